@@ -25,7 +25,7 @@ from src.customers.models import Customer
 from src.suppliers.models import Supplier
 from src.items.models import Item
 from src.buy_invoices.models import BuyInvoice, BuyInvoiceLine
-from src.sale_invoices.models import SaleInvoice, SaleInvoiceLine
+from src.sale_invoices.models import SaleInvoice, SaleInvoiceLine, SaleInvoiceSubmission
 from src.organizations.models import Organization
 from src.branches.models import Branch
 from src.authorization.models import Permission, UserPermission, Role, RolePermission, UserBranch
@@ -0,0 +1,123 @@
+"""Time of generating the keys and CSRs of many branches onboarded at once, and how long they block the event loop.
+
+Every branch takes a private key, builds and signs its CSR, then waits --zatca-latency seconds standing in for the
+compliance CSID request, nothing is sent over the network. --concurrency branches are onboarded at the same time
+while a ticker task measures how late the event loop wakes it up. The modes are:
+    inline    the key is generated and the CSR built on the event loop
+    thread    the key is generated and the CSR built on a worker thread, without the key pool
+    pooled    the key is taken from a key pool filled before the run and the CSR built on a worker thread
+Every CSR is parsed back and its signature verified.
+
+Run from the repository root:
+    python -m benchmarks.bulk_onboarding
+    python -m benchmarks.bulk_onboarding --branches 500 --concurrency 50 --modes inline pooled
+"""
+import argparse
+import asyncio
+import base64
+import time
+from types import SimpleNamespace
+from cryptography import x509
+from src.tax_authorities.zatca_phase2.utils.csr_generator import csr_generator, key_pool
+
+MODES = ("inline", "thread", "pooled")
+ASN_TEMPLATE = "TSTZATCA-Code-Signing"
+# Interval of the ticker measuring the event loop lag
+TICK = 0.001
+
+
+def make_branch(number: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        country_code="SA",
+        organization_unit_name=f"Branch {number}",
+        organization_name="Wasel Benchmark",
+        common_name=f"EGS-{number}",
+        vat_number="399999999900003",
+        invoicing_type="1100",
+        address="Riyadh",
+        business_category="Supply activities",
+    )
+
+
+def percentile(sorted_timings: list[float], fraction: float) -> float:
+    return sorted_timings[min(len(sorted_timings) - 1, int(len(sorted_timings) * fraction))]
+
+
+async def onboard(branch: SimpleNamespace, mode: str, zatca_latency: float) -> tuple[str, float]:
+    started_at = time.perf_counter()
+    if mode == "inline":
+        _, csr_base64 = csr_generator.generate(branch, ASN_TEMPLATE)
+    else:
+        _, csr_base64 = await csr_generator.generate_async(branch, ASN_TEMPLATE)
+    await asyncio.sleep(zatca_latency)
+    return csr_base64, time.perf_counter() - started_at
+
+
+async def measure_lag(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started_at - TICK)
+
+
+async def run(mode: str, branches: int, concurrency: int, zatca_latency: float) -> dict:
+    if mode != "pooled":
+        key_pool.configure(0)
+    else:
+        key_pool.configure(branches)
+        key_pool.fill()
+    semaphore = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+    lags = []
+
+    async def limited(number: int):
+        async with semaphore:
+            return await onboard(make_branch(number), mode, zatca_latency)
+
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*(limited(number) for number in range(branches)))
+    elapsed = time.perf_counter() - started_at
+    stop.set()
+    await ticker
+    key_pool.clear()
+
+    invalid = 0
+    for csr_base64, _ in results:
+        csr = x509.load_pem_x509_csr(base64.b64decode(csr_base64))
+        invalid += not csr.is_signature_valid
+    latencies = sorted(latency for _, latency in results)
+    lags.sort()
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "branches_per_second": branches / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "max_lag": lags[-1] if lags else 0.0,
+        "p99_lag": percentile(lags, 0.99) if lags else 0.0,
+        "invalid": invalid,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--branches", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--zatca-latency", type=float, default=0.05, help="seconds each compliance CSID request takes")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    print(f"{args.branches} branches, {args.concurrency} at a time, {args.zatca_latency * 1000:.0f} ms per CSID request")
+    print(f"{'mode':<8} {'total s':>8} {'branch/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'loop lag p99 ms':>16} {'max ms':>8} {'invalid':>8}")
+    for mode in args.modes:
+        result = asyncio.run(run(mode, args.branches, args.concurrency, args.zatca_latency))
+        print(
+            f"{result['mode']:<8} {result['elapsed']:>8.3f} {result['branches_per_second']:>9.1f} "
+            f"{result['p50'] * 1000:>8.2f} {result['p99'] * 1000:>8.2f} "
+            f"{result['p99_lag'] * 1000:>16.3f} {result['max_lag'] * 1000:>8.3f} {result['invalid']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
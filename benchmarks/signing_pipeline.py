@@ -0,0 +1,218 @@
+"""Time of every stage of the signing pipeline, for standard and simplified invoices of growing size.
+
+Signs with the bundled test certificate in zatca_phase2/utils/resources, nothing is sent over the network. Every
+(invoice type, lines) case runs in a fresh interpreter so its peak resident memory can be reported on its own.
+Results are written to a JSON file, pass an earlier one to --compare to see how the p50 of every stage moved.
+
+Run from the repository root:
+    python -m benchmarks.signing_pipeline
+    python -m benchmarks.signing_pipeline --lines 1 100 --types simplified --stages ecdsa qr end_to_end
+    python -m benchmarks.signing_pipeline --compare benchmarks/results/signing_pipeline-20260101-120000.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from lxml import etree
+from scripts.invoice_corpus import make_invoice
+from src.tax_authorities.zatca_phase2.utils.einvoice_signer import einvoice_signer
+from src.tax_authorities.zatca_phase2.utils.invoice_helper import invoice_helper
+from src.tax_authorities.zatca_phase2.utils.qr_code_generator import qr_code_generator
+from src.tax_authorities.zatca_phase2.utils.resource_registry import resource_registry
+from src.tax_authorities.zatca_phase2.utils.xml_generator import xml_generator
+
+RESOURCES = os.path.join("src", "tax_authorities", "zatca_phase2", "utils", "resources")
+RESULTS = os.path.join("benchmarks", "results")
+INVOICE_TYPES = {"standard": "0100000", "simplified": "0200000"}
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+STAGES = (
+    "template_fill",
+    "pretty_print",
+    "xslt",
+    "c14n",
+    "prune_c14n",
+    "hash",
+    "signed_properties",
+    "ecdsa",
+    "qr",
+    "base64",
+    "end_to_end",
+)
+
+
+def load_signing_material():
+    with open(os.path.join(RESOURCES, "certificate.pem")) as f:
+        certificate = f.read().strip()
+    with open(os.path.join(RESOURCES, "privatekey.pem")) as f:
+        private_key = f.read().strip()
+    return invoice_helper.get_signing_material(None, private_key, certificate)
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_stages(invoice_data: dict, signing_material) -> dict:
+    """Returns, for every stage, a function running that stage alone on inputs prepared beforehand.
+    A stage that needs a fresh input on every call gets a (setup, run) pair instead."""
+    root = xml_generator.generate_xml_invoice_tree(invoice_data)
+    canonical_xml = einvoice_signer.canonicalize_pruned_xml(root)
+    base64_hash = einvoice_signer.generate_base64_hash(canonical_xml)
+    timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    signed_properties_hash = einvoice_signer.get_signed_properties_hash(timestamp, signing_material.public_key_hashing, signing_material.issuer_name, signing_material.serial_number)
+    signature_value = einvoice_signer.get_digital_signature(base64_hash, signing_material.private_key)
+    qr_details = qr_code_generator.get_invoice_details_from_tree(root)
+    qr_code = qr_code_generator.generate_qr_code(canonical_xml, base64_hash, signature_value, signing_material.ecdsa_result, qr_details)
+    ubl_content = einvoice_signer.populate_ubl_template(base64_hash, signed_properties_hash, signature_value, signing_material.certificate_content, timestamp, signing_material.public_key_hashing, signing_material.issuer_name, signing_material.serial_number)
+    signature_content = resource_registry.get_signature_template().replace("BASE64_QRCODE", qr_code)
+    if einvoice_signer.is_simplified_invoice(root):
+        encode = lambda: einvoice_signer.assemble_signed_invoice(f"{XML_DECLARATION}\n", canonical_xml, ubl_content, signature_content)
+    else:
+        encode = lambda: einvoice_signer.encode_invoice(XML_DECLARATION, canonical_xml)
+    return {
+        "template_fill": lambda: xml_generator.build_xml_invoice(invoice_data, normalize=True),
+        "pretty_print": (
+            lambda: xml_generator.build_xml_invoice(invoice_data, normalize=True).getroot(),
+            lambda tree: etree.indent(tree, space="\t"),
+        ),
+        "xslt": lambda: einvoice_signer.transform_xml(root),
+        "c14n": lambda: einvoice_signer.canonicalize_xml(root),
+        "prune_c14n": lambda: einvoice_signer.canonicalize_pruned_xml(root),
+        "hash": lambda: einvoice_signer.generate_base64_hash(canonical_xml),
+        "signed_properties": lambda: einvoice_signer.get_signed_properties_hash(timestamp, signing_material.public_key_hashing, signing_material.issuer_name, signing_material.serial_number),
+        "ecdsa": lambda: einvoice_signer.get_digital_signature(base64_hash, signing_material.private_key),
+        "qr": lambda: qr_code_generator.generate_qr_code(canonical_xml, base64_hash, signature_value, signing_material.ecdsa_result, qr_details),
+        "base64": encode,
+        "end_to_end": lambda: invoice_helper.sign_and_get_request(invoice_data, signing_material),
+    }
+
+
+def time_stage(stage, min_time: float, min_iterations: int, max_iterations: int) -> list[float]:
+    """Runs the stage until it took min_time seconds and ran at least min_iterations times"""
+    setup, run = stage if isinstance(stage, tuple) else (None, stage)
+    timings = []
+    total = 0.0
+    while len(timings) < max_iterations and (len(timings) < min_iterations or total < min_time):
+        argument = setup() if setup is not None else None
+        started_at = time.perf_counter()
+        if setup is not None:
+            run(argument)
+        else:
+            run()
+        elapsed = time.perf_counter() - started_at
+        timings.append(elapsed)
+        total += elapsed
+    return timings
+
+
+def percentile(sorted_timings: list[float], fraction: float) -> float:
+    return sorted_timings[min(len(sorted_timings) - 1, int(fraction * len(sorted_timings)))]
+
+
+def summarize(timings: list[float]) -> dict:
+    sorted_timings = sorted(timings)
+    mean = sum(timings) / len(timings)
+    return {
+        "iterations": len(timings),
+        "ops_per_sec": 1 / mean if mean else None,
+        "mean_ms": mean * 1000,
+        "p50_ms": percentile(sorted_timings, 0.50) * 1000,
+        "p99_ms": percentile(sorted_timings, 0.99) * 1000,
+    }
+
+
+def run(invoice_type: str, lines: int, stages: list[str], min_time: float, min_iterations: int, max_iterations: int) -> dict:
+    """Benchmarks one case in the current interpreter"""
+    signing_material = load_signing_material()
+    invoice_data = make_invoice(lines, INVOICE_TYPES[invoice_type])
+    baseline = peak_rss_mib()
+    stage_functions = build_stages(invoice_data, signing_material)
+    results = {}
+    for name in stages:
+        results[name] = summarize(time_stage(stage_functions[name], min_time, min_iterations, max_iterations))
+    peak = peak_rss_mib()
+    return {
+        "invoice_type": invoice_type,
+        "lines": lines,
+        "peak_rss_mib": peak,
+        "peak_rss_growth_mib": peak - baseline,
+        "stages": results,
+    }
+
+
+def measure(invoice_type: str, lines: int, args: argparse.Namespace) -> dict:
+    command = [
+        sys.executable, "-m", "benchmarks.signing_pipeline", "--run", invoice_type, str(lines),
+        "--stages", *args.stages,
+        "--min-time", str(args.min_time), "--min-iterations", str(args.min_iterations), "--max-iterations", str(args.max_iterations),
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def compare(results: dict, previous_path: str) -> None:
+    """Prints the p50 of every stage next to the one of an earlier run, as the ratio new / old"""
+    with open(previous_path) as f:
+        previous = {(case["invoice_type"], case["lines"]): case for case in json.load(f)["cases"]}
+    print(f"\ncompared with {previous_path} (p50 ms, new / old)")
+    for case in results["cases"]:
+        old_case = previous.get((case["invoice_type"], case["lines"]))
+        if old_case is None:
+            continue
+        for name, stage in case["stages"].items():
+            old_stage = old_case["stages"].get(name)
+            if old_stage is None or not old_stage["p50_ms"]:
+                continue
+            ratio = stage["p50_ms"] / old_stage["p50_ms"]
+            print(f"{case['invoice_type']:>10} {case['lines']:>6} {name:<18} {old_stage['p50_ms']:>10.3f} {stage['p50_ms']:>10.3f} {ratio:>7.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--types", nargs="+", choices=list(INVOICE_TYPES), default=list(INVOICE_TYPES))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds each stage runs for at least")
+    parser.add_argument("--min-iterations", type=int, default=5)
+    parser.add_argument("--max-iterations", type=int, default=10000)
+    parser.add_argument("--output", help="where to write the results, a timestamped file in benchmarks/results by default")
+    parser.add_argument("--compare", metavar="RESULTS", help="an earlier results file to compare with")
+    parser.add_argument("--run", nargs=2, metavar=("TYPE", "LINES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        print(json.dumps(run(args.run[0], int(args.run[1]), args.stages, args.min_time, args.min_iterations, args.max_iterations)))
+        return
+
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "lxml": ".".join(str(part) for part in etree.LXML_VERSION),
+        "machine": platform.platform(),
+        "cases": [],
+    }
+    print(f"{'type':>10} {'lines':>6} {'stage':<18} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for invoice_type in args.types:
+        for lines in args.lines:
+            case = measure(invoice_type, lines, args)
+            results["cases"].append(case)
+            for name, stage in case["stages"].items():
+                print(f"{invoice_type:>10} {lines:>6} {name:<18} {stage['ops_per_sec']:>10.1f} {stage['p50_ms']:>10.3f} {stage['p99_ms']:>10.3f}")
+            print(f"{invoice_type:>10} {lines:>6} {'peak rss MiB':<18} {case['peak_rss_mib']:>10.1f}", flush=True)
+
+    output = args.output or os.path.join(RESULTS, f"signing_pipeline-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Peak memory of the in-memory and the streaming invoice generation as the number of lines grows.
+
+Every measurement runs in a fresh interpreter and reports how far the peak resident memory rose above what the
+interpreter, the imports and the invoice data already used, so the memory held by lxml is counted as well.
+
+Run from the repository root:
+    python -m benchmarks.streaming_memory
+    python -m benchmarks.streaming_memory --lines 10 1000 50000 --skip-in-memory
+"""
+import argparse
+import copy
+import json
+import resource
+import subprocess
+import sys
+import time
+from src.tax_authorities.zatca_phase2.utils.invoice_helper import invoice_helper
+from src.tax_authorities.zatca_phase2.utils.invoice_streamer import invoice_streamer
+from src.tax_authorities.zatca_phase2.utils.templates.invoice_data import invoice_data_template
+
+
+class discarding_output:
+    """Counts what is written to it and drops it, so only the generator's own memory is measured"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+
+
+def make_invoice(lines: int) -> dict:
+    """A standard invoice with the given number of identical lines"""
+    invoice_data = copy.deepcopy(invoice_data_template)
+    invoice_data["invoice_type"] = "0100000"
+    line = invoice_data["invoice_lines"][0]
+    invoice_data["invoice_lines"] = [dict(line, id=str(i + 1)) for i in range(lines)]
+    return invoice_data
+
+
+def peak_memory_mib() -> float:
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(mode: str, lines: int) -> dict:
+    """Generates one invoice and returns the time it took and how much the peak memory grew"""
+    invoice_data = make_invoice(lines)
+    baseline = peak_memory_mib()
+    started_at = time.perf_counter()
+    if mode == "stream":
+        invoice_streamer.write_invoice(invoice_data, None, discarding_output())
+    else:
+        invoice_helper.sign_and_get_request(invoice_data, None)
+    elapsed = time.perf_counter() - started_at
+    return {"seconds": elapsed, "peak_mib": peak_memory_mib() - baseline}
+
+
+def measure(mode: str, lines: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.streaming_memory", "--run", mode, str(lines)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10, 100, 1000, 10000, 50000])
+    parser.add_argument("--skip-in-memory", action="store_true", help="only measure the streaming generation")
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "LINES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        print(json.dumps(run(args.run[0], int(args.run[1]))))
+        return
+
+    print(f"{'lines':>8} {'stream s':>10} {'stream MiB':>11} {'memory s':>10} {'memory MiB':>11}")
+    for lines in args.lines:
+        stream = measure("stream", lines)
+        row = f"{lines:>8} {stream['seconds']:>10.3f} {stream['peak_mib']:>11.2f}"
+        if not args.skip_in_memory:
+            memory = measure("memory", lines)
+            row += f" {memory['seconds']:>10.3f} {memory['peak_mib']:>11.2f}"
+        print(row, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Fills in the QR code and hash of the stored ZATCA invoices that are missing them, read from their signed XML.
+
+Works through zatca_phase2_sale_invoice_data in batches ordered by id, committing after every batch, so it can be
+stopped and resumed from the last id it printed. Needs the same environment as the application.
+
+Run from the repository root:
+    python -m scripts.backfill_invoice_data
+    python -m scripts.backfill_invoice_data --batch-size 1000 --after-id 250000
+"""
+import argparse
+import asyncio
+from src.core.database import async_session, engine
+# Imports every router and with them every model, so the relationships between models resolve as in the app
+import src.core.routers
+from src.tax_authorities.zatca_phase2.repositories import ZatcaRepository
+from src.tax_authorities.zatca_phase2.services import ZatcaPhase2Service
+from src.tax_authorities.zatca_phase2.utils.signing_executor import signing_executor
+
+
+async def backfill(after_id: int, batch_size: int) -> None:
+    updated = 0
+    try:
+        async with async_session() as session:
+            # Only the repository is used while backfilling
+            service = ZatcaPhase2Service(ZatcaRepository(session), None, None, None, None)
+            while True:
+                async with session.begin():
+                    last_id, batch_updated = await service.backfill_invoices_tax_authority_data(after_id, batch_size)
+                if last_id == after_id:
+                    break
+                after_id = last_id
+                updated += batch_updated
+                print(f"up to id {after_id}: {updated} invoices updated", flush=True)
+    finally:
+        signing_executor.shutdown()
+        await engine.dispose()
+    print(f"done, {updated} invoices updated")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--after-id", type=int, default=0, help="resume after this id")
+    parser.add_argument("--batch-size", type=int, default=ZatcaPhase2Service.BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.after_id, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
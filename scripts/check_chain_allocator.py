@@ -0,0 +1,157 @@
+"""Checks that invoices signed at the same time for one branch still form a single ICV/PIH chain.
+
+Every invoice is signed in a transaction of its own, the way the submission workers do it: it reserves the next
+slot of the chain, waits up to --signing-time seconds standing in for the signing, moves the chain forward to the
+hash of its (icv, pih) and commits. --failure-rate of them fail after signing and roll back. Once all are done the
+committed invoices must have the ICVs 1 to n without duplicates or gaps, and the PIH of each must be the hash of
+the one before it. The modes are:
+    locked    the slot is reserved with ZatcaRepository.lock_chain(), as ZatcaPhase2Service does
+    unlocked  the ICV and PIH are read with plain selects, as they were before, to show what goes wrong
+The unlocked mode is expected to give duplicates and gaps, so only the results of the locked mode can fail the check.
+
+Needs the database of the application. A chain of its own is created for the branch under a throwaway stage for
+every mode and deleted at the end, the chains of the branch are left untouched.
+
+Run from the repository root:
+    python -m scripts.check_chain_allocator --organization-id 1 --branch-id 1
+    python -m scripts.check_chain_allocator --organization-id 1 --branch-id 1 --invoices 2000 --concurrency 100
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+import sys
+import time
+import uuid
+from sqlalchemy import delete
+from src.core.database import async_session, engine
+# Imports every router and with them every model, so the relationships between models resolve as in the app
+import src.core.routers
+from src.tax_authorities.zatca_phase2.models import ZatcaPhase2BranchData
+from src.tax_authorities.zatca_phase2.repositories import ZatcaRepository
+from src.tax_authorities.zatca_phase2.services import ZatcaPhase2Service
+
+MODES = ("locked", "unlocked")
+
+
+class SigningFailed(Exception):
+    pass
+
+
+def hash_invoice(icv: int, pih: str) -> str:
+    """Stands in for the hash of the invoice signed in the slot"""
+    return base64.b64encode(hashlib.sha256(f"{icv}|{pih}".encode()).digest()).decode()
+
+
+async def sign(mode: str, organization_id: int, branch_id: int, stage: str, signing_time: float, failure_rate: float) -> tuple[int, str, str] | None:
+    """Signs one invoice, returns its (icv, pih, invoice_hash) once committed or None when it rolled back"""
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                repo = ZatcaRepository(session)
+                if mode == "locked":
+                    icv, pih = await repo.lock_chain(organization_id, branch_id, stage)
+                else:
+                    icv = await repo.get_icv(organization_id, branch_id, stage)
+                    pih = await repo.get_pih(organization_id, branch_id, stage)
+                icv, pih = (icv or 0) + 1, pih or ZatcaPhase2Service.INITIAL_PIH
+                await asyncio.sleep(random.uniform(0, signing_time))
+                invoice_hash = hash_invoice(icv, pih)
+                if random.random() < failure_rate:
+                    raise SigningFailed()
+                await repo.update_pih_and_icv(organization_id, branch_id, stage, icv, invoice_hash)
+        return icv, pih, invoice_hash
+    except SigningFailed:
+        return None
+
+
+def check_chain(signed: list[tuple[int, str, str]], head: tuple[int | None, str | None]) -> dict[str, int]:
+    """Counts what breaks the chain made of the committed invoices, all zeros for a valid chain"""
+    by_icv = {}
+    for icv, pih, invoice_hash in signed:
+        by_icv.setdefault(icv, []).append((pih, invoice_hash))
+    errors = {
+        "duplicates": sum(len(invoices) - 1 for invoices in by_icv.values()),
+        "gaps": len(set(range(1, max(by_icv, default=0) + 1)) - set(by_icv)),
+        "broken_links": 0,
+        "wrong_head": 0,
+    }
+    previous_hash = ZatcaPhase2Service.INITIAL_PIH
+    for icv in sorted(by_icv):
+        pih, invoice_hash = by_icv[icv][0]
+        errors["broken_links"] += pih != previous_hash
+        previous_hash = invoice_hash
+    errors["wrong_head"] = int(head != (max(by_icv, default=None), previous_hash if by_icv else None))
+    return errors
+
+
+async def run(mode: str, organization_id: int, branch_id: int, invoices: int, concurrency: int, signing_time: float, failure_rate: float) -> dict:
+    stage = f"CHAIN-CHECK-{uuid.uuid4().hex[:8]}"
+    async with async_session() as session:
+        async with session.begin():
+            session.add(ZatcaPhase2BranchData(organization_id=organization_id, branch_id=branch_id, stage=stage, country_code="SA"))
+    try:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                return await sign(mode, organization_id, branch_id, stage, signing_time, failure_rate)
+
+        started_at = time.perf_counter()
+        results = await asyncio.gather(*(limited() for _ in range(invoices)))
+        elapsed = time.perf_counter() - started_at
+        async with async_session() as session:
+            repo = ZatcaRepository(session)
+            head = (await repo.get_icv(organization_id, branch_id, stage), await repo.get_pih(organization_id, branch_id, stage))
+    finally:
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(delete(ZatcaPhase2BranchData).where(ZatcaPhase2BranchData.stage == stage))
+    signed = [result for result in results if result is not None]
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "invoices_per_second": invoices / elapsed,
+        "committed": len(signed),
+        "rolled_back": invoices - len(signed),
+        **check_chain(signed, head),
+    }
+
+
+async def main_async(args: argparse.Namespace) -> bool:
+    valid = True
+    try:
+        for mode in args.modes:
+            result = await run(mode, args.organization_id, args.branch_id, args.invoices, args.concurrency, args.signing_time, args.failure_rate)
+            print(
+                f"{result['mode']:<9} {result['elapsed']:>8.3f} {result['invoices_per_second']:>10.1f} "
+                f"{result['committed']:>10} {result['rolled_back']:>12} {result['duplicates']:>11} {result['gaps']:>6} "
+                f"{result['broken_links']:>13} {result['wrong_head']:>11}"
+            )
+            if mode == "locked":
+                valid = valid and not any(result[key] for key in ("duplicates", "gaps", "broken_links", "wrong_head"))
+    finally:
+        await engine.dispose()
+    return valid
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--organization-id", type=int, required=True)
+    parser.add_argument("--branch-id", type=int, required=True, help="a branch of the organization, its chains are not touched")
+    parser.add_argument("--invoices", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50, help="invoices signed at the same time")
+    parser.add_argument("--signing-time", type=float, default=0.005, help="longest seconds the signing of an invoice takes")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="fraction of the invoices that roll back after signing")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    print(f"{args.invoices} invoices, {args.concurrency} at a time, {args.failure_rate:.0%} rolled back")
+    print(f"{'mode':<9} {'total s':>8} {'invoice/s':>10} {'committed':>10} {'rolled back':>12} {'duplicates':>11} {'gaps':>6} {'broken links':>13} {'wrong head':>11}")
+    valid = asyncio.run(main_async(args))
+    sys.exit(0 if valid else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Checks that the pruning hash path of einvoice_signer gives the same canonical form as the XSLT.
+
+Every invoice of the corpus is compared unsigned, and again once signed, since only signed invoices carry the
+UBL extensions, the signature and the QR code the two paths have to drop.
+
+Run from the repository root:
+    python -m scripts.check_hash_transform
+"""
+import base64
+import os
+import sys
+from lxml import etree
+from scripts.invoice_corpus import iter_corpus
+from src.tax_authorities.zatca_phase2.utils.einvoice_signer import einvoice_signer
+from src.tax_authorities.zatca_phase2.utils.invoice_helper import invoice_helper
+from src.tax_authorities.zatca_phase2.utils.xml_generator import xml_generator
+
+RESOURCES = os.path.join("src", "tax_authorities", "zatca_phase2", "utils", "resources")
+
+# Shapes the generator never produces but the XSLT handles, each one wrapped around a signed invoice
+EDGE_CASES = {
+    "qr-id-with-spaces": lambda xml: xml.replace(b"<cbc:ID>QR</cbc:ID>", b"<cbc:ID>  QR\n</cbc:ID>"),
+    "comment-before-signature": lambda xml: xml.replace(b"<cac:Signature>", b"<!-- signed --><cac:Signature>"),
+    "no-whitespace-around-signature": lambda xml: xml.replace(b"</cac:AdditionalDocumentReference>\n", b"</cac:AdditionalDocumentReference>"),
+    "other-document-reference": lambda xml: xml.replace(b"<cbc:ID>QR</cbc:ID>", b"<cbc:ID>QRX</cbc:ID>"),
+}
+
+
+def compare(name: str, xml) -> bool:
+    by_xslt = einvoice_signer.canonicalize_xml(einvoice_signer.transform_xml(xml))
+    by_pruning = einvoice_signer.canonicalize_pruned_xml(xml)
+    if by_xslt != by_pruning:
+        print(f"MISMATCH {name}")
+        return False
+    return True
+
+
+def main() -> None:
+    with open(os.path.join(RESOURCES, "certificate.pem")) as f:
+        certificate = f.read().strip()
+    with open(os.path.join(RESOURCES, "privatekey.pem")) as f:
+        private_key = f.read().strip()
+    signing_material = invoice_helper.get_signing_material(None, private_key, certificate)
+
+    checked = 0
+    failed = 0
+    for name, invoice_data in iter_corpus():
+        cases = {name: xml_generator.generate_xml_invoice_tree(invoice_data)}
+        signed_xml = base64.b64decode(invoice_helper.sign_and_get_request(invoice_data, signing_material)["invoice"])
+        cases[f"{name}-signed"] = etree.fromstring(signed_xml)
+        if invoice_data["invoice_type"] == "0200000":
+            for edge_case, change in EDGE_CASES.items():
+                cases[f"{name}-signed-{edge_case}"] = etree.fromstring(change(signed_xml))
+        for case_name, xml in cases.items():
+            checked += 1
+            failed += not compare(case_name, xml)
+    print(f"{checked} invoices checked, {failed} mismatches")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Signs the invoice corpus through every signing pipeline and checks they all produce the same invoices.
+
+The reference pipeline signs the pretty printed invoice string and hashes it through the XSLT. The other pipelines
+are the fast paths: the indented tree hashed by pruning, the batch signer and the streaming writer. For every invoice
+of scripts/invoice_corpus.py, the signed XML, the invoiceHash and the QR code fields of each pipeline are compared
+with the reference, and the reference itself with the golden results in scripts/golden/signed_invoices.json.
+
+All the pipelines build the invoice with the current xml_generator, so they cannot catch a change of the invoice
+itself. The golden results can: they were recorded with the xml_generator and einvoice_signer of commit 2c2b94c,
+before the template caching and filling were reworked. Record them again only after an intended change of the
+signed output.
+
+Every invoice is signed at SIGNATURE_TIMESTAMP. The ECDSA nonce is still random, so signatures are verified
+against the certificate instead of compared, and masked out of the XML and the QR code.
+
+Run from the repository root:
+    python -m scripts.check_signed_output
+    python -m scripts.check_signed_output --pipelines tree stream
+    python -m scripts.check_signed_output --record    # after an intended change of the signed output
+"""
+import argparse
+import base64
+import difflib
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+from lxml import etree
+from scripts.invoice_corpus import iter_corpus
+from src.tax_authorities.zatca_phase2.utils.einvoice_signer import einvoice_signer
+from src.tax_authorities.zatca_phase2.utils.invoice_helper import invoice_helper
+from src.tax_authorities.zatca_phase2.utils.invoice_streamer import invoice_streamer
+from src.tax_authorities.zatca_phase2.utils.qr_code_generator import qr_code_generator
+from src.tax_authorities.zatca_phase2.utils.xml_generator import xml_generator
+
+RESOURCES = os.path.join("src", "tax_authorities", "zatca_phase2", "utils", "resources")
+GOLDEN = os.path.join("scripts", "golden", "signed_invoices.json")
+SIGNATURE_VALUE = re.compile(r"<ds:SignatureValue>([^<]*)</ds:SignatureValue>")
+# QR tags holding bytes rather than text: the public key and the signature of the certificate
+BINARY_QR_TAGS = (8, 9)
+QR_SIGNATURE_TAG = 7
+# Signing time of every invoice, so the same invoice always gives the same output
+SIGNATURE_TIMESTAMP = "2026-01-01T00:00:00"
+
+
+def sign_reference(invoice_data: dict, signing_material) -> dict:
+    xml = etree.fromstring(xml_generator.generate_xml_invoice(invoice_data).encode('utf-8'))
+    previous = einvoice_signer.HASH_WITH_XSLT
+    einvoice_signer.HASH_WITH_XSLT = True
+    try:
+        return einvoice_signer.get_request_api(xml, signing_material, SIGNATURE_TIMESTAMP).to_request()
+    finally:
+        einvoice_signer.HASH_WITH_XSLT = previous
+
+
+def sign_tree(invoice_data: dict, signing_material) -> dict:
+    return invoice_helper.sign_and_get_request(invoice_data, signing_material, signature_timestamp=SIGNATURE_TIMESTAMP)
+
+
+def sign_batch(invoice_data: dict, signing_material) -> dict:
+    return invoice_helper.sign_batch([invoice_data], signing_material, invoice_data["pih"], int(invoice_data["icv"]), signature_timestamp=SIGNATURE_TIMESTAMP)[0]
+
+
+def sign_stream(invoice_data: dict, signing_material) -> dict:
+    output = io.BytesIO()
+    signed_invoice = invoice_streamer.write_invoice(invoice_data, signing_material, output, SIGNATURE_TIMESTAMP)
+    return dict(signed_invoice.to_request(), invoice=output.getvalue().decode())
+
+
+PIPELINES = {
+    "reference": sign_reference,
+    "tree": sign_tree,
+    "batch": sign_batch,
+    "stream": sign_stream,
+}
+
+
+def normalize(request: dict, signing_material) -> dict:
+    """The comparable parts of an invoice request, with the random parts of the signature masked out"""
+    xml = base64.b64decode(request["invoice"]).decode('utf-8')
+    result = {"invoice_hash": request["invoiceHash"], "uuid": request["uuid"], "qr": None, "signature_valid": None}
+    match = SIGNATURE_VALUE.search(xml)
+    if match is not None:
+        signature_value = match.group(1)
+        result["signature_valid"] = einvoice_signer.verify_digital_signature(request["invoiceHash"], signature_value, signing_material.certificate)
+        qr_code = xml_generator.extract_base64_qr_code(xml.encode('utf-8'))
+        fields = qr_code_generator.read_tlv(qr_code)
+        result["signature_valid"] = result["signature_valid"] and fields.pop(QR_SIGNATURE_TAG).decode() == signature_value
+        result["qr"] = {
+            str(tag): value.hex() if tag in BINARY_QR_TAGS else value.decode('utf-8') for tag, value in fields.items()
+        }
+        xml = xml.replace(signature_value, "SIGNATURE_VALUE").replace(qr_code, "QR_CODE")
+    result["xml"] = xml
+    return result
+
+
+def to_golden(result: dict) -> dict:
+    return {
+        "invoice_hash": result["invoice_hash"],
+        "xml_sha256": hashlib.sha256(result["xml"].encode('utf-8')).hexdigest(),
+        "qr": result["qr"],
+    }
+
+
+def diff(name: str, expected: dict, actual: dict) -> list[str]:
+    """Describes every field in which actual differs from expected"""
+    problems = []
+    for field in expected:
+        if expected[field] == actual.get(field):
+            continue
+        if field == "xml":
+            lines = difflib.unified_diff(expected["xml"].splitlines(), actual["xml"].splitlines(), "expected", name, n=1, lineterm="")
+            problems.append("xml differs:\n" + "\n".join(list(lines)[:20]))
+        elif isinstance(expected[field], dict) and isinstance(actual.get(field), dict):
+            for key in sorted(expected[field].keys() | actual[field].keys()):
+                if expected[field].get(key) != actual[field].get(key):
+                    problems.append(f"{field} {key} differs: expected {expected[field].get(key)!r}, got {actual[field].get(key)!r}")
+        else:
+            problems.append(f"{field} differs: expected {expected[field]!r}, got {actual.get(field)!r}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", nargs="+", choices=[name for name in PIPELINES if name != "reference"], default=[name for name in PIPELINES if name != "reference"])
+    parser.add_argument("--golden", default=GOLDEN)
+    parser.add_argument("--record", action="store_true", help="write the golden results from the reference pipeline")
+    args = parser.parse_args()
+
+    with open(os.path.join(RESOURCES, "certificate.pem")) as f:
+        certificate = f.read().strip()
+    with open(os.path.join(RESOURCES, "privatekey.pem")) as f:
+        private_key = f.read().strip()
+    signing_material = invoice_helper.get_signing_material(None, private_key, certificate)
+    golden = {}
+    if not args.record and os.path.exists(args.golden):
+        with open(args.golden) as f:
+            golden = json.load(f)
+
+    recorded = {}
+    checked = 0
+    failed = 0
+    for name, invoice_data in iter_corpus():
+        reference = normalize(sign_reference(invoice_data, signing_material), signing_material)
+        problems = []
+        if reference["signature_valid"] is False:
+            problems.append("reference: signature does not verify")
+        recorded[name] = to_golden(reference)
+        if name in golden:
+            problems += [f"reference against golden: {problem}" for problem in diff("reference", golden[name], recorded[name])]
+        for pipeline in args.pipelines:
+            result = normalize(PIPELINES[pipeline](invoice_data, signing_material), signing_material)
+            if result["signature_valid"] is False:
+                problems.append(f"{pipeline}: signature does not verify")
+            comparable = {field: value for field, value in reference.items() if field != "signature_valid"}
+            problems += [f"{pipeline}: {problem}" for problem in diff(pipeline, comparable, result)]
+        checked += 1
+        if problems:
+            failed += 1
+            print(f"MISMATCH {name}")
+            for problem in problems:
+                print(f"  {problem}")
+
+    if args.record:
+        os.makedirs(os.path.dirname(args.golden), exist_ok=True)
+        with open(args.golden, "w") as f:
+            json.dump(recorded, f, indent=2, sort_keys=True)
+        print(f"golden results of {len(recorded)} invoices written to {args.golden}")
+    elif not golden:
+        print(f"no golden results in {args.golden}, only the pipelines were compared")
+    print(f"{checked} invoices checked against {', '.join(args.pipelines)}, {failed} with mismatches")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
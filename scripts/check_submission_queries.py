@@ -0,0 +1,129 @@
+"""Checks that signing an invoice for Zatca takes the same number of queries whatever the number of its lines.
+
+Signs every given invoice with ZatcaPhase2Service.sign_invoice(), as the submission workers do, and counts the
+statements sent to the database while it runs. The invoice is read beforehand through another service, so the
+repository doing the signing starts with nothing read and every line data it needs is a statement it sends. Each
+invoice is signed in a transaction that is rolled back, nothing is stored and the chains are left as they were.
+Give invoices with different numbers of lines: the check fails unless they all take the same number of statements.
+
+Needs the database of the application, with a branch of an organization using Zatca phase 2 that can sign invoices
+and some of its issued invoices.
+
+Run from the repository root:
+    python -m scripts.check_submission_queries --user-id 1 --organization-id 1 --branch-id 1 --invoice-ids 10 11 12
+    python -m scripts.check_submission_queries --user-id 1 --organization-id 1 --branch-id 1 --invoice-ids 10 11 --verbose
+"""
+import argparse
+import asyncio
+import sys
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.core.database import async_session, engine
+# Imports every router and with them every model, so the relationships between models resolve as in the app
+import src.core.routers
+from src.core.schemas.context import RequestContext
+from src.branches.repositories import BranchRepository
+from src.branches.schemas import BranchOut
+from src.customers.repositories import CustomerRepository
+from src.customers.services import CustomerService
+from src.items.repositories import ItemRepository
+from src.items.services import ItemService
+from src.organizations.repositories import OrganizationRepository
+from src.organizations.schemas import OrganizationOut
+from src.users.repositories import UserRepository
+from src.users.schemas import UserOut
+from src.sale_invoices.repositories import SaleInvoiceRepository
+from src.sale_invoices.services.full_service import SaleInvoiceService
+from src.sale_invoices.services.raw_service import SaleInvoiceServiceRaw
+from src.tax_authorities.zatca_phase2.repositories import ZatcaRepository
+from src.tax_authorities.zatca_phase2.services import ZatcaPhase2Service
+from src.tax_authorities.zatca_phase2.utils.signing_executor import signing_executor
+
+
+async def get_context(session: AsyncSession, user_id: int, organization_id: int, branch_id: int) -> RequestContext:
+    user = await UserRepository(session).get(user_id)
+    organization = await OrganizationRepository(session).get(organization_id)
+    branch = await BranchRepository(session).get_branch(organization_id, branch_id)
+    if user is None or organization is None or branch is None:
+        raise SystemExit("The user, organization or branch was not found")
+    return RequestContext(
+        user=UserOut.model_validate(user),
+        organization=OrganizationOut.model_validate(organization),
+        branch=BranchOut.model_validate(branch),
+    )
+
+
+def get_zatca_service(session: AsyncSession) -> ZatcaPhase2Service:
+    """A service with a repository of its own, which has read nothing yet"""
+    item_service = ItemService(ItemRepository(session))
+    customer_service = CustomerService(CustomerRepository(session))
+    sale_invoice_service_raw = SaleInvoiceServiceRaw(
+        repo=SaleInvoiceRepository(session),
+        customer_service=customer_service,
+        item_service=item_service,
+    )
+    return ZatcaPhase2Service(ZatcaRepository(session), None, item_service, customer_service, sale_invoice_service_raw)
+
+
+async def count_statements(user_id: int, organization_id: int, branch_id: int, invoice_id: int) -> tuple[int, list[str]]:
+    """Signs the invoice in a transaction rolled back afterwards, returns its number of lines and the statements sent"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async with async_session() as session:
+        try:
+            ctx = await get_context(session, user_id, organization_id, branch_id)
+            reader_zatca_service = get_zatca_service(session)
+            invoice_service = SaleInvoiceService(
+                repo=SaleInvoiceRepository(session),
+                item_service=reader_zatca_service.item_service,
+                tax_authority_service=reader_zatca_service,
+            )
+            invoice = await invoice_service.get_invoice(ctx, invoice_id)
+            zatca_service = get_zatca_service(session)
+            event.listen(engine.sync_engine, "before_cursor_execute", record)
+            try:
+                await zatca_service.sign_invoice(ctx, invoice)
+            finally:
+                event.remove(engine.sync_engine, "before_cursor_execute", record)
+        finally:
+            await session.rollback()
+    return len(invoice.invoice_lines), statements
+
+
+async def main_async(args: argparse.Namespace) -> bool:
+    counts = set()
+    try:
+        for invoice_id in args.invoice_ids:
+            lines, statements = await count_statements(args.user_id, args.organization_id, args.branch_id, invoice_id)
+            counts.add(len(statements))
+            print(f"{invoice_id:>10} {lines:>6} {len(statements):>11}")
+            if args.verbose:
+                for statement in statements:
+                    print("    " + " ".join(statement.split()))
+    finally:
+        await engine.dispose()
+    return len(counts) == 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--organization-id", type=int, required=True)
+    parser.add_argument("--branch-id", type=int, required=True)
+    parser.add_argument("--invoice-ids", type=int, nargs="+", required=True, help="issued invoices of the branch, not signed for Zatca yet")
+    parser.add_argument("--verbose", action="store_true", help="print the statements of every invoice")
+    args = parser.parse_args()
+
+    signing_executor.configure(signing_executor.INLINE)
+    print(f"{'invoice':>10} {'lines':>6} {'statements':>11}")
+    valid = asyncio.run(main_async(args))
+    if not valid:
+        print("The invoices did not all take the same number of statements")
+    sys.exit(0 if valid else 1)
+
+
+if __name__ == "__main__":
+    main()
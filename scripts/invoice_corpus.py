@@ -0,0 +1,72 @@
+"""Invoice data covering every invoice type, invoice type code and tax category the generator supports.
+
+Shared by the scripts that compare two implementations of the same step on the same invoices.
+"""
+import copy
+import json
+from src.tax_authorities.zatca_phase2.utils.templates.invoice_data import invoice_data_template
+
+INVOICE_TYPES = ("0100000", "0200000")
+INVOICE_TYPE_CODES = ("388", "381", "383")
+TAX_CATEGORY_SETS = (("S",), ("Z",), ("E",), ("O",), ("S", "Z", "E"))
+
+
+def to_str(data: dict) -> dict:
+    """Same conversion the service applies before signing, every number becomes a string"""
+    return json.loads(json.dumps(data, default=str), parse_int=lambda x: str(x))
+
+
+def make_invoice(lines: int = 1, invoice_type: str = "0200000", invoice_type_code: str = "388", discount: bool = False,
+                 tax_categories: tuple = ("S",), customer: bool = True, note: bool = True) -> dict:
+    invoice_data = copy.deepcopy(invoice_data_template)
+    invoice_data["invoice_type"] = invoice_type
+    invoice_data["invoice_type_code"] = invoice_type_code
+    if not customer:
+        invoice_data.pop("customer")
+    if not note:
+        invoice_data.pop("note")
+    if invoice_type_code != "388":
+        invoice_data["original_invoice_number"] = "SIMINV-26-000001"
+        invoice_data["instruction_note"] = "Correction & <fix>"
+    invoice_lines = []
+    categories = {}
+    for i in range(lines):
+        category = tax_categories[i % len(tax_categories)]
+        line = copy.deepcopy(invoice_data_template["invoice_lines"][0])
+        line["id"] = i + 1
+        line["classified_tax_category"] = category
+        line["tax_rate"] = "15" if category == "S" else "0"
+        line["item"]["name"] = f"Item {i} ünï"
+        invoice_lines.append(line)
+        categories.setdefault(category, {
+            "taxable_amount": "10.00",
+            "tax_amount": "1.50" if category == "S" else "0.00",
+            "classified_tax_category": category,
+            "tax_rate": "15" if category == "S" else "0",
+            "tax_exemption_reason_code": None if category == "S" else "VATEX-SA-29",
+            "tax_exemption_reason": None if category == "S" else "Financial services",
+            "used": True,
+        })
+    invoice_data["invoice_lines"] = invoice_lines
+    invoice_data["tax_categories"] = categories
+    if discount:
+        invoice_data["has_total_discount"] = True
+        invoice_data["discount_amount"] = "1.00"
+    return to_str(invoice_data)
+
+
+def iter_corpus():
+    """Yields (name, invoice_data) for every combination, plus a few invoices of unusual shape"""
+    for invoice_type in INVOICE_TYPES:
+        for invoice_type_code in INVOICE_TYPE_CODES:
+            for tax_categories in TAX_CATEGORY_SETS:
+                for discount in (False, True):
+                    # A document level discount is only allowed when all lines share one tax category
+                    if discount and len(tax_categories) > 1:
+                        continue
+                    # Simplified credit and debit notes are issued without a customer
+                    customer = invoice_type == "0100000" or invoice_type_code == "388"
+                    name = f"{invoice_type}-{invoice_type_code}-{''.join(tax_categories)}{'-discount' if discount else ''}"
+                    yield name, make_invoice(3, invoice_type, invoice_type_code, discount, tax_categories, customer)
+    yield "without-note", make_invoice(1, note=False)
+    yield "fifty-lines", make_invoice(50, tax_categories=("S", "E"))
@@ -0,0 +1,48 @@
+"""Sends the invoices queued for the tax authority, as a process of its own.
+
+Runs the same SaleInvoiceSubmissionWorker the app starts in its lifespan. Start any number of these next to, or
+instead of, the app workers (set SUBMISSION_WORKERS=0 in the app to leave the queue to them). Stops after the
+submissions it claimed are done on SIGINT or SIGTERM. Needs the same environment as the application.
+
+Run from the repository root:
+    python -m scripts.submission_worker
+    python -m scripts.submission_worker --concurrency 16 --batch-size 50
+"""
+import argparse
+import asyncio
+import signal
+from src.core.config import settings
+from src.core.database import engine
+# Imports every router and with them every model, so the relationships between models resolve as in the app
+import src.core.routers
+from src.core.services import AsyncRequestService
+from src.sale_invoices.services.submission_worker import SaleInvoiceSubmissionWorker
+from src.tax_authorities.zatca_phase2.utils.signing_executor import signing_executor
+
+
+async def run(concurrency: int, batch_size: int) -> None:
+    signing_executor.configure(settings.SIGNING_EXECUTOR, settings.SIGNING_WORKERS)
+    signing_executor.start()
+    client = AsyncRequestService.create_client()
+    worker = SaleInvoiceSubmissionWorker(AsyncRequestService(client=client), concurrency=concurrency, batch_size=batch_size)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.request_stop)
+    try:
+        await worker.run()
+    finally:
+        await client.aclose()
+        signing_executor.shutdown()
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=max(settings.SUBMISSION_WORKERS, 1), help="submissions sent at the same time")
+    parser.add_argument("--batch-size", type=int, default=settings.SUBMISSION_BATCH_SIZE, help="most submissions claimed at a time, never more than --concurrency")
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+"""A local stand-in for the Zatca APIs, to load and soak test the onboarding and invoicing paths offline.
+
+Serves the compliance CSID, production CSID (issue and renewal), compliance invoice, clearance and reporting
+endpoints with answers in the shape Zatca gives them:
+    CSIDs      a certificate issued for the public key and subject of the CSR sent, signed with the test key in
+               zatca_phase2/utils/resources, so the application signs invoices with it as with a real CSID
+    invoices   the invoice is parsed and its hash computed again, an invoiceHash that does not match is rejected
+               with 400. Cleared invoices come back in clearedInvoice, signed with the test certificate and key.
+               An invoice whose uuid was accepted before is answered with 409.
+How every endpoint behaves is set by a ZatcaMockConfig: the distribution of its latency and the rates of server
+errors (500/503), rejections (400), warnings (202) and conflicts (409), and a rate limit over which requests are
+throttled with 429 and a Retry-After. The config can be replaced while the mock runs with PUT /mock/config, to run
+chaos scenarios (an endpoint going down, slowing down or throttling) in the middle of a soak test. GET /mock/stats
+returns the answers given by every endpoint and POST /mock/reset forgets them with the uuids seen.
+
+Run from the repository root, then point the application at it with the settings printed at startup:
+    python -m scripts.zatca_mock --port 8100
+    python -m scripts.zatca_mock --port 8100 --latency lognormal 0.3 0.5 --error-rate 0.02 --rate-limit 50
+    python -m scripts.zatca_mock --port 8100 --endpoints clearance --error-rate 1
+
+Or in process without a server, for instance as a pytest fixture:
+    async with zatca_mock.in_process(ZatcaMockConfig(seed=1)) as (request_service, mock):
+        zatca_service = ZatcaPhase2Service(zatca_repo, request_service, ...)
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import datetime
+import math
+import os
+import random
+import secrets
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+import httpx
+import uvicorn
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from lxml import etree
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from src.core.config import settings
+from src.core.services import AsyncRequestService
+from src.tax_authorities.zatca_phase2.utils.einvoice_signer import einvoice_signer
+from src.tax_authorities.zatca_phase2.utils.invoice_helper import invoice_helper
+from src.tax_authorities.zatca_phase2.utils.qr_code_generator import qr_code_generator
+
+RESOURCES = os.path.join("src", "tax_authorities", "zatca_phase2", "utils", "resources")
+# Name of every endpoint: its method, path and the setting holding its url in the application
+ENDPOINTS = {
+    "compliance_csid": ("POST", "/compliance", "ZATCA_COMPLIANCE_CSID_URL"),
+    "compliance_invoice": ("POST", "/compliance/invoices", "ZATCA_COMPLIANCE_INVOICE_URL"),
+    "production_csid": ("POST", "/production/csids", "ZATCA_PRODUCTION_CSID_URL"),
+    "production_csid_renewal": ("PATCH", "/production/csids", "ZATCA_PRODUCTION_CSID_RENEWAL_URL"),
+    "clearance": ("POST", "/invoices/clearance/single", "ZATCA_STANDARD_INVOICE_URL"),
+    "reporting": ("POST", "/invoices/reporting/single", "ZATCA_SIMPLIFIED_INVOICE_URL"),
+}
+INVOICE_ENDPOINTS = ("compliance_invoice", "clearance", "reporting")
+# Uuids of the accepted invoices remembered to answer them again with 409, the oldest are forgotten first
+SEEN_UUIDS_LIMIT = 1_000_000
+CERTIFICATE_VALIDITY = datetime.timedelta(days=5 * 365)
+
+
+class LatencyDistribution(BaseModel):
+    """Seconds an endpoint takes to answer. mean is the median for lognormal, spread is the half width of uniform
+    and the sigma of lognormal. Every sample is capped to max."""
+    kind: Literal["fixed", "uniform", "exponential", "lognormal"] = "fixed"
+    mean: float = 0
+    spread: float = 0
+    max: float = 60
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            latency = rng.uniform(self.mean - self.spread, self.mean + self.spread)
+        elif self.kind == "exponential":
+            latency = rng.expovariate(1 / self.mean) if self.mean > 0 else 0.0
+        elif self.kind == "lognormal":
+            latency = rng.lognormvariate(math.log(self.mean), self.spread) if self.mean > 0 else 0.0
+        else:
+            latency = self.mean
+        return min(max(latency, 0.0), self.max)
+
+
+class EndpointBehaviour(BaseModel):
+    latency: LatencyDistribution = LatencyDistribution()
+    # Fraction of the requests answered with 500 or 503
+    error_rate: float = 0
+    # Fraction of the requests rejected with 400, an invalid OTP for CSIDs and validation errors for invoices
+    rejection_rate: float = 0
+    # Fraction of the invoices accepted with warnings, 202
+    warning_rate: float = 0
+    # Fraction of the invoices answered with 409 as if they were sent before
+    conflict_rate: float = 0
+    # Requests per second over which requests are throttled with 429, no limit when None
+    rate_limit: Optional[float] = None
+    burst: int = 10
+
+
+class ZatcaMockConfig(BaseModel):
+    default: EndpointBehaviour = EndpointBehaviour()
+    # Behaviour of some endpoints by name, the others behave as default
+    endpoints: dict[str, EndpointBehaviour] = {}
+    verify_hash: bool = True
+    seed: Optional[int] = None
+
+    def get_behaviour(self, endpoint: str) -> EndpointBehaviour:
+        return self.endpoints.get(endpoint, self.default)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token, returns 0 when one was left or else the seconds until the next one"""
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ZatcaMock:
+    """The state of the mock: its config, the issuer of its certificates, the uuids accepted and the counters"""
+
+    def __init__(self, config: ZatcaMockConfig) -> None:
+        with open(os.path.join(RESOURCES, "certificate.pem")) as f:
+            certificate = f.read().strip()
+        with open(os.path.join(RESOURCES, "privatekey.pem")) as f:
+            private_key = f.read().strip()
+        self.signing_material = invoice_helper.get_signing_material(None, private_key, certificate)
+        # The signer keeps a pyOpenSSL key, certificates are built with cryptography
+        self.issuer_key = self.signing_material.private_key.to_cryptography_key()
+        self.seen_uuids: OrderedDict[str, None] = OrderedDict()
+        self.stats: dict[str, Counter] = {}
+        self.configure(config)
+
+    def configure(self, config: ZatcaMockConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.buckets: dict[str, TokenBucket] = {}
+        for endpoint in ENDPOINTS:
+            behaviour = config.get_behaviour(endpoint)
+            if behaviour.rate_limit:
+                self.buckets[endpoint] = TokenBucket(behaviour.rate_limit, behaviour.burst)
+
+    def reset(self) -> None:
+        self.seen_uuids.clear()
+        self.stats.clear()
+
+    def get_stats(self) -> dict[str, dict[str, float]]:
+        stats = {}
+        for endpoint, counter in self.stats.items():
+            stats[endpoint] = {key: value for key, value in counter.items() if key != "latency"}
+            # Throttled requests are answered at once, without a latency
+            delayed = counter["requests"] - counter["429"]
+            stats[endpoint]["average_latency"] = counter["latency"] / delayed if delayed else 0.0
+        return stats
+
+    def remember_uuid(self, uuid: str) -> bool:
+        """Records an accepted invoice, returns False when its uuid was accepted before"""
+        if uuid in self.seen_uuids:
+            return False
+        self.seen_uuids[uuid] = None
+        if len(self.seen_uuids) > SEEN_UUIDS_LIMIT:
+            self.seen_uuids.popitem(last=False)
+        return True
+
+    def issue_certificate(self, subject: x509.Name, public_key, extensions: x509.Extensions) -> str:
+        """Returns the base64 DER of a certificate for the key, the way the application stores certificates"""
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(self.signing_material.certificate.issuer)
+            .public_key(public_key)
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(datetime.datetime.now(datetime.timezone.utc))
+            .not_valid_after(datetime.datetime.now(datetime.timezone.utc) + CERTIFICATE_VALIDITY)
+        )
+        for extension in extensions:
+            builder = builder.add_extension(extension.value, extension.critical)
+        certificate = builder.sign(self.issuer_key, hashes.SHA256())
+        return base64.b64encode(certificate.public_bytes(serialization.Encoding.DER)).decode()
+
+    def issue_csid(self, certificate_content: str) -> dict:
+        return {
+            "requestID": self.rng.randrange(10 ** 12, 10 ** 13),
+            "tokenType": "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-x509-token-profile-1.0#X509v3",
+            "dispositionMessage": "ISSUED",
+            "binarySecurityToken": base64.b64encode(certificate_content.encode()).decode(),
+            "secret": secrets.token_urlsafe(32),
+            "errors": None,
+        }
+
+    def check_invoice(self, invoice_request: dict) -> tuple[str, bool, Optional[str], str, Optional[list]]:
+        """Parses the invoice sent, returns (uuid, is_simplified, canonical_xml, invoice_hash, qr_details). The
+        canonical_xml is None when the invoice cannot be parsed."""
+        try:
+            xml = etree.fromstring(base64.b64decode(invoice_request["invoice"]))
+            uuid, is_simplified, canonical_xml, qr_details = einvoice_signer.canonicalize_invoice(xml)
+            if not is_simplified:
+                qr_details = qr_code_generator.get_invoice_details_from_tree(xml)
+        except (KeyError, TypeError, ValueError, binascii.Error, etree.XMLSyntaxError):
+            return invoice_request.get("uuid"), False, None, "", None
+        invoice_hash = einvoice_signer.generate_base64_hash(canonical_xml) if self.config.verify_hash else invoice_request.get("invoiceHash")
+        return uuid, is_simplified, canonical_xml, invoice_hash, qr_details
+
+    def clear_invoice(self, uuid: str, canonical_xml: str, invoice_hash: str, qr_details: list) -> str:
+        """Signs the standard invoice with the test certificate as Zatca does when clearing it"""
+        return einvoice_signer.sign_simplified_invoice(canonical_xml, invoice_hash, self.signing_material, uuid, qr_details).invoice
+
+
+def validation_results(status: str, errors: list | None = None, warnings: list | None = None) -> dict:
+    return {
+        "infoMessages": [{
+            "type": "INFO",
+            "code": "XSD_ZATCA_VALID",
+            "category": "XSD validation",
+            "message": "Complied with UBL 2.1 standards in line with ZATCA specifications",
+            "status": "PASS",
+        }],
+        "warningMessages": warnings or [],
+        "errorMessages": errors or [],
+        "status": status,
+    }
+
+
+def message(kind: str, code: str, category: str, text: str) -> dict:
+    return {"type": kind, "code": code, "category": category, "message": text, "status": kind}
+
+
+def csid_error(code: str, text: str) -> dict:
+    return {"errors": [{"code": code, "message": text}]}
+
+
+def get_certificate_from_auth(request: Request) -> Optional[x509.Certificate]:
+    """The certificate of the CSID in the basic auth of the request, None when the auth is missing or invalid"""
+    try:
+        _, credentials = request.headers["authorization"].split(" ", 1)
+        binary_security_token = base64.b64decode(credentials).decode().split(":", 1)[0]
+        certificate_content = base64.b64decode(binary_security_token).decode()
+        return x509.load_der_x509_certificate(base64.b64decode(certificate_content))
+    except (KeyError, ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+async def answer_csid(mock: ZatcaMock, endpoint: str, request: Request, body: dict, behaviour: EndpointBehaviour) -> tuple[int, dict]:
+    if endpoint == "production_csid":
+        compliance_certificate = get_certificate_from_auth(request)
+        if compliance_certificate is None:
+            return 401, csid_error("Invalid-Authorization", "The compliance CSID in the authorization is not valid")
+        if not body.get("compliance_request_id"):
+            return 400, csid_error("Missing-ComplianceRequestId", "compliance_request_id is mandatory")
+        certificate_content = await run_in_threadpool(
+            mock.issue_certificate, compliance_certificate.subject, compliance_certificate.public_key(), compliance_certificate.extensions,
+        )
+        return 200, mock.issue_csid(certificate_content)
+    if endpoint == "production_csid_renewal" and get_certificate_from_auth(request) is None:
+        return 401, csid_error("Invalid-Authorization", "The production CSID in the authorization is not valid")
+    otp = request.headers.get("otp", "")
+    if not (otp.isdigit() and len(otp) == 6) or mock.rng.random() < behaviour.rejection_rate:
+        return 400, csid_error("Invalid-OTP", "The provided OTP is invalid")
+    try:
+        csr = x509.load_pem_x509_csr(base64.b64decode(body["csr"]))
+    except (KeyError, TypeError, ValueError, binascii.Error):
+        return 400, csid_error("Invalid-CSR", "The provided CSR is invalid")
+    certificate_content = await run_in_threadpool(mock.issue_certificate, csr.subject, csr.public_key(), csr.extensions)
+    return 200, mock.issue_csid(certificate_content)
+
+
+async def answer_invoice(mock: ZatcaMock, endpoint: str, request: Request, body: dict, behaviour: EndpointBehaviour) -> tuple[int, dict]:
+    if get_certificate_from_auth(request) is None:
+        return 401, {"message": "Unauthorized"}
+    status_key, not_accepted = ("clearanceStatus", "NOT_CLEARED") if endpoint == "clearance" else ("reportingStatus", "NOT_REPORTED")
+    uuid, is_simplified, canonical_xml, invoice_hash, qr_details = await run_in_threadpool(mock.check_invoice, body)
+    if canonical_xml is None:
+        errors = [message("ERROR", "XSD_SCHEMA_ERROR", "XSD validation", "The invoice could not be parsed")]
+        return 400, {"validationResults": validation_results("ERROR", errors), status_key: not_accepted}
+    if invoice_hash != body.get("invoiceHash") or uuid != body.get("uuid"):
+        errors = [message("ERROR", "invoiceHash_QRCODE_INVALID", "INVOICE_HASHING_ERRORS", "The invoice hash API body does not match the (calculated) Hash of the XML")]
+        return 400, {"validationResults": validation_results("ERROR", errors), status_key: not_accepted}
+    if mock.rng.random() < behaviour.rejection_rate:
+        errors = [message("ERROR", "BR-KSA-37", "KSA", "The seller address building number must contain 4 digits")]
+        return 400, {"validationResults": validation_results("ERROR", errors), status_key: not_accepted}
+    if endpoint != "compliance_invoice" and (mock.rng.random() < behaviour.conflict_rate or not mock.remember_uuid(uuid)):
+        errors = [message("ERROR", "Invoice-Already-Submitted", "DUPLICATE", f"An invoice with the uuid {uuid} was already submitted")]
+        return 409, {"validationResults": validation_results("ERROR", errors), status_key: not_accepted}
+    status_code, warnings = 200, None
+    if mock.rng.random() < behaviour.warning_rate:
+        status_code = 202
+        warnings = [message("WARNING", "BR-KSA-08", "KSA", "The seller identification is missing or not valid")]
+    results = validation_results("WARNING" if warnings else "PASS", warnings=warnings)
+    if endpoint == "compliance_invoice":
+        return status_code, {
+            "validationResults": results,
+            "reportingStatus": "REPORTED" if is_simplified else None,
+            "clearanceStatus": None if is_simplified else "CLEARED",
+            "qrSellertStatus": None,
+            "qrBuyertStatus": None,
+        }
+    if endpoint == "clearance":
+        cleared_invoice = await run_in_threadpool(mock.clear_invoice, uuid, canonical_xml, invoice_hash, qr_details)
+        return status_code, {"validationResults": results, "clearanceStatus": "CLEARED", "clearedInvoice": cleared_invoice}
+    return status_code, {"validationResults": results, "reportingStatus": "REPORTED"}
+
+
+def create_endpoint(mock: ZatcaMock, endpoint: str):
+    async def handle(request: Request) -> JSONResponse:
+        behaviour = mock.config.get_behaviour(endpoint)
+        stats = mock.stats.setdefault(endpoint, Counter())
+        stats["requests"] += 1
+        # The gateway throttles before the request reaches Zatca, so a throttled request is answered at once
+        bucket = mock.buckets.get(endpoint)
+        retry_after = bucket.take() if bucket is not None else 0.0
+        if retry_after:
+            stats["429"] += 1
+            return JSONResponse({"message": "Too Many Requests"}, status_code=429, headers={"Retry-After": str(math.ceil(retry_after))})
+        latency = behaviour.latency.sample(mock.rng)
+        stats["latency"] += latency
+        await asyncio.sleep(latency)
+        if mock.rng.random() < behaviour.error_rate:
+            status_code = mock.rng.choice((500, 503))
+            stats[str(status_code)] += 1
+            return JSONResponse({"code": str(status_code), "message": "Something went wrong, please try again later"}, status_code=status_code)
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        answer = answer_invoice if endpoint in INVOICE_ENDPOINTS else answer_csid
+        status_code, content = await answer(mock, endpoint, request, body if isinstance(body, dict) else {}, behaviour)
+        stats[str(status_code)] += 1
+        return JSONResponse(content, status_code=status_code)
+
+    return handle
+
+
+def create_app(config: ZatcaMockConfig | None = None) -> FastAPI:
+    mock = ZatcaMock(config or ZatcaMockConfig())
+    app = FastAPI(title="Zatca mock")
+    app.state.zatca_mock = mock
+    for endpoint, (method, path, _) in ENDPOINTS.items():
+        app.add_api_route(path, create_endpoint(mock, endpoint), methods=[method], name=endpoint)
+
+    @app.get("/mock/config")
+    async def get_config() -> ZatcaMockConfig:
+        return mock.config
+
+    @app.put("/mock/config")
+    async def put_config(config: ZatcaMockConfig) -> ZatcaMockConfig:
+        mock.configure(config)
+        return mock.config
+
+    @app.get("/mock/stats")
+    async def get_stats() -> dict:
+        return mock.get_stats()
+
+    @app.post("/mock/reset")
+    async def reset() -> dict:
+        mock.reset()
+        return mock.get_stats()
+
+    return app
+
+
+# The app as `uvicorn scripts.zatca_mock:app` serves it, behaving like Zatca without failures or latency
+app = create_app()
+
+
+def get_settings_urls(base_url: str) -> dict[str, str]:
+    """The url of every endpoint of the mock served at base_url, by the setting holding it in the application"""
+    return {setting: base_url.rstrip("/") + path for _, path, setting in ENDPOINTS.values()}
+
+
+@asynccontextmanager
+async def in_process(config: ZatcaMockConfig | None = None, base_url: str = "http://zatca-mock"):
+    """Points the Zatca settings at a mock running in this process and yields (request_service, mock), the
+    request service sending to it. The settings are restored on exit."""
+    mock_app = create_app(config)
+    urls = get_settings_urls(base_url)
+    previous_urls = {setting: getattr(settings, setting) for setting in urls}
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_app))
+    try:
+        for setting, url in urls.items():
+            setattr(settings, setting, url)
+        yield AsyncRequestService(client=client), mock_app.state.zatca_mock
+    finally:
+        for setting, url in previous_urls.items():
+            setattr(settings, setting, url)
+        await client.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS), help="endpoints the options below apply to, the others answer at once without failures")
+    parser.add_argument("--latency", nargs="+", default=["fixed", "0"], metavar="KIND MEAN [SPREAD]", help="fixed, uniform, exponential or lognormal, then its mean (median for lognormal) and spread in seconds")
+    parser.add_argument("--max-latency", type=float, default=60)
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction answered with 500 or 503")
+    parser.add_argument("--rejection-rate", type=float, default=0, help="fraction rejected with 400")
+    parser.add_argument("--warning-rate", type=float, default=0, help="fraction of the invoices accepted with warnings, 202")
+    parser.add_argument("--conflict-rate", type=float, default=0, help="fraction of the invoices answered with 409")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second over which 429 is answered")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--no-verify-hash", action="store_true", help="trust the invoiceHash sent instead of computing it")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    kind, *values = args.latency
+    latency = LatencyDistribution(kind=kind, mean=float(values[0]) if values else 0, spread=float(values[1]) if len(values) > 1 else 0, max=args.max_latency)
+    behaviour = EndpointBehaviour(
+        latency=latency,
+        error_rate=args.error_rate,
+        rejection_rate=args.rejection_rate,
+        warning_rate=args.warning_rate,
+        conflict_rate=args.conflict_rate,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+    )
+    config = ZatcaMockConfig(endpoints={endpoint: behaviour for endpoint in args.endpoints}, verify_hash=not args.no_verify_hash, seed=args.seed)
+    for setting, url in get_settings_urls(f"http://{args.host}:{args.port}").items():
+        print(f"{setting}={url}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
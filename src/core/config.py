@@ -39,6 +39,33 @@ class Settings(BaseSettings):
     CLOUDINARY_API_SECRET: str
     CLOUDINARY_URL: str
     STANDARD_TAX_RATE: float
+    SIGNING_EXECUTOR: str = "thread"
+    SIGNING_WORKERS: int = 2
+    ZATCA_VALIDATE_INVOICES: bool = True
+    ZATCA_KEY_POOL_SIZE: int = 8
+    HTTP2: bool = True
+    HTTP_CONNECT_TIMEOUT: float = 5
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 60
+    HTTP_RETRY_BASE_DELAY: float = 0.5
+    HTTP_RETRY_MAX_DELAY: float = 8
+    HTTP_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    HTTP_CIRCUIT_RECOVERY_TIMEOUT: float = 30
+    HTTP_CONCURRENCY_INITIAL_LIMIT: int = 10
+    HTTP_CONCURRENCY_MIN_LIMIT: int = 1
+    HTTP_CONCURRENCY_MAX_LIMIT: int = 100
+    HTTP_CONCURRENCY_LATENCY_TARGET: float = 3
+    HTTP_CONCURRENCY_QUEUE_TIMEOUT: float = 2
+    ZATCA_CSID_TIMEOUT: float | None = None
+    ZATCA_COMPLIANCE_INVOICE_TIMEOUT: float | None = None
+    ZATCA_CLEARANCE_TIMEOUT: float | None = None
+    ZATCA_REPORTING_TIMEOUT: float | None = None
+    SUBMISSION_WORKERS: int = 4
+    SUBMISSION_BATCH_SIZE: int = 20
+    SUBMISSION_POLL_INTERVAL: float = 1
+    SUBMISSION_MAX_ATTEMPTS: int = 6
+    SUBMISSION_LEASE_SECONDS: int = 300
     model_config = SettingsConfigDict(env_file=".env")
 
 settings = Settings()
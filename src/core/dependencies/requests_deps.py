@@ -1,6 +1,7 @@
-from fastapi import Depends
+from fastapi import Depends, Request
 from typing import Annotated
 from ..services.requests_service import AsyncRequestService
 
-def get_requests_service() -> AsyncRequestService:
-    return AsyncRequestService()
+def get_requests_service(request: Request) -> AsyncRequestService:
+    """The request service of the app, created once in the lifespan so every request shares its connections"""
+    return request.app.state.request_service
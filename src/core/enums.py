@@ -127,10 +127,17 @@ class InvoiceStatus(str, Enum):
 
 class InvoiceTaxAuthorityStatus(str, Enum):
     NOT_SENT = "NOT_SENT"
+    PENDING = "PENDING"             # Queued for submission, see SaleInvoiceSubmission
     ACCEPTED = "ACCEPTED"
     ACCEPTED_WITH_WARNINGS = "ACCEPTED_WITH_WARNINGS"
     REJECTED = "REJECTED"
 
+class SubmissionStatus(str, Enum):
+    PENDING = "PENDING"             # Waiting for a worker, or for its next attempt
+    PROCESSING = "PROCESSING"       # Claimed by a worker
+    SUCCEEDED = "SUCCEEDED"         # The tax authority answered, accepted or not
+    FAILED = "FAILED"               # Gave up, the invoice could not be sent
+
 class ProjectStatus(str, Enum):
     DRAFT = "DRAFT"
     ACTIVE = "ACTIVE"
@@ -1,6 +1,7 @@
 from .exceptions import (
     BaseAppException,
     RequestCouldNotBeSent,
+    ServiceUnavailableException,
     IntegrityErrorException,
     UniqueConstraintViolationException,
     ForeignKeyViolationException,
@@ -11,6 +11,11 @@ class RequestCouldNotBeSent(BaseAppException):
         super().__init__(detail, status_code)
 
 
+class ServiceUnavailableException(BaseAppException):
+    def __init__(self, detail: str | None = "The service is unavailable, try again later.", status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE):
+        super().__init__(detail, status_code)
+
+
 class IntegrityErrorException(BaseAppException):
     def __init__(self, detail: str | None = (
         "A database integrity error occurred. "
@@ -1,30 +1,149 @@
+import asyncio
+import importlib.util
+import math
+import time
 import httpx
 import backoff
 from src.core.config import settings
+from ..exceptions import RequestCouldNotBeSent, ServiceUnavailableException
+from .resilience import CircuitBreaker, ConcurrencyLimiter, EndpointGuard
 
 class AsyncRequestService:
+    """Sends HTTP requests through a circuit breaker and an adaptive concurrency limiter per endpoint, so an endpoint
+    that fails or slows down gets fewer requests instead of holding every worker. Requests marked idempotent are
+    retried with jittered exponential backoff on transport errors and on RETRY_STATUS_CODES."""
+
+    # Answers meaning the endpoint failed or is overloaded, they count as failures and are retried when safe
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
     
-    def __init__(self, timeout=settings.TIMEOUT, max_retries=settings.MAX_RETRIES):
+    def __init__(
+        self,
+        timeout=settings.TIMEOUT,
+        max_retries=settings.MAX_RETRIES,
+        client: httpx.AsyncClient | None = None,
+        retry_base_delay: float = settings.HTTP_RETRY_BASE_DELAY,
+        retry_max_delay: float = settings.HTTP_RETRY_MAX_DELAY,
+    ):
         self.timeout = timeout
         self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        # A client passed in is shared and closed by whoever created it, only an own client is closed by close()
+        self.owns_client = client is None
+        self.client = client if client is not None else httpx.AsyncClient(timeout=httpx.Timeout(timeout), follow_redirects=True)
+        self.endpoints: dict[str, EndpointGuard] = {}
 
-        self.client = httpx.AsyncClient(timeout=httpx.Timeout(timeout), follow_redirects=True)
+    @staticmethod
+    def create_client(
+        timeout: float = settings.TIMEOUT,
+        connect_timeout: float = settings.HTTP_CONNECT_TIMEOUT,
+        max_connections: int = settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = settings.HTTP_KEEPALIVE_EXPIRY,
+        http2: bool = settings.HTTP2,
+    ) -> httpx.AsyncClient:
+        """Creates a pooled client meant to live as long as the app, so requests reuse open connections instead
+        of paying a TCP and TLS handshake each. HTTP/2 is only used when the h2 package is installed."""
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2 and importlib.util.find_spec("h2") is not None,
+            follow_redirects=True,
+        )
 
     async def close(self):
-        await self.client.aclose()
-
-    @backoff.on_exception(
-        backoff.expo,
-        (httpx.RequestError, httpx.HTTPStatusError),
-        max_tries=lambda self: self.max_retries,
-        jitter=None,
-    )
-    async def request(self, method, url, json, headers, auth=None, params=None, **kwargs):
+        if self.owns_client:
+            await self.client.aclose()
+
+    def _get_endpoint(self, url) -> EndpointGuard:
+        """The guard of the endpoint of the url, created on its first request. The query string is not part of it."""
+        parsed_url = httpx.URL(url)
+        name = f"{parsed_url.host}{parsed_url.path}"
+        if name not in self.endpoints:
+            self.endpoints[name] = EndpointGuard(
+                name,
+                CircuitBreaker(settings.HTTP_CIRCUIT_FAILURE_THRESHOLD, settings.HTTP_CIRCUIT_RECOVERY_TIMEOUT),
+                ConcurrencyLimiter(
+                    settings.HTTP_CONCURRENCY_INITIAL_LIMIT,
+                    settings.HTTP_CONCURRENCY_MIN_LIMIT,
+                    settings.HTTP_CONCURRENCY_MAX_LIMIT,
+                    settings.HTTP_CONCURRENCY_LATENCY_TARGET,
+                    settings.HTTP_CONCURRENCY_QUEUE_TIMEOUT,
+                ),
+            )
+        return self.endpoints[name]
+
+    def get_metrics(self) -> dict[str, dict[str, float | str]]:
+        """Returns the counters, breaker state and concurrency limit of every endpoint requested so far"""
+        return {name: endpoint.get_metrics() for name, endpoint in self.endpoints.items()}
+
+    def _get_retry_delay(self, attempt: int, response: httpx.Response | None = None) -> float:
+        """Full jitter over an exponential backoff, at least the Retry-After the endpoint asked for"""
+        delay = backoff.full_jitter(min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1)))
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+        return min(delay, self.retry_max_delay)
+
+    async def _send(self, endpoint: EndpointGuard, method, url, json, headers, auth=None, params=None, **kwargs) -> httpx.Response:
+        """Sends the request once, if the breaker and the limiter of the endpoint let it through"""
+        if not endpoint.breaker.allow():
+            endpoint.metrics["rejected_open"] += 1
+            raise ServiceUnavailableException(detail=f"Requests to {endpoint.name} are paused after repeated failures, try again in {math.ceil(endpoint.breaker.retry_after())} seconds")
+        if not await endpoint.limiter.acquire():
+            endpoint.breaker.record_not_sent()
+            endpoint.metrics["rejected_limit"] += 1
+            raise ServiceUnavailableException(detail=f"Too many requests to {endpoint.name} are waiting for an answer, try again later")
+        started_at = time.perf_counter()
+        failed = True
         try:
-            response: httpx.Response = await self.client.request(method=method, url=url, data=json, headers=headers, auth=auth, **kwargs)
+            response: httpx.Response = await self.client.request(method=method, url=url, data=json, headers=headers, auth=auth, params=params, **kwargs)
+            failed = response.status_code in self.RETRY_STATUS_CODES
             return response
-        except httpx.RequestError as e:
-            return None
+        except asyncio.CancelledError:
+            # Cancelled by the caller, nothing is known about the endpoint
+            failed = None
+            raise
+        finally:
+            latency = time.perf_counter() - started_at
+            await endpoint.limiter.release(latency, bool(failed))
+            if failed is None:
+                endpoint.breaker.record_not_sent()
+            elif failed:
+                endpoint.breaker.record_failure()
+            else:
+                endpoint.breaker.record_success()
+            endpoint.metrics["sent"] += 1
+            endpoint.metrics["failed" if failed else "succeeded"] += 1
+            endpoint.metrics["total_latency"] += latency
+            endpoint.metrics["max_latency"] = max(endpoint.metrics["max_latency"], latency)
+
+    async def request(self, method, url, json, headers, auth=None, params=None, idempotent: bool = False, **kwargs) -> httpx.Response:
+        """Sends the request and returns the answer of the endpoint, whatever its status. Only an idempotent request,
+        one the endpoint recognizes when it is sent again, is retried up to max_retries times. Raises
+        RequestCouldNotBeSent when the endpoint could not be reached and ServiceUnavailableException when its breaker
+        or limiter refused the request, which is never retried."""
+        endpoint = self._get_endpoint(url)
+        attempts = max(self.max_retries, 1) if idempotent else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                response = await self._send(endpoint, method, url, json, headers, auth, params, **kwargs)
+            except httpx.RequestError as e:
+                if attempt == attempts:
+                    raise RequestCouldNotBeSent(detail=f"Request to {endpoint.name} could not be sent: {type(e).__name__}")
+                delay = self._get_retry_delay(attempt)
+            else:
+                if attempt == attempts or response.status_code not in self.RETRY_STATUS_CODES:
+                    return response
+                delay = self._get_retry_delay(attempt, response)
+            endpoint.metrics["retried"] += 1
+            await asyncio.sleep(delay)
 
     async def get(self, url, headers, json, auth=None, params=None, **kwargs):
         return await self.request("GET", url, json, headers, auth, params, **kwargs)
@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+
+class CircuitBreaker:
+    """Stops sending requests to an endpoint after failure_threshold failures in a row. Once open it rejects every
+    request for recovery_timeout seconds, then lets a single trial request through: its success closes the breaker
+    again, its failure opens it for another recovery_timeout."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    def retry_after(self) -> float:
+        """Seconds left before an open breaker lets a trial request through"""
+        return max(self.opened_at + self.recovery_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now, a request allowed must be followed by one of the record methods"""
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._trial_running:
+                return False
+            self._trial_running = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def record_not_sent(self) -> None:
+        """The allowed request was not sent after all, another one may be the trial"""
+        self._trial_running = False
+
+
+class ConcurrencyLimiter:
+    """Adapts the number of requests in flight to an endpoint the way TCP adapts its window (AIMD): the limit grows by
+    about one for every limit requests answered within latency_target seconds, and is cut by decrease_factor on a
+    failure or a slower answer. A request over the limit waits up to queue_timeout seconds for a slot, then is refused,
+    so a slow endpoint holds a bounded number of workers instead of all of them."""
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        queue_timeout: float,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.latency_target = latency_target
+        self.queue_timeout = queue_timeout
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> bool:
+        """Takes a slot, returns False when none was free within queue_timeout"""
+        async with self._condition:
+            try:
+                await asyncio.wait_for(self._condition.wait_for(lambda: self.in_flight < int(self.limit)), self.queue_timeout)
+            except asyncio.TimeoutError:
+                return False
+            self.in_flight += 1
+            return True
+
+    async def release(self, latency: float, failed: bool) -> None:
+        """Gives the slot back and adapts the limit to how the request went"""
+        async with self._condition:
+            self.in_flight -= 1
+            if failed or latency > self.latency_target:
+                self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class EndpointGuard:
+    """The circuit breaker, concurrency limiter and counters of one endpoint"""
+
+    def __init__(self, name: str, breaker: CircuitBreaker, limiter: ConcurrencyLimiter) -> None:
+        self.name = name
+        self.breaker = breaker
+        self.limiter = limiter
+        self.metrics = {
+            "sent": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+            "rejected_open": 0,
+            "rejected_limit": 0,
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+        }
+
+    def get_metrics(self) -> dict[str, float | str]:
+        metrics = dict(self.metrics)
+        metrics["state"] = self.breaker.state
+        metrics["limit"] = int(self.limiter.limit)
+        metrics["in_flight"] = self.limiter.in_flight
+        metrics["average_latency"] = metrics["total_latency"] / metrics["sent"] if metrics["sent"] else 0.0
+        return metrics
@@ -7,7 +7,9 @@ This endpoint handles three different invoice creation flows based on the user's
 - **Production Stage - Standard**: Creates a standard invoice using production CSID, signs it, and submits to ZATCA for clearance
 - **Production Stage - Simplified**: Creates a simplified invoice using production CSID, signs it, and submits to ZATCA for reporting
 
-The process includes calculating invoices totals, signing with appropriate CSID certificates, and submitting to ZATCA. All invoices are stored with their ZATCA responses, QR codes, and signatures.""",
+The process includes calculating invoices totals, signing with appropriate CSID certificates, and submitting to ZATCA. All invoices are stored with their ZATCA responses, QR codes, and signatures.
+
+When `send_to_tax_authority` is set, the invoice is queued and returned with the tax authority status `PENDING`. It is signed and submitted in the background, follow it with `GET /sale-invoices/{id}/submission`.""",
 
     "get_invoice": """Retrieve a complete invoice by its unique identifier.
     
@@ -22,5 +24,23 @@ The invoice data is retrieved from the current user's account, ensuring proper a
 
     "generate_invoice_number": """Generate and return a new invoice number.
 
-This function creates a unique invoice number that is displayed to the user when a new invoice is being created."""
+This function creates a unique invoice number that is displayed to the user when a new invoice is being created.""",
+
+    "submit_invoice": """Queue an issued invoice to be signed and submitted to the tax authority.
+
+The request returns right away with `202 Accepted` and the submission, the invoice gets the tax authority status `PENDING`. A background worker signs and submits it:
+- Timeouts, throttling and server errors of the tax authority are retried with increasing delays
+- Any other error fails the submission and sets the invoice back to `NOT_SENT`, so it can be submitted again
+
+Use `GET /sale-invoices/{id}/submission` to follow the submission.""",
+
+    "submit_invoices": """Sign many issued invoices of the branch at once and queue them to be submitted to the tax authority, such as the end of day invoices of a point of sale.
+
+The invoices are signed in the order given, as one run of the chain of every EGS unit, before the request returns with `202 Accepted` and their submissions. Nothing is signed or queued if any of them can not be submitted. The background worker then submits them like invoices queued one by one, with the signatures made here.
+
+Use `GET /sale-invoices/{id}/submission` to follow every submission.""",
+
+    "get_invoice_submission": """Return the last submission of an invoice to the tax authority.
+
+The status is `PENDING` while it waits for a worker or for its next attempt, `PROCESSING` while it is being sent, `SUCCEEDED` once the tax authority answered, with its answer in `tax_authority_status`, and `FAILED` when it could not be sent, with the reason in `last_error`."""
 } 
\ No newline at end of file
@@ -16,5 +16,23 @@ RESPONSES = {
     },
     "generate_invoice_number": {
         status.HTTP_200_OK: {"description": "Invoice number generated successfully"}
-    }
+    },
+    "submit_invoice": {
+        status.HTTP_202_ACCEPTED: {"description": "Invoice queued for the tax authority."},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid or missing access token.", "model": ErrorResponse},
+        status.HTTP_403_FORBIDDEN: {"description": "The invoice is not issued, already accepted or already queued.", "model": ErrorResponse},
+        status.HTTP_404_NOT_FOUND: {"description": "Invoice not found.", "model": ErrorResponse},
+    },
+    "submit_invoices": {
+        status.HTTP_202_ACCEPTED: {"description": "Invoices signed and queued for the tax authority."},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid or missing access token.", "model": ErrorResponse},
+        status.HTTP_403_FORBIDDEN: {"description": "An invoice is not issued, already accepted or already queued.", "model": ErrorResponse},
+        status.HTTP_404_NOT_FOUND: {"description": "An invoice not found.", "model": ErrorResponse},
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "An invoice does not comply with the tax authority rules.", "model": ErrorResponse},
+    },
+    "get_invoice_submission": {
+        status.HTTP_200_OK: {"description": "Submission retrieved successfully."},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid or missing access token.", "model": ErrorResponse},
+        status.HTTP_404_NOT_FOUND: {"description": "Invoice not found or never submitted.", "model": ErrorResponse},
+    },
 } 
\ No newline at end of file
@@ -2,4 +2,7 @@ SUMMARIES = {
     "create_invoice": "Create a new invoice.",
     "get_invoice": "Get an invoice by id.",
     "generate_invoice_number": "Generates a new invoice number",
+    "submit_invoice": "Queue an invoice for the tax authority.",
+    "submit_invoices": "Sign many invoices and queue them for the tax authority.",
+    "get_invoice_submission": "Get the submission status of an invoice.",
 } 
\ No newline at end of file
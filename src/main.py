@@ -1,8 +1,33 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from src.core.config import settings
 from src.core.exceptions.exception_handlers import register_exception_handlers
 from src.core.routers import v1_router
+from src.core.services import AsyncRequestService
+from src.sale_invoices.services.submission_worker import SaleInvoiceSubmissionWorker
+from src.tax_authorities.zatca_phase2.utils.csr_generator import key_pool
+from src.tax_authorities.zatca_phase2.utils.signing_executor import signing_executor
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    signing_executor.configure(settings.SIGNING_EXECUTOR, settings.SIGNING_WORKERS)
+    signing_executor.start()
+    key_pool.configure(settings.ZATCA_KEY_POOL_SIZE)
+    key_pool.start()
+    app.state.request_service = AsyncRequestService(client=AsyncRequestService.create_client())
+    # Without in-process workers the queued invoices are sent by scripts/submission_worker.py
+    submission_worker = None
+    if settings.SUBMISSION_WORKERS > 0:
+        submission_worker = SaleInvoiceSubmissionWorker(app.state.request_service)
+        submission_worker.start()
+    yield
+    if submission_worker is not None:
+        await submission_worker.stop()
+    await app.state.request_service.client.aclose()
+    signing_executor.shutdown()
+    key_pool.clear()
 
 app = FastAPI(
     title="Wasel - Backend API",
@@ -45,6 +70,7 @@ Wasel Backend API makes **integration simple, secure, and reliable**. Use the do
         "email": "support@wasel.com",
         "url": "https://wasel.com",
     },
+    lifespan=lifespan,
 )
 # app = FastAPI(
 #     swagger_ui_parameters={
@@ -4,6 +4,7 @@ from typing import Annotated
 from .repositories import PointOfSaleRepository
 from .services import PointOfSaleService
 from src.core.database import get_db
+from src.tax_authorities.dependencies import get_tax_authority_service, TaxAuthorityService
 
 
 async def get_point_of_sale_repository(
@@ -14,6 +15,7 @@ async def get_point_of_sale_repository(
 
 def get_point_of_sale_service(
     point_of_sale_repo: Annotated[PointOfSaleRepository, Depends(get_point_of_sale_repository)],
+    tax_authority_service: Annotated[TaxAuthorityService, Depends(get_tax_authority_service)],
 ) -> PointOfSaleService:
     
-    return PointOfSaleService(point_of_sale_repo)
+    return PointOfSaleService(point_of_sale_repo, tax_authority_service)
@@ -10,7 +10,8 @@ from src.core.schemas import (
 # from src.docs.points_of_sale import DOCSTRINGS, RESPONSES, SUMMARIES
 
 from .dependencies import Annotated, Depends, get_point_of_sale_service
-from .schemas import PointOfSaleCreate, PointOfSaleFilters, PointOfSaleOut, PointOfSaleUpdate
+from .schemas import PointOfSaleCreate, PointOfSaleFilters, PointOfSaleOut, PointOfSaleOutWithTaxAuthority, PointOfSaleUpdate
+from src.tax_authorities.schemas import BranchTaxAuthorityDataComplete, PointOfSaleTaxAuthorityDataCreate
 from .services import PointOfSaleService
 from src.core.schemas.context import RequestContext
 
@@ -63,6 +64,22 @@ async def get_point_of_sale(
     return SingleObjectResponse(data=data)
 
 
+@router.get(
+    path="/{id}/tax-authority-data",
+    response_model=SingleObjectResponse[PointOfSaleOutWithTaxAuthority],
+    # responses=RESPONSES["get_point_of_sale_tax_authority_data"],
+    # summary=SUMMARIES["get_point_of_sale_tax_authority_data"],
+    # description=DOCSTRINGS["get_point_of_sale_tax_authority_data"],
+)
+async def get_point_of_sale_tax_authority_data(
+    id: int,
+    point_of_sale_service: Annotated[PointOfSaleService, Depends(get_point_of_sale_service)],
+    request_context: Annotated[RequestContext, Depends(get_request_context)],
+) -> SingleObjectResponse[PointOfSaleOutWithTaxAuthority]:
+    data = await point_of_sale_service.get_point_of_sale_tax_authority_data(request_context, id)
+    return SingleObjectResponse(data=data)
+
+
 # =========================================================
 # POST routes
 # =========================================================
@@ -84,6 +101,42 @@ async def create_point_of_sale(
     return SingleObjectResponse(data=data)
 
 
+@router.post(
+    path="/{id}/tax-authority-data",
+    status_code=status.HTTP_201_CREATED,
+    response_model=SingleObjectResponse[PointOfSaleOutWithTaxAuthority],
+    # responses=RESPONSES["create_point_of_sale_tax_authority_data"],
+    # summary=SUMMARIES["create_point_of_sale_tax_authority_data"],
+    # description=DOCSTRINGS["create_point_of_sale_tax_authority_data"],
+)
+async def create_point_of_sale_tax_authority_data(
+    id: int,
+    body: PointOfSaleTaxAuthorityDataCreate,
+    point_of_sale_service: Annotated[PointOfSaleService, Depends(get_point_of_sale_service)],
+    request_context: Annotated[RequestContext, Depends(get_request_context)],
+) -> SingleObjectResponse[PointOfSaleOutWithTaxAuthority]:
+    data = await point_of_sale_service.create_point_of_sale_tax_authority_data(request_context, id, body)
+    return SingleObjectResponse(data=data)
+
+
+@router.post(
+    path="/{id}/tax-authority-data/complete",
+    status_code=status.HTTP_201_CREATED,
+    response_model=SingleObjectResponse[PointOfSaleOutWithTaxAuthority],
+    # responses=RESPONSES["complete_point_of_sale_tax_authority_data"],
+    # summary=SUMMARIES["complete_point_of_sale_tax_authority_data"],
+    # description=DOCSTRINGS["complete_point_of_sale_tax_authority_data"],
+)
+async def complete_point_of_sale_tax_authority_data(
+    id: int,
+    body: BranchTaxAuthorityDataComplete,
+    point_of_sale_service: Annotated[PointOfSaleService, Depends(get_point_of_sale_service)],
+    request_context: Annotated[RequestContext, Depends(get_request_context)],
+) -> SingleObjectResponse[PointOfSaleOutWithTaxAuthority]:
+    data = await point_of_sale_service.complete_point_of_sale_tax_authority_data(request_context, id, body)
+    return SingleObjectResponse(data=data)
+
+
 # =========================================================
 # PATCH routes
 # =========================================================
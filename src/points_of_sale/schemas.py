@@ -3,6 +3,7 @@ from datetime import datetime
 from decimal import Decimal
 from src.core.enums import UnitCodes
 from typing import Optional
+from src.tax_authorities.schemas import BranchTaxAuthorityDataOut
 
 
 class PointOfSaleBase(BaseModel):
@@ -18,5 +19,8 @@ class PointOfSaleOut(PointOfSaleBase):
     id: int
     model_config = ConfigDict(from_attributes=True)
 
+class PointOfSaleOutWithTaxAuthority(PointOfSaleOut):
+    tax_authority_data: Optional[BranchTaxAuthorityDataOut] = None
+
 class PointOfSaleFilters(BaseModel):
     name: Optional[str] = None
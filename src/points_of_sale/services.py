@@ -1,12 +1,15 @@
-from .schemas import PointOfSaleOut, PointOfSaleCreate, PointOfSaleUpdate, PointOfSaleFilters
+from .schemas import PointOfSaleOut, PointOfSaleOutWithTaxAuthority, PointOfSaleCreate, PointOfSaleUpdate, PointOfSaleFilters
 from src.core.schemas import PagintationParams
 from .repositories import PointOfSaleRepository
 from .exceptions import PointOfSaleNotFoundException
 from src.core.schemas.context import RequestContext
+from src.tax_authorities.services import TaxAuthorityService
+from src.tax_authorities.schemas import BranchTaxAuthorityDataComplete, PointOfSaleTaxAuthorityDataCreate
 
 class PointOfSaleService:
-    def __init__(self, point_of_sale_repo: PointOfSaleRepository):
+    def __init__(self, point_of_sale_repo: PointOfSaleRepository, tax_authority_service: TaxAuthorityService):
         self.point_of_sale_repo = point_of_sale_repo
+        self.tax_authority_service = tax_authority_service
 
     async def get_point_of_sale(self, ctx: RequestContext, id: int) -> PointOfSaleOut:
         point_of_sale = await self.point_of_sale_repo.get_point_of_sale(ctx.organization.id, ctx.branch.id, id)
@@ -44,3 +47,18 @@ class PointOfSaleService:
         await self.get_point_of_sale(ctx, id)
         await self.point_of_sale_repo.delete_point_of_sale(ctx.organization.id, ctx.branch.id, id)
         return None
+
+    async def get_point_of_sale_tax_authority_data(self, ctx: RequestContext, id: int) -> PointOfSaleOutWithTaxAuthority:
+        point_of_sale = PointOfSaleOutWithTaxAuthority.model_validate(await self.get_point_of_sale(ctx, id))
+        point_of_sale.tax_authority_data = await self.tax_authority_service.get_point_of_sale_tax_authority_data(ctx, id)
+        return point_of_sale
+
+    async def create_point_of_sale_tax_authority_data(self, ctx: RequestContext, id: int, data: PointOfSaleTaxAuthorityDataCreate) -> PointOfSaleOutWithTaxAuthority:
+        await self.get_point_of_sale(ctx, id)
+        await self.tax_authority_service.create_point_of_sale_tax_authority_data(ctx, id, data)
+        return await self.get_point_of_sale_tax_authority_data(ctx, id)
+
+    async def complete_point_of_sale_tax_authority_data(self, ctx: RequestContext, id: int, data: BranchTaxAuthorityDataComplete) -> PointOfSaleOutWithTaxAuthority:
+        await self.get_point_of_sale(ctx, id)
+        await self.tax_authority_service.complete_point_of_sale_tax_authority_data(ctx, id, data)
+        return await self.get_point_of_sale_tax_authority_data(ctx, id)
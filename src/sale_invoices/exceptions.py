@@ -31,6 +31,11 @@ class CreditDebitNoteNotAllowed(BaseAppException):
     def __init__(self, detail: str | None = "Credit and debit note creation is only allowed for invoices with status ISSUED", status_code: int = status.HTTP_403_FORBIDDEN):
         super().__init__(detail, status_code)
 
+class InvoiceSubmissionNotFoundException(BaseAppException):
+    """Raised when an invoice was never queued for the tax authority"""
+    def __init__(self, detail: str | None = "The invoice was not submitted to the tax authority", status_code: int = status.HTTP_404_NOT_FOUND):
+        super().__init__(detail, status_code)
+
 class SaleInvoiceValidationException(BaseAppException):
     """Raised when invoice business rules are violated"""
     def __init__(self, detail: str | None = "Invoice validation failed", status_code: int = status.HTTP_422_UNPROCESSABLE_ENTITY):
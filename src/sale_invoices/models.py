@@ -1,8 +1,8 @@
-from sqlalchemy import BOOLEAN, Column, Integer, String, UUID, Date, Text, DECIMAL, DateTime, ForeignKey, Enum, func, text, TIME
+from sqlalchemy import BOOLEAN, Column, Integer, String, UUID, Date, Text, DECIMAL, DateTime, ForeignKey, Enum, Index, func, text, TIME
 from sqlalchemy.orm import relationship
 from src.core.database import Base
 from src.core.models import AuditMixin
-from src.core.enums import InvoiceType, InvoiceTypeCode, PaymentMeansCode, TaxExemptionReasonCode, ZatcaPhase2Stage, DocumentType
+from src.core.enums import InvoiceType, InvoiceTypeCode, PaymentMeansCode, SubmissionStatus, TaxExemptionReasonCode, ZatcaPhase2Stage, DocumentType
 
 
 class SaleInvoice(Base, AuditMixin):
@@ -57,4 +57,20 @@ class SaleInvoiceLine(Base):
     rounding_amount = Column(DECIMAL(scale=2), nullable=False)
     classified_tax_category = Column(String(5), nullable=False)
     tax_rate = Column(DECIMAL(scale=2), nullable=False)    
-    
\ No newline at end of file
+    
+
+class SaleInvoiceSubmission(Base, AuditMixin):
+    """Outbox of the invoices waiting to be sent to the tax authority, written in the transaction that issues them.
+    Rows are claimed by SaleInvoiceSubmissionWorker, created_by is the user the invoice is sent as."""
+    __tablename__ = "sale_invoice_submissions"
+    __table_args__ = (Index("ix_sale_invoice_submissions_status_available_at", "status", "available_at"),)
+    id = Column(Integer, autoincrement=True, primary_key=True, index=True)
+    organization_id = Column(Integer, ForeignKey('organizations.id'), nullable=False)
+    branch_id = Column(Integer, ForeignKey('branches.id'), nullable=False)
+    invoice_id = Column(Integer, ForeignKey('sale_invoices.id', ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String(50), nullable=False, default=SubmissionStatus.PENDING.value)
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    tax_authority_status = Column(String(50), nullable=True)
+    last_error = Column(Text, nullable=True)
@@ -1,10 +1,11 @@
+from datetime import timedelta
 from typing import Any, Dict, List, Optional, Tuple
-from sqlalchemy import and_, func, select, update, delete, distinct
+from sqlalchemy import and_, or_, func, insert, select, update, delete, distinct
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload, aliased
 
-from .models import SaleInvoice, SaleInvoiceLine
-from src.core.enums import ZatcaPhase2Stage, InvoiceType
+from .models import SaleInvoice, SaleInvoiceLine, SaleInvoiceSubmission
+from src.core.enums import SubmissionStatus, ZatcaPhase2Stage, InvoiceType
 
 
 class SaleInvoiceRepository:
@@ -133,6 +134,19 @@ class SaleInvoiceRepository:
         await self.db.flush()
         return result.scalars().first()
 
+    async def update_invoices(self, organization_id: int, user_id: int, invoice_ids: List[int], data: Dict[str, Any]) -> None:
+        """Sets the same values on many invoices in one statement"""
+        if not invoice_ids:
+            return None
+        stmt = (
+            update(SaleInvoice)
+            .where(SaleInvoice.organization_id == organization_id, SaleInvoice.id.in_(invoice_ids))
+            .values(**data, updated_by=user_id)
+        )
+        await self.db.execute(stmt)
+        await self.db.flush()
+        return None
+
     async def delete_invoice(self, organization_id: int, invoice_id: int) -> None:
         stmt = delete(SaleInvoice).where(SaleInvoice.organization_id == organization_id, SaleInvoice.id == invoice_id)
         await self.db.execute(stmt)
@@ -150,3 +164,79 @@ class SaleInvoiceRepository:
 
         result = await self.db.execute(stmt)
         return int(result.scalars().first() or 0)
+
+    async def create_submission(self, organization_id: int, branch_id: int, user_id: int, invoice_id: int) -> SaleInvoiceSubmission:
+        submission = SaleInvoiceSubmission(
+            organization_id=organization_id,
+            branch_id=branch_id,
+            invoice_id=invoice_id,
+            status=SubmissionStatus.PENDING.value,
+            attempts=0,
+            created_by=user_id,
+        )
+        self.db.add(submission)
+        await self.db.flush()
+        await self.db.refresh(submission)
+        return submission
+
+    async def create_submissions(self, organization_id: int, branch_id: int, user_id: int, invoice_ids: List[int]) -> List[SaleInvoiceSubmission]:
+        """Queues many invoices in one statement, the submissions are returned in the order of invoice_ids"""
+        if not invoice_ids:
+            return []
+        data = [
+            {
+                "organization_id": organization_id,
+                "branch_id": branch_id,
+                "invoice_id": invoice_id,
+                "status": SubmissionStatus.PENDING.value,
+                "attempts": 0,
+                "created_by": user_id,
+            }
+            for invoice_id in invoice_ids
+        ]
+        stmt = insert(SaleInvoiceSubmission).returning(SaleInvoiceSubmission, sort_by_parameter_order=True)
+        result = await self.db.execute(stmt, data)
+        await self.db.flush()
+        return list(result.scalars().all())
+
+    async def get_last_submission(self, organization_id: int, invoice_id: int) -> Optional[SaleInvoiceSubmission]:
+        stmt = (
+            select(SaleInvoiceSubmission)
+            .where(SaleInvoiceSubmission.organization_id == organization_id, SaleInvoiceSubmission.invoice_id == invoice_id)
+            .order_by(SaleInvoiceSubmission.id.desc())
+            .limit(1)
+        )
+        result = await self.db.execute(stmt)
+        return result.scalars().first()
+
+    async def claim_submissions(self, limit: int, lease: timedelta) -> List[SaleInvoiceSubmission]:
+        """Marks up to limit due submissions as PROCESSING for the length of the lease and returns them, oldest first.
+        Rows locked by another worker are skipped, a PROCESSING row whose lease ran out was left by a worker that
+        stopped and is claimed again."""
+        now = func.now()
+        due = (
+            select(SaleInvoiceSubmission.id)
+            .where(or_(
+                and_(SaleInvoiceSubmission.status == SubmissionStatus.PENDING.value, SaleInvoiceSubmission.available_at <= now),
+                and_(SaleInvoiceSubmission.status == SubmissionStatus.PROCESSING.value, SaleInvoiceSubmission.locked_until < now),
+            ))
+            .order_by(SaleInvoiceSubmission.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(SaleInvoiceSubmission)
+            .where(SaleInvoiceSubmission.id.in_(due.scalar_subquery()))
+            .values(
+                status=SubmissionStatus.PROCESSING.value,
+                attempts=SaleInvoiceSubmission.attempts + 1,
+                locked_until=now + lease,
+            )
+            .returning(SaleInvoiceSubmission)
+        )
+        result = await self.db.execute(stmt)
+        return sorted(result.scalars().all(), key=lambda submission: submission.id)
+
+    async def update_submission(self, id: int, data: Dict[str, Any]) -> None:
+        stmt = update(SaleInvoiceSubmission).where(SaleInvoiceSubmission.id == id).values(**data)
+        await self.db.execute(stmt)
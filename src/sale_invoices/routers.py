@@ -3,6 +3,7 @@ from typing import Annotated
 
 from src.core.dependencies.auth import get_request_context
 from src.core.schemas import (
+    ObjectListResponse,
     PaginatedResponse,
     PagintationParams,
     SingleObjectResponse,
@@ -23,6 +24,8 @@ from .schemas import (
     SaleInvoiceCreate,
     SaleInvoiceOut,
     SaleInvoiceUpdateStatus,
+    SaleInvoiceSubmissionOut,
+    SaleInvoiceBulkSubmit,
 )
 from src.core.enums import DocumentType
 
@@ -72,6 +75,21 @@ async def get_invoice(
     data = await invoice_service.get_invoice(request_context, id)
     return SingleObjectResponse(data=data)
 
+@router.get(
+    path="/{id}/submission",
+    response_model=SingleObjectResponse[SaleInvoiceSubmissionOut],
+    responses=RESPONSES["get_invoice_submission"],
+    summary=SUMMARIES["get_invoice_submission"],
+    description=DOCSTRINGS["get_invoice_submission"],
+)
+async def get_invoice_submission(
+    id: int,
+    invoice_service: Annotated[SaleInvoiceService, Depends(get_invoice_service)],
+    request_context: Annotated[RequestContext, Depends(get_request_context)],
+) -> SingleObjectResponse[SaleInvoiceSubmissionOut]:
+    data = await invoice_service.get_invoice_submission(request_context, id)
+    return SingleObjectResponse(data=data)
+
 
 # =========================================================
 # POST routes
@@ -133,19 +151,35 @@ async def convert_invoice(
     data = await invoice_service.convert_quotation_to_invoice(request_context, id, body)
     return SingleObjectResponse(data=data)
 
+@router.post(
+    path="/submit",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ObjectListResponse[SaleInvoiceSubmissionOut],
+    responses=RESPONSES["submit_invoices"],
+    summary=SUMMARIES["submit_invoices"],
+    description=DOCSTRINGS["submit_invoices"],
+)
+async def submit_invoices_to_tax_authority(
+    body: SaleInvoiceBulkSubmit,
+    invoice_service: Annotated[SaleInvoiceService, Depends(get_invoice_service)],
+    request_context: Annotated[RequestContext, Depends(get_request_context)],
+) -> ObjectListResponse[SaleInvoiceSubmissionOut]:
+    data = await invoice_service.submit_invoices_to_tax_authority(request_context, body.invoice_ids)
+    return ObjectListResponse(data=data)
+
 @router.post(
     path="/submit/{id}",
-    status_code=status.HTTP_200_OK,
-    response_model=SingleObjectResponse[SaleInvoiceOut],
-    responses=RESPONSES["create_invoice"],
-    summary=SUMMARIES["create_invoice"],
-    description=DOCSTRINGS["create_invoice"],
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=SingleObjectResponse[SaleInvoiceSubmissionOut],
+    responses=RESPONSES["submit_invoice"],
+    summary=SUMMARIES["submit_invoice"],
+    description=DOCSTRINGS["submit_invoice"],
 )
 async def submit_invoice_to_tax_authority(
     id: int,
     invoice_service: Annotated[SaleInvoiceService, Depends(get_invoice_service)],
     request_context: Annotated[RequestContext, Depends(get_request_context)],
-) -> SingleObjectResponse[SaleInvoiceOut]:
+) -> SingleObjectResponse[SaleInvoiceSubmissionOut]:
     data = await invoice_service.submit_invoice_to_tax_authority(request_context, id)
     return SingleObjectResponse(data=data)
 
@@ -21,6 +21,7 @@ from src.core.enums import (
     TaxCategory,
     InvoiceStatus,
     InvoiceTaxAuthorityStatus,
+    SubmissionStatus,
 )
 from src.points_of_sale.schemas import PointOfSaleOut
 from src.projects.schemas import ProjectOut
@@ -243,3 +244,19 @@ class GetInvoiceNumberRequest(BaseModel):
 
 class GetInvoiceNumberResponse(BaseModel):
     invoice_number: str
+
+
+class SaleInvoiceBulkSubmit(BaseModel):
+    invoice_ids: list[int] = Field(..., min_length=1, max_length=5000, description="Issued invoices of the branch, signed as one run in this order and queued for the tax authority")
+
+class SaleInvoiceSubmissionOut(BaseModel):
+    id: int
+    invoice_id: int
+    status: SubmissionStatus = Field(..., description="Where the submission is in the queue")
+    attempts: int = Field(..., description="Number of times a worker tried to send the invoice")
+    available_at: Optional[datetime] = Field(None, description="When the next attempt is made, for a PENDING submission")
+    tax_authority_status: Optional[InvoiceTaxAuthorityStatus] = Field(None, description="The answer of the tax authority, once it is SUCCEEDED")
+    last_error: Optional[str] = Field(None, description="Why the last attempt failed")
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
@@ -9,6 +9,7 @@ from src.core.consts import TAX_RATE, KSA_TZ
 from src.core.schemas.context import RequestContext
 from src.items.services import ItemService
 from src.tax_authorities.services import TaxAuthorityService
+from ..models import SaleInvoice
 from ..repositories import SaleInvoiceRepository
 from ..schemas import (
     PagintationParams,
@@ -21,11 +22,13 @@ from ..schemas import (
     SaleInvoiceOut,
     SaleInvoiceUpdate,
     SaleInvoiceUpdateStatus,
+    SaleInvoiceSubmissionOut,
 )
 from ..exceptions import (
     BaseAppException,
     InvoiceSendNotAllowed,
     InvoiceNotFoundException,
+    InvoiceSubmissionNotFoundException,
     InvoiceUpdateNotAllowed,
     InvoiceDeleteNotAllowed,
     CreditDebitNoteNotAllowed,
@@ -127,6 +130,14 @@ class SaleInvoiceService:
         if is_invoice and data.instruction_note is not None:
             raise SaleInvoiceValidationException("Instruction note should be empty for invoices")
 
+    def _validate_invoice_before_submit(self, invoice: SaleInvoiceHeaderOut | SaleInvoice) -> None:
+        if invoice.document_type != DocumentType.INVOICE:
+            raise InvoiceSendNotAllowed(detail="Quotations can not be sent to tax authority")
+        if invoice.status != InvoiceStatus.ISSUED:
+            raise  InvoiceSendNotAllowed(detail="Only issued invoices can be sent to the tax authority")
+        if invoice.tax_authority_status in {InvoiceTaxAuthorityStatus.ACCEPTED, InvoiceTaxAuthorityStatus.ACCEPTED_WITH_WARNINGS}:
+            raise InvoiceUpdateNotAllowed(detail="Invoice has already been sent to the tax authority successfully")
+
     async def _get_invoice_header(self, ctx: RequestContext, invoice_id: int) -> SaleInvoiceHeaderOut:
         db_invoice = await self.repo.get_invoice(ctx.organization.id, invoice_id)
         if not db_invoice:
@@ -327,17 +338,72 @@ class SaleInvoiceService:
         except Exception as e:
             raise e
 
-    async def submit_invoice_to_tax_authority(self, ctx: RequestContext, invoice_id: int) -> SaleInvoiceOut:
+    async def submit_invoice_to_tax_authority(self, ctx: RequestContext, invoice_id: int) -> SaleInvoiceSubmissionOut:
+        """Queues the invoice to be sent to the tax authority by SaleInvoiceSubmissionWorker, in the current
+        transaction, and returns the submission to follow it with."""
+        try:
+            db_invoice = await self.repo.get_invoice(ctx.organization.id, invoice_id)
+            if not db_invoice:
+                raise InvoiceNotFoundException()
+            self._validate_invoice_before_submit(db_invoice)
+            if db_invoice.tax_authority_status == InvoiceTaxAuthorityStatus.PENDING:
+                raise InvoiceUpdateNotAllowed(detail="Invoice is already waiting to be sent to the tax authority")
+            submission = await self.repo.create_submission(ctx.organization.id, ctx.branch.id, ctx.user.id, invoice_id)
+            await self.repo.update_invoice(
+                ctx.organization.id,
+                ctx.user.id,
+                invoice_id,
+                {"tax_authority_status": InvoiceTaxAuthorityStatus.PENDING}
+            )
+            return SaleInvoiceSubmissionOut.model_validate(submission)
+        except IntegrityError as e:
+            raise_integrity_error(e)
+        except Exception as e:
+            raise e
+
+    async def submit_invoices_to_tax_authority(self, ctx: RequestContext, invoice_ids: List[int]) -> List[SaleInvoiceSubmissionOut]:
+        """Signs many invoices as one run, such as the end of day invoices of a point of sale, and queues them to be
+        sent to the tax authority by SaleInvoiceSubmissionWorker, in the current transaction. The chains of the branch
+        stay locked until the transaction is committed, the worker sends the invoices after it with these signatures."""
+        try:
+            invoices: List[SaleInvoiceOut] = []
+            for invoice_id in dict.fromkeys(invoice_ids):
+                invoice = await self.get_invoice(ctx, invoice_id)
+                self._validate_invoice_before_submit(invoice)
+                if invoice.tax_authority_status == InvoiceTaxAuthorityStatus.PENDING:
+                    raise InvoiceUpdateNotAllowed(detail=f"Invoice {invoice.invoice_number} is already waiting to be sent to the tax authority")
+                invoices.append(invoice)
+            await self.tax_authority_service.sign_invoices(ctx, invoices)
+            submissions = await self.repo.create_submissions(ctx.organization.id, ctx.branch.id, ctx.user.id, [invoice.id for invoice in invoices])
+            await self.repo.update_invoices(
+                ctx.organization.id,
+                ctx.user.id,
+                [invoice.id for invoice in invoices],
+                {"tax_authority_status": InvoiceTaxAuthorityStatus.PENDING}
+            )
+            return [SaleInvoiceSubmissionOut.model_validate(submission) for submission in submissions]
+        except IntegrityError as e:
+            raise_integrity_error(e)
+        except Exception as e:
+            raise e
+
+    async def sign_invoice_for_tax_authority(self, ctx: RequestContext, invoice_id: int) -> None:
+        """Signs the invoice ahead of sending it. Called by the worker in a transaction of its own, so the chain of
+        the branch is only locked while the invoice is signed and not while it is sent."""
+        invoice = await self.get_invoice(ctx, invoice_id)
+        if not invoice:
+            raise InvoiceNotFoundException()
+        self._validate_invoice_before_submit(invoice)
+        await self.tax_authority_service.sign_invoice(ctx, invoice)
+        return None
+
+    async def send_invoice_to_tax_authority(self, ctx: RequestContext, invoice_id: int) -> SaleInvoiceOut:
+        """Signs the invoice and sends it to the tax authority now. Called by the worker for a queued invoice."""
         try:
             invoice = await self.get_invoice(ctx, invoice_id)
             if not invoice:
                 raise InvoiceNotFoundException()
-            if invoice.document_type != DocumentType.INVOICE:
-                raise InvoiceSendNotAllowed(detail="Quotations can not be sent to tax authority")
-            if invoice.status != InvoiceStatus.ISSUED:
-                raise  InvoiceSendNotAllowed(detail="Only issued invoices can be sent to the tax authority")
-            if invoice.tax_authority_status in {InvoiceTaxAuthorityStatus.ACCEPTED, InvoiceTaxAuthorityStatus.ACCEPTED_WITH_WARNINGS}:
-                raise InvoiceUpdateNotAllowed(detail="Invoice has already been sent to the tax authority successfully")
+            self._validate_invoice_before_submit(invoice)
 
             tax_authority_result = await self.tax_authority_service.sign_and_submit_invoice(ctx, invoice)
             await self.repo.update_invoice(
@@ -346,12 +412,25 @@ class SaleInvoiceService:
                 invoice.id, 
                 {"tax_authority_status": tax_authority_result.status}
             )
-            return await self.get_invoice(ctx, invoice.id)
+            # The invoice read above with what sending it changed, instead of reading all of it again
+            invoice.tax_authority_status = tax_authority_result.status
+            invoice.tax_authority_data = tax_authority_result
+            return invoice
         except IntegrityError as e:
             raise_integrity_error(e)
         except Exception as e:
             raise e
 
+    async def get_invoice_submission(self, ctx: RequestContext, invoice_id: int) -> SaleInvoiceSubmissionOut:
+        """Returns the last submission of the invoice to the tax authority."""
+        db_invoice = await self.repo.get_invoice(ctx.organization.id, invoice_id)
+        if not db_invoice:
+            raise InvoiceNotFoundException()
+        submission = await self.repo.get_last_submission(ctx.organization.id, invoice_id)
+        if not submission:
+            raise InvoiceSubmissionNotFoundException()
+        return SaleInvoiceSubmissionOut.model_validate(submission)
+
     async def convert_quotation_to_invoice(self, ctx: RequestContext, invoice_id: int, convert_data: QuotationConvert) -> SaleInvoiceOut:
         try:
             invoice_header = await self._get_invoice_header(ctx, invoice_id)
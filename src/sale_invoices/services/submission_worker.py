@@ -0,0 +1,200 @@
+import asyncio
+from datetime import timedelta
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from src.core.config import settings
+from src.core.database import async_session
+from src.core.enums import InvoiceTaxAuthorityStatus, SubmissionStatus, TaxAuthority
+from src.core.exceptions import BaseAppException
+from src.core.schemas.context import RequestContext
+from src.core.services import AsyncRequestService
+from src.branches.repositories import BranchRepository
+from src.branches.schemas import BranchOut
+from src.customers.repositories import CustomerRepository
+from src.customers.services import CustomerService
+from src.items.repositories import ItemRepository
+from src.items.services import ItemService
+from src.organizations.repositories import OrganizationRepository
+from src.organizations.schemas import OrganizationOut
+from src.users.repositories import UserRepository
+from src.users.schemas import UserOut
+from src.tax_authorities.services import TaxAuthorityService
+from src.tax_authorities.no_tax_authority.services import NoTaxAuthorityService
+from src.tax_authorities.zatca_phase1.services import ZatcaPhase1Service
+from src.tax_authorities.zatca_phase2.repositories import ZatcaRepository
+from src.tax_authorities.zatca_phase2.services import ZatcaPhase2Service
+from ..models import SaleInvoiceSubmission
+from ..repositories import SaleInvoiceRepository
+from ..exceptions import InvoiceSendNotAllowed
+from .full_service import SaleInvoiceService
+from .raw_service import SaleInvoiceServiceRaw
+
+
+class SaleInvoiceSubmissionWorker:
+    """Sends the invoices queued in sale_invoice_submissions to the tax authority, away from the requests that
+    queued them.
+
+    Every poll claims the due submissions with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers, in the
+    app or in scripts/submission_worker.py, share the queue without sending an invoice twice. Each submission is
+    signed in a transaction of its own, which holds the lock on the chain of its branch only while signing, then
+    sent in another one, so the invoices of a branch are sent in parallel like those of different branches. A
+    failure the tax authority may recover from, such as a timeout or a 5xx, is retried after RETRY_DELAYS with the
+    invoice signed the first time, any other one marks the submission FAILED and the invoice NOT_SENT so it can be
+    submitted again.
+    """
+
+    # Seconds before the next attempt, by the number of attempts made so far
+    RETRY_DELAYS = (5, 30, 120, 600, 1800)
+
+    def __init__(
+        self,
+        request_service: AsyncRequestService,
+        session_factory: async_sessionmaker[AsyncSession] = async_session,
+        concurrency: int = settings.SUBMISSION_WORKERS,
+        batch_size: int = settings.SUBMISSION_BATCH_SIZE,
+        poll_interval: float = settings.SUBMISSION_POLL_INTERVAL,
+        max_attempts: int = settings.SUBMISSION_MAX_ATTEMPTS,
+        lease_seconds: int = settings.SUBMISSION_LEASE_SECONDS,
+    ) -> None:
+        if concurrency < 1:
+            raise ValueError("The submission worker needs a concurrency of at least one")
+        self.request_service = request_service
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        # Only as many submissions as are sent at once are claimed, so each starts right away and its lease is not
+        # spent waiting behind the others of the batch, where another worker would claim and send it again
+        self.claim_size = min(batch_size, concurrency)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = timedelta(seconds=lease_seconds)
+        self._stopping = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Runs the worker in the background of the current event loop"""
+        self._stopping.clear()
+        self._task = asyncio.create_task(self.run())
+
+    def request_stop(self) -> None:
+        """Makes the worker stop once the submissions it claimed are done"""
+        self._stopping.set()
+
+    async def stop(self) -> None:
+        self.request_stop()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def run(self) -> None:
+        """Sends the queued invoices until request_stop() is called"""
+        while not self._stopping.is_set():
+            try:
+                claimed = await self.run_once()
+            except Exception:
+                # The database is unreachable, the claimed submissions are claimed again once their lease runs out
+                claimed = 0
+            if claimed < self.claim_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> int:
+        """Claims the due submissions the worker can send at once and sends them, returns the number claimed"""
+        async with self.session_factory() as session:
+            async with session.begin():
+                submissions = await SaleInvoiceRepository(session).claim_submissions(self.claim_size, self.lease)
+        await asyncio.gather(*(self.process(submission) for submission in submissions))
+        return len(submissions)
+
+    async def process(self, submission: SaleInvoiceSubmission) -> None:
+        """Sends one claimed submission and records the outcome"""
+        try:
+            # Signed and committed first, the chain of the branch is free again before the invoice is sent
+            async with self.session_factory() as session:
+                async with session.begin():
+                    ctx = await self._get_context(session, submission)
+                    await self._get_invoice_service(session, ctx).sign_invoice_for_tax_authority(ctx, submission.invoice_id)
+            async with self.session_factory() as session:
+                async with session.begin():
+                    repo = SaleInvoiceRepository(session)
+                    invoice = await self._get_invoice_service(session, ctx).send_invoice_to_tax_authority(ctx, submission.invoice_id)
+                    if invoice.tax_authority_status == InvoiceTaxAuthorityStatus.NOT_SENT:
+                        await self._retry_or_fail(repo, submission, "The tax authority did not process the invoice", retryable=True)
+                    else:
+                        await repo.update_submission(submission.id, {
+                            "status": SubmissionStatus.SUCCEEDED.value,
+                            "tax_authority_status": invoice.tax_authority_status.value,
+                            "locked_until": None,
+                            "last_error": None,
+                        })
+        except Exception as e:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    await self._retry_or_fail(SaleInvoiceRepository(session), submission, self._describe_error(e), self._is_retryable(e))
+
+    async def _retry_or_fail(self, repo: SaleInvoiceRepository, submission: SaleInvoiceSubmission, error: str, retryable: bool) -> None:
+        if retryable and submission.attempts < self.max_attempts:
+            delay = self.RETRY_DELAYS[min(submission.attempts, len(self.RETRY_DELAYS)) - 1]
+            data = {
+                "status": SubmissionStatus.PENDING.value,
+                "available_at": func.now() + timedelta(seconds=delay),
+                "locked_until": None,
+                "last_error": error,
+            }
+            tax_authority_status = InvoiceTaxAuthorityStatus.PENDING
+        else:
+            data = {"status": SubmissionStatus.FAILED.value, "locked_until": None, "last_error": error}
+            tax_authority_status = InvoiceTaxAuthorityStatus.NOT_SENT
+        await repo.update_submission(submission.id, data)
+        invoice = await repo.get_invoice(submission.organization_id, submission.invoice_id)
+        # An invoice accepted in the meantime, through another submission, keeps its status
+        if invoice is not None and invoice.tax_authority_status in {InvoiceTaxAuthorityStatus.PENDING, InvoiceTaxAuthorityStatus.NOT_SENT}:
+            await repo.update_invoice(submission.organization_id, submission.created_by, submission.invoice_id, {"tax_authority_status": tax_authority_status})
+
+    def _is_retryable(self, error: Exception) -> bool:
+        """Errors of the application are final unless the tax authority timed out, throttled or failed itself"""
+        if isinstance(error, BaseAppException):
+            return error.status_code in {408, 429} or error.status_code >= 500
+        return True
+
+    def _describe_error(self, error: Exception) -> str:
+        if isinstance(error, BaseAppException) and error.detail:
+            return error.detail
+        return f"{type(error).__name__}: {error}"
+
+    async def _get_context(self, session: AsyncSession, submission: SaleInvoiceSubmission) -> RequestContext:
+        """The context of the request that queued the submission"""
+        user = await UserRepository(session).get(submission.created_by)
+        organization = await OrganizationRepository(session).get(submission.organization_id)
+        branch = await BranchRepository(session).get_branch(submission.organization_id, submission.branch_id)
+        if user is None or organization is None or branch is None:
+            raise InvoiceSendNotAllowed(detail="The user, organization or branch that submitted the invoice no longer exists")
+        return RequestContext(
+            user=UserOut.model_validate(user),
+            organization=OrganizationOut.model_validate(organization),
+            branch=BranchOut.model_validate(branch),
+        )
+
+    def _get_tax_authority_service(self, session: AsyncSession, ctx: RequestContext, item_service: ItemService, customer_service: CustomerService) -> TaxAuthorityService:
+        """Same choice as get_tax_authority_service, outside of a request"""
+        if ctx.organization.tax_authority is None:
+            return NoTaxAuthorityService()
+        if ctx.organization.tax_authority == TaxAuthority.ZATCA_PHASE1:
+            return ZatcaPhase1Service()
+        sale_invoice_service_raw = SaleInvoiceServiceRaw(
+            repo=SaleInvoiceRepository(session),
+            customer_service=customer_service,
+            item_service=item_service,
+        )
+        return ZatcaPhase2Service(ZatcaRepository(session), self.request_service, item_service, customer_service, sale_invoice_service_raw)
+
+    def _get_invoice_service(self, session: AsyncSession, ctx: RequestContext) -> SaleInvoiceService:
+        item_service = ItemService(ItemRepository(session))
+        customer_service = CustomerService(CustomerRepository(session))
+        return SaleInvoiceService(
+            repo=SaleInvoiceRepository(session),
+            item_service=item_service,
+            tax_authority_service=self._get_tax_authority_service(session, ctx, item_service, customer_service),
+        )
@@ -10,6 +10,7 @@ from .zatca_phase2.schemas import (
     ZatcaPhase2BranchDataCreate,
     ZatcaPhase2BranchDataComplete,
     ZatcaPhase2BranchDataOut,
+    ZatcaPhase2PointOfSaleDataCreate,
 )
 
 InvoiceTaxAuthorityDataCreate = Annotated[
@@ -49,6 +50,11 @@ BranchTaxAuthorityDataComplete = Annotated[
     Union[ZatcaPhase2BranchDataComplete],
     Field(discriminator="tax_authority")
 ]
+
+PointOfSaleTaxAuthorityDataCreate = Annotated[
+    Union[ZatcaPhase2PointOfSaleDataCreate],
+    Field(discriminator="tax_authority")
+]
 # class BranchTaxAuthorityDataCreate(TaxAuthorityDiscriminator):
 #     pass
 
@@ -3,6 +3,7 @@ from typing import Optional, Any
 from src.core.enums import BranchTaxIntegrationStatus
 from src.sale_invoices.schemas import SaleInvoiceOut
 from .schemas import InvoiceTaxAuthorityDataOut, InvoiceLineTaxAuthorityDataOut, BranchTaxAuthorityDataOut
+from .exceptions import IncorrectTaxAuthorityException
 from src.core.schemas.context import RequestContext
 
 class TaxAuthorityService(ABC):
@@ -11,6 +12,14 @@ class TaxAuthorityService(ABC):
         """Signs the invoice and submits it to the tax authority."""
         pass
 
+    async def sign_invoice(self, request_context: RequestContext, invoice: SaleInvoiceOut, metadata: dict = {}) -> Optional[InvoiceTaxAuthorityDataOut]:
+        """Signs the invoice ahead of submitting it, for tax authorities that chain their invoices. Does nothing by default."""
+        return None
+
+    async def sign_invoices(self, request_context: RequestContext, invoices: list[SaleInvoiceOut], metadata: dict = {}) -> list[Optional[InvoiceTaxAuthorityDataOut]]:
+        """Signs many invoices ahead of submitting them, in the order given. Signs them one by one by default."""
+        return [await self.sign_invoice(request_context, invoice, metadata) for invoice in invoices]
+
     @abstractmethod
     async def get_invoice_tax_authority_data(self, request_context: RequestContext, invoice_id: int) -> Optional[InvoiceTaxAuthorityDataOut]:
         """Retrieves compliance data for a specific invoice."""
@@ -46,6 +55,18 @@ class TaxAuthorityService(ABC):
         """Retrieves branch compliance data for tax authority."""
         pass
 
+    async def create_point_of_sale_tax_authority_data(self, request_context: RequestContext, point_of_sale_id: int, data: Any) -> Optional[BranchTaxAuthorityDataOut]:
+        """Registers a point of sale as a device of its own with the tax authority. Not supported by default."""
+        raise IncorrectTaxAuthorityException()
+
+    async def complete_point_of_sale_tax_authority_data(self, request_context: RequestContext, point_of_sale_id: int, data: Any) -> Optional[BranchTaxAuthorityDataOut]:
+        """Completes the registration of a point of sale with the tax authority. Not supported by default."""
+        raise IncorrectTaxAuthorityException()
+
+    async def get_point_of_sale_tax_authority_data(self, request_context: RequestContext, point_of_sale_id: int) -> Optional[BranchTaxAuthorityDataOut]:
+        """Retrieves the tax authority data of a point of sale, None when it is not registered on its own."""
+        return None
+
     @abstractmethod
     async def create_invoice_tax_authority_data(self, request_context: RequestContext, invoice_id: int, data: Any) -> Optional[InvoiceTaxAuthorityDataOut]:
         """Creates invoice compliance data for tax authority."""
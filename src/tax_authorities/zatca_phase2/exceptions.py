@@ -21,6 +21,11 @@ class ZatcaInvoiceSigningException(BaseAppException):
     def __init__(self, detail: str | None = "An error has occurred when signing the invoice", status_code: int = status.HTTP_400_BAD_REQUEST):
         super().__init__(detail, status_code)
 
+class ZatcaInvoiceValidationException(BaseAppException):
+    """Raised when the invoice breaks a ZATCA rule and would be rejected, it is not signed nor sent"""
+    def __init__(self, detail: str | None = "The invoice does not comply with the ZATCA rules", status_code: int = status.HTTP_422_UNPROCESSABLE_ENTITY):
+        super().__init__(detail, status_code)
+
 class ZatcaBranchDataNotFoundException(BaseAppException):
     def __init__(self, 
         detail: str | None = "Tax authority data for this branch was not found", 
@@ -42,3 +47,22 @@ class ZatcaBranchDataAlreadyCreatedException(BaseAppException):
     ):
         super().__init__(detail, status_code)
 
+
+class ZatcaPointOfSaleOnboardingNotAllowedException(BaseAppException):
+    def __init__(self, 
+        detail: str | None = "The branch must complete its tax authority onboarding before its points of sale can be registered", 
+        status_code: int = status.HTTP_403_FORBIDDEN,
+    ):
+        super().__init__(detail, status_code)
+
+class ZatcaPointOfSaleDataAlreadyCreatedException(BaseAppException):
+    def __init__(self, 
+        detail: str | None = "This point of sale is already registered as an EGS unit", 
+        status_code: int = status.HTTP_409_CONFLICT,
+    ):
+        super().__init__(detail, status_code)
+
+class ZatcaInvoiceConflictException(BaseAppException):
+    """Raised when Zatca answers that an invoice with the same uuid was already submitted, without saying it accepted this one"""
+    def __init__(self, detail: str | None = "Zatca already has an invoice with this uuid", status_code: int = status.HTTP_409_CONFLICT):
+        super().__init__(detail, status_code)
@@ -9,6 +9,7 @@ class ZatcaPhase2SaleInvoiceData(Base, AuditMixin):
     id = Column(Integer, autoincrement=True, primary_key=True, index=True)
     tax_authority = Column(String(50), nullable=True, default=TaxAuthority.ZATCA_PHASE2.value)
     invoice_id = Column(Integer, ForeignKey('sale_invoices.id', ondelete="CASCADE"))
+    point_of_sale_id = Column(Integer, ForeignKey('points_of_sale.id'), nullable=True)
     icv = Column(Integer, nullable=True)
     signed_xml_base64 = Column(Text, nullable=True)
     invoice_hash = Column(Text, nullable=True)
@@ -34,6 +35,7 @@ class ZatcaPhase2BranchData(Base, AuditMixin):
     tax_authority = Column(String(50), nullable=True, default=TaxAuthority.ZATCA_PHASE2.value)
     organization_id = Column(Integer, ForeignKey('organizations.id'))
     branch_id = Column(Integer, ForeignKey('branches.id'))
+    point_of_sale_id = Column(Integer, ForeignKey('points_of_sale.id', ondelete="CASCADE"), nullable=True, index=True)
     stage = Column(String, nullable=True)
     icv = Column(Integer, nullable=True)
     pih = Column(Text, nullable=True)
@@ -60,6 +62,7 @@ class ZatcaPhase2CSID(Base, AuditMixin):
     stage = Column(String(50), nullable=True)
     organization_id = Column(Integer, ForeignKey('organizations.id'))
     branch_id = Column(Integer, ForeignKey('branches.id'))
+    point_of_sale_id = Column(Integer, ForeignKey('points_of_sale.id', ondelete="CASCADE"), nullable=True, index=True)
     private_key = Column(String, nullable=False)
     csr_base64 = Column(String, nullable=False)
     request_id = Column(String, nullable=False)
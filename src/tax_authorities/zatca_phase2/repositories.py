@@ -1,15 +1,18 @@
 from typing import Any, Dict, List, Optional, Tuple
 
-from sqlalchemy import and_, func, insert, select, update, delete, distinct
+from sqlalchemy import and_, or_, func, insert, select, update, delete, distinct
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .models import ZatcaPhase2BranchData, ZatcaPhase2CSID, ZatcaPhase2SaleInvoiceLineData, ZatcaPhase2SaleInvoiceData
-from src.core.enums import ZatcaPhase2Stage, InvoiceType
+from src.core.enums import ZatcaPhase2Stage, InvoiceType, InvoiceTaxAuthorityStatus
 
 
 class ZatcaRepository:
     def __init__(self, db: AsyncSession) -> None:
         self.db = db
+        # Rows already read through this repository, which lives as long as the request or the transaction using it
+        self._submission_units: dict[tuple, tuple[ZatcaPhase2BranchData, ZatcaPhase2CSID | None] | None] = {}
+        self._lines_tax_authority_data: dict[int, ZatcaPhase2SaleInvoiceLineData | None] = {}
 
     async def get_csid(self, id: int, stage: ZatcaPhase2Stage) -> ZatcaPhase2CSID | None:
         stmt = (
@@ -19,15 +22,22 @@ class ZatcaRepository:
         result = await self.db.execute(stmt)
         return result.scalars().first()
 
-    async def get_csid_by_branch(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage) -> ZatcaPhase2CSID | None:
+    async def get_csid_by_branch(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> ZatcaPhase2CSID | None:
+        """Returns the CSID of the EGS unit of the point of sale, or of the branch itself without point_of_sale_id"""
         stmt = (
             select(ZatcaPhase2CSID)
-            .where(ZatcaPhase2CSID.organization_id == organization_id, ZatcaPhase2CSID.branch_id == branch_id, ZatcaPhase2CSID.stage == stage)
+            .where(
+                ZatcaPhase2CSID.organization_id == organization_id,
+                ZatcaPhase2CSID.branch_id == branch_id,
+                ZatcaPhase2CSID.stage == stage,
+                ZatcaPhase2CSID.point_of_sale_id.is_not_distinct_from(point_of_sale_id),
+            )
         )
         result = await self.db.execute(stmt)
         return result.scalars().first()
 
     async def create_csid(self, organizaion_id: int, branch_id: int, data: dict) -> ZatcaPhase2CSID | None:
+        self._submission_units.clear()
         csid = ZatcaPhase2CSID(**data)
         csid.organization_id = organizaion_id
         csid.branch_id = branch_id
@@ -37,6 +47,7 @@ class ZatcaRepository:
         return csid
 
     async def update_csid(self, user_id: int, id: int, data: dict) -> ZatcaPhase2CSID | None:
+        self._submission_units.clear()
         stmt = (
             update(ZatcaPhase2CSID)
             .where(ZatcaPhase2CSID.id == id)
@@ -48,12 +59,14 @@ class ZatcaRepository:
         return result.scalars().first()
 
     async def delete_csid(self, id: int) -> None:
+        self._submission_units.clear()
         stmt = delete(ZatcaPhase2CSID).where(ZatcaPhase2CSID.id == id)
         await self.db.execute(stmt)
         await self.db.flush()
         return None
 
     async def create_branch_tax_authority_data(self, user_id: int, organization_id: int, branch_id: int, data: dict) -> ZatcaPhase2BranchData:
+        self._submission_units.clear()
         branch = ZatcaPhase2BranchData(**data)
         branch.created_by = user_id
         branch.organization_id = organization_id
@@ -63,10 +76,11 @@ class ZatcaRepository:
         await self.db.refresh(branch)
         return branch
 
-    async def update_branch_tax_authority_data(self, user_id: int, organization_id: int, branch_id: int, data: dict) -> ZatcaPhase2BranchData | None:
+    async def update_branch_tax_authority_data(self, user_id: int, organization_id: int, branch_id: int, data: dict, point_of_sale_id: int | None = None) -> ZatcaPhase2BranchData | None:
+        self._submission_units.clear()
         stmt = (
             update(ZatcaPhase2BranchData)
-            .where(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id)
+            .where(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.point_of_sale_id.is_not_distinct_from(point_of_sale_id))
             .values(updated_by = user_id, **data)
             .returning(ZatcaPhase2BranchData)
         )
@@ -74,11 +88,24 @@ class ZatcaRepository:
         await self.db.flush()
         return result.scalars().first()
 
-    async def update_pih_and_icv(self, branch_id: int, pih: str) -> ZatcaPhase2BranchData | None:
+    async def lock_chain(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> tuple[int | None, str | None] | None:
+        """Locks the row holding the chain of the EGS unit in the stage until the end of the transaction and returns its
+        (icv, pih), those of the last signed invoice. Other transactions locking the same chain wait meanwhile. The
+        unit is the point of sale registered as one, or the branch itself without point_of_sale_id."""
+        stmt = (
+            select(ZatcaPhase2BranchData.icv, ZatcaPhase2BranchData.pih)
+            .where(and_(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage, ZatcaPhase2BranchData.point_of_sale_id.is_not_distinct_from(point_of_sale_id)))
+            .with_for_update()
+        )
+        result = await self.db.execute(stmt)
+        row = result.first()
+        return tuple(row) if row is not None else None
+
+    async def update_pih_and_icv(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage, icv: int, pih: str, point_of_sale_id: int | None = None) -> ZatcaPhase2BranchData | None:
         stmt = (
             update(ZatcaPhase2BranchData)
-            .where(ZatcaPhase2BranchData.branch_id == branch_id)
-            .values(pih=pih, icv=ZatcaPhase2BranchData.icv+1)
+            .where(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage, ZatcaPhase2BranchData.point_of_sale_id.is_not_distinct_from(point_of_sale_id))
+            .values(pih=pih, icv=icv)
             .returning(ZatcaPhase2BranchData)
         )
         result = await self.db.execute(stmt)
@@ -90,28 +117,29 @@ class ZatcaRepository:
         result = await self.db.execute(stmt)
         return result.scalars().first()
 
-    async def get_branch_tax_authority_data_by_branch(self, branch_id: int, stage: ZatcaPhase2Stage) -> ZatcaPhase2BranchData | None:
-        stmt = (select(ZatcaPhase2BranchData).where(ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage))
+    async def get_branch_tax_authority_data_by_branch(self, branch_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> ZatcaPhase2BranchData | None:
+        """Returns the data of the EGS unit of the point of sale, or of the branch itself without point_of_sale_id"""
+        stmt = (select(ZatcaPhase2BranchData).where(ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage, ZatcaPhase2BranchData.point_of_sale_id.is_not_distinct_from(point_of_sale_id)))
         result = await self.db.execute(stmt)
         return result.scalars().first()
 
     async def get_branch_stage(self, organization_id: int, branch_id: int) -> Optional[str]:
         stmt = select(ZatcaPhase2BranchData.stage).where(
-            and_(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id)
+            and_(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.point_of_sale_id.is_(None))
         )
         result = await self.db.execute(stmt)
         return result.scalars().first()
 
-    async def get_pih(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage) -> Optional[str]:
+    async def get_pih(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> Optional[str]:
         stmt = select(ZatcaPhase2BranchData.pih).where(
-            and_(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage)
+            and_(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage, ZatcaPhase2BranchData.point_of_sale_id.is_not_distinct_from(point_of_sale_id))
         )
         result = await self.db.execute(stmt)
         return result.scalars().first()
     
-    async def get_icv(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage) -> Optional[int]:
+    async def get_icv(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> Optional[int]:
         stmt = select(ZatcaPhase2BranchData.icv).where(
-            and_(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage)
+            and_(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, ZatcaPhase2BranchData.stage == stage, ZatcaPhase2BranchData.point_of_sale_id.is_not_distinct_from(point_of_sale_id))
         )
         result = await self.db.execute(stmt)
         return result.scalars().first()
@@ -122,7 +150,18 @@ class ZatcaRepository:
         await self.db.flush()
         return result.scalars().first()
 
+    async def create_invoices_tax_authority_data(self, data: list[dict]) -> list[ZatcaPhase2SaleInvoiceData]:
+        """Inserts many invoices in one statement, every dictionary holds the invoice_id of its row. The rows are
+        returned in the order of data."""
+        if not data:
+            return []
+        stmt = insert(ZatcaPhase2SaleInvoiceData).returning(ZatcaPhase2SaleInvoiceData, sort_by_parameter_order=True)
+        result = await self.db.execute(stmt, data)
+        await self.db.flush()
+        return list(result.scalars().all())
+
     async def create_line_tax_authority_data(self, invoice_id: int, invoice_line_id: int, data: dict) -> ZatcaPhase2SaleInvoiceLineData:
+        self._lines_tax_authority_data.pop(invoice_line_id, None)
         stmt = insert(ZatcaPhase2SaleInvoiceLineData).values(invoice_id=invoice_id, invoice_line_id=invoice_line_id, **data).returning(ZatcaPhase2SaleInvoiceLineData)
         result = await self.db.execute(stmt)
         await self.db.flush()
@@ -133,11 +172,143 @@ class ZatcaRepository:
         result = await self.db.execute(stmt)
         return result.scalars().first()
     
-    async def get_line_tax_authority_data(self, invoice_line_id: int) -> Optional[ZatcaPhase2SaleInvoiceLineData]:
-        stmt = select(ZatcaPhase2SaleInvoiceLineData).where(ZatcaPhase2SaleInvoiceLineData.invoice_line_id==invoice_line_id)
+    async def get_unsent_invoice_tax_authority_data(self, invoice_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> Optional[ZatcaPhase2SaleInvoiceData]:
+        """Returns the invoice signed in the stage by the EGS unit that Zatca did not process yet, if any"""
+        stmt = (
+            select(ZatcaPhase2SaleInvoiceData)
+            .where(
+                ZatcaPhase2SaleInvoiceData.invoice_id == invoice_id,
+                ZatcaPhase2SaleInvoiceData.stage == stage,
+                ZatcaPhase2SaleInvoiceData.point_of_sale_id.is_not_distinct_from(point_of_sale_id),
+                ZatcaPhase2SaleInvoiceData.status == InvoiceTaxAuthorityStatus.NOT_SENT,
+                ZatcaPhase2SaleInvoiceData.signed_xml_base64.is_not(None),
+            )
+            .order_by(ZatcaPhase2SaleInvoiceData.id.desc())
+        )
+        result = await self.db.execute(stmt)
+        return result.scalars().first()
+
+    async def get_unsent_invoices_tax_authority_data(self, invoice_ids: list[int], stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> dict[int, ZatcaPhase2SaleInvoiceData]:
+        """Same as get_unsent_invoice_tax_authority_data for many invoices in one query, by invoice id"""
+        if not invoice_ids:
+            return {}
+        stmt = (
+            select(ZatcaPhase2SaleInvoiceData)
+            .where(
+                ZatcaPhase2SaleInvoiceData.invoice_id.in_(invoice_ids),
+                ZatcaPhase2SaleInvoiceData.stage == stage,
+                ZatcaPhase2SaleInvoiceData.point_of_sale_id.is_not_distinct_from(point_of_sale_id),
+                ZatcaPhase2SaleInvoiceData.status == InvoiceTaxAuthorityStatus.NOT_SENT,
+                ZatcaPhase2SaleInvoiceData.signed_xml_base64.is_not(None),
+            )
+            .order_by(ZatcaPhase2SaleInvoiceData.id)
+        )
+        result = await self.db.execute(stmt)
+        # Ordered by id, the last row signed for an invoice is the one kept
+        return {signed_invoice.invoice_id: signed_invoice for signed_invoice in result.scalars().all()}
+
+    async def update_invoice_tax_authority_data(self, id: int, data: dict) -> ZatcaPhase2SaleInvoiceData:
+        stmt = update(ZatcaPhase2SaleInvoiceData).where(ZatcaPhase2SaleInvoiceData.id == id).values(**data).returning(ZatcaPhase2SaleInvoiceData)
         result = await self.db.execute(stmt)
+        await self.db.flush()
         return result.scalars().first()
+
+    async def get_line_tax_authority_data(self, invoice_line_id: int) -> Optional[ZatcaPhase2SaleInvoiceLineData]:
+        if invoice_line_id not in self._lines_tax_authority_data:
+            stmt = select(ZatcaPhase2SaleInvoiceLineData).where(ZatcaPhase2SaleInvoiceLineData.invoice_line_id==invoice_line_id)
+            result = await self.db.execute(stmt)
+            self._lines_tax_authority_data[invoice_line_id] = result.scalars().first()
+        return self._lines_tax_authority_data[invoice_line_id]
+
+    async def get_lines_tax_authority_data(self, invoice_line_ids: list[int]) -> dict[int, ZatcaPhase2SaleInvoiceLineData]:
+        """Returns the data of the invoice lines that have some by invoice line id, the lines not read yet in one query"""
+        missing_ids = [id for id in dict.fromkeys(invoice_line_ids) if id not in self._lines_tax_authority_data]
+        if missing_ids:
+            stmt = select(ZatcaPhase2SaleInvoiceLineData).where(ZatcaPhase2SaleInvoiceLineData.invoice_line_id.in_(missing_ids))
+            result = await self.db.execute(stmt)
+            self._lines_tax_authority_data.update(dict.fromkeys(missing_ids))
+            for line_tax_authority_data in result.scalars().all():
+                self._lines_tax_authority_data[line_tax_authority_data.invoice_line_id] = line_tax_authority_data
+        return {
+            id: self._lines_tax_authority_data[id]
+            for id in invoice_line_ids
+            if self._lines_tax_authority_data[id] is not None
+        }
+
+    async def get_submission_context(
+        self,
+        organization_id: int,
+        branch_id: int,
+        stage: ZatcaPhase2Stage,
+        point_of_sale_id: int | None,
+        invoice_line_ids: list[int],
+    ) -> tuple[ZatcaPhase2BranchData, ZatcaPhase2CSID | None, dict[int, ZatcaPhase2SaleInvoiceLineData]] | None:
+        """Returns everything signing and sending an invoice reads: the data of the EGS unit signing it, the CSID of the
+        unit and the data of the invoice lines. The unit is the point of sale once it is registered in production,
+        otherwise the branch in stage. Takes one query for the unit and its CSID and one for the lines, none for what
+        this repository already read. The icv and pih of the unit are only a snapshot, lock_chain() reads the ones to
+        sign with."""
+        key = (organization_id, branch_id, stage, point_of_sale_id)
+        if key not in self._submission_units:
+            unit_filter = and_(ZatcaPhase2BranchData.point_of_sale_id.is_(None), ZatcaPhase2BranchData.stage == stage)
+            if point_of_sale_id is not None:
+                unit_filter = or_(
+                    and_(ZatcaPhase2BranchData.point_of_sale_id == point_of_sale_id, ZatcaPhase2BranchData.stage == ZatcaPhase2Stage.PRODUCTION),
+                    unit_filter,
+                )
+            stmt = (
+                select(ZatcaPhase2BranchData, ZatcaPhase2CSID)
+                .outerjoin(
+                    ZatcaPhase2CSID,
+                    and_(
+                        ZatcaPhase2CSID.organization_id == ZatcaPhase2BranchData.organization_id,
+                        ZatcaPhase2CSID.branch_id == ZatcaPhase2BranchData.branch_id,
+                        ZatcaPhase2CSID.stage == ZatcaPhase2BranchData.stage,
+                        ZatcaPhase2CSID.point_of_sale_id.is_not_distinct_from(ZatcaPhase2BranchData.point_of_sale_id),
+                    ),
+                )
+                .where(ZatcaPhase2BranchData.organization_id == organization_id, ZatcaPhase2BranchData.branch_id == branch_id, unit_filter)
+                # The unit of the point of sale first
+                .order_by(ZatcaPhase2BranchData.point_of_sale_id.is_(None))
+            )
+            result = await self.db.execute(stmt)
+            row = result.first()
+            self._submission_units[key] = tuple(row) if row is not None else None
+        unit = self._submission_units[key]
+        if unit is None:
+            return None
+        branch_tax_authority_data, csid = unit
+        return branch_tax_authority_data, csid, await self.get_lines_tax_authority_data(invoice_line_ids)
     
+    async def get_invoices_tax_authority_data_to_backfill(self, after_id: int, limit: int) -> list[tuple[int, str, str | None, str | None]]:
+        """Returns (id, signed_xml_base64, base64_qr_code, invoice_hash) of the stored invoices missing their QR code
+        or hash, ordered by id and starting after after_id"""
+        stmt = (
+            select(
+                ZatcaPhase2SaleInvoiceData.id,
+                ZatcaPhase2SaleInvoiceData.signed_xml_base64,
+                ZatcaPhase2SaleInvoiceData.base64_qr_code,
+                ZatcaPhase2SaleInvoiceData.invoice_hash,
+            )
+            .where(
+                ZatcaPhase2SaleInvoiceData.id > after_id,
+                ZatcaPhase2SaleInvoiceData.signed_xml_base64.is_not(None),
+                (ZatcaPhase2SaleInvoiceData.base64_qr_code.is_(None)) | (ZatcaPhase2SaleInvoiceData.invoice_hash.is_(None)),
+            )
+            .order_by(ZatcaPhase2SaleInvoiceData.id)
+            .limit(limit)
+        )
+        result = await self.db.execute(stmt)
+        return [tuple(row) for row in result.all()]
+
+    async def update_invoices_tax_authority_data(self, data: list[dict]) -> None:
+        """Updates many invoices at once, every dictionary holds the id of its row and the columns to set"""
+        if not data:
+            return None
+        await self.db.execute(update(ZatcaPhase2SaleInvoiceData), data)
+        await self.db.flush()
+        return None
+
     async def delete_invoice_tax_authority_data(self, invoice_id: int) -> None:
         stmt = delete(ZatcaPhase2SaleInvoiceData).where(ZatcaPhase2SaleInvoiceData.invoice_id==invoice_id)
         await self.db.execute(stmt)
@@ -145,6 +316,7 @@ class ZatcaRepository:
         return None
     
     async def delete_lines_tax_authority_data(self, invoice_id: int) -> None:
+        self._lines_tax_authority_data.clear()
         stmt = delete(ZatcaPhase2SaleInvoiceLineData).where(ZatcaPhase2SaleInvoiceLineData.invoice_id==invoice_id)
         await self.db.execute(stmt)
         await self.db.flush()
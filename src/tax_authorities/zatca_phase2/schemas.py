@@ -37,14 +37,15 @@ class ZatcaPhase2InvoiceResponse(ZatcaPhase2Discriminator):
 
 class ZatcaPhase2InvoiceDataBase(ZatcaPhase2Discriminator):
     status: InvoiceTaxAuthorityStatus
-    status_code: int
-    response: dict
+    status_code: Optional[int] = None
+    response: Optional[dict] = None
     signed_xml_base64: Optional[str] = None
     pih: Optional[str] = None 
     icv: Optional[int] = None
     base64_qr_code: Optional[str] = None
     invoice_hash: Optional[str] = None
     stage: Optional[ZatcaPhase2Stage] = None
+    point_of_sale_id: Optional[int] = None
 
 class ZatcaPhase2InvoiceDataCreate(ZatcaPhase2InvoiceDataBase):
     pass
@@ -91,14 +92,26 @@ class ZatcaPhase2BranchDataInDB(ZatcaPhase2BranchDataBase):
     stage: str
     organization_id: int
     branch_id: int
+    point_of_sale_id: Optional[int] = None
     pih: Optional[str] = None
     icv: Optional[int] = None
     model_config = ConfigDict(from_attributes=True)
 
 class ZatcaPhase2BranchDataOut(ZatcaPhase2BranchDataBase):
     stage: ZatcaPhase2Stage
+    point_of_sale_id: Optional[int] = None
     model_config = ConfigDict(from_attributes=True)
 
+class ZatcaPhase2PointOfSaleDataCreate(ZatcaPhase2Discriminator):
+    common_name: str = Field(..., min_length=1, max_length=250, description="The name of the EGS unit of the point of sale, as registered in the Zatca portal")
+    invoicing_type: Optional[str] = Field(None, description="The invoicing type of the EGS unit, the one of the branch by default")
+
+class ZatcaPhase2SubmissionContext(BaseModel):
+    """What signing and sending invoices of one EGS unit reads, loaded by ZatcaRepository.get_submission_context()"""
+    branch_data: ZatcaPhase2BranchDataInDB
+    csid: Optional[ZatcaPhase2CSIDInDB] = None
+    lines_data: dict[int, ZatcaPhase2InvoiceLineDataOut] = {}
+
 class ZatcaPhase2BranchDataComplete(ZatcaPhase2Discriminator):
     otp: str = Field(..., min_length=6, max_length=6, pattern=r'^\d{6}$', description="The OTP code from Zatca portal")
 
@@ -1,21 +1,15 @@
+import asyncio
 from datetime import datetime
 from decimal import Decimal
 import json
 import base64
 from typing import Optional
-from httpx import BasicAuth
+from httpx import BasicAuth, Timeout, USE_CLIENT_DEFAULT
 from fastapi import status
 import os
 import re
 import uuid
-from cryptography import x509
-from cryptography.x509.oid import NameOID, ObjectIdentifier
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import ec
 from src.core.schemas.context import RequestContext
-from src.core.utils.json_helper import ToStrEncoder
-from src.core.utils.math_helper import round_decimal
 from .schemas import (
     ZatcaPhase2BranchDataComplete,
     ZatcaPhase2CSIDCreate,
@@ -30,6 +24,8 @@ from .schemas import (
     ZatcaPhase2InvoiceLineDataCreate,
     ZatcaPhase2InvoiceLineDataOut,
     ZatcaPhase2InvoiceDataOut,
+    ZatcaPhase2PointOfSaleDataCreate,
+    ZatcaPhase2SubmissionContext,
 )
 from src.branches.schemas import BranchUpdate
 from src.core.config import settings
@@ -37,16 +33,24 @@ from src.core.services import AsyncRequestService
 from ..services import TaxAuthorityService
 from src.core.enums import BranchTaxIntegrationStatus, InvoiceTaxAuthorityStatus, InvoiceType, InvoiceTypeCode, InvoicingType, ZatcaPhase2Stage, BranchStatus, TaxAuthority
 from src.sale_invoices.schemas import SaleInvoiceOut
+from .models import ZatcaPhase2SaleInvoiceData
 from .repositories import ZatcaRepository
+from .utils.csr_generator import csr_generator
 from .utils.invoice_helper import invoice_helper
+from .utils.invoice_validator import InvoiceValidationError
+from .utils.signable_invoice import SignableInvoice, SignableParty, SignableTaxCategory
 from src.branches.services import BranchService
 from .exceptions import (
     ZatcaBranchDataUpdateNotAllowedException,
     ZatcaCSIDNotIssuedException,
     ZatcaRequestFailedException,
     ZatcaInvoiceSigningException,
+    ZatcaInvoiceValidationException,
+    ZatcaInvoiceConflictException,
     ZatcaBranchDataNotFoundException,
     ZatcaBranchDataAlreadyCreatedException,
+    ZatcaPointOfSaleDataAlreadyCreatedException,
+    ZatcaPointOfSaleOnboardingNotAllowedException,
 )
 from ..exceptions import IncorrectTaxAuthorityException, InvoiceNotAcceptedException
 from src.items.services import ItemService
@@ -56,6 +60,13 @@ from src.sale_invoices.services.raw_service import SaleInvoiceServiceRaw
 from src.sale_invoices.schemas import SaleInvoiceOut, SaleInvoiceCreate
 
 class ZatcaPhase2Service(TaxAuthorityService):
+    # Number of compliance invoices sent to Zatca at the same time while onboarding a branch
+    COMPLIANCE_SUBMISSION_CONCURRENCY = 3
+    # Number of stored invoices read at a time when backfilling their QR codes and hashes
+    BACKFILL_BATCH_SIZE = 500
+    # PIH of the first invoice of a chain, the hash of "0"
+    INITIAL_PIH = "NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ=="
+
     def __init__(self,
         zatca_repo: ZatcaRepository,
         request_service: AsyncRequestService,
@@ -69,81 +80,25 @@ class ZatcaPhase2Service(TaxAuthorityService):
         self.item_service = item_service
         self.sale_invoice_service = sale_invoice_service
 
-    def _convert_dict_to_str(self, data: dict) -> dict[str, str]:
-        data_json = json.dumps(data, cls=ToStrEncoder)
-        return json.loads(data_json, parse_int=lambda x: str(x))
-
-    def _generate_private_key(self):
-        """Returns a private key object, not a serialized string."""
-        return ec.generate_private_key(ec.SECP256K1(), default_backend())
-
-    def _generate_serial_number(self) -> str:
-        """Generates a serial number for CSR generation."""
-        serial_uuid = str(uuid.uuid4())
-        serial_number = "|".join(["1-Wasel", "2-v1", f"3-{serial_uuid}"])
-        return serial_number
-
-    def _generate_private_key_and_csr(self, branch: ZatcaPhase2BranchDataInDB) -> tuple[str, str]:
-        """Generates a private key and CSR in base64 and returns them as a tuple of strings (private_key, csr_base64)."""
-        private_key = self._generate_private_key()
-        # Build the CSR
-        csr_builder = x509.CertificateSigningRequestBuilder()
-        csr_builder = csr_builder.subject_name(x509.Name([
-            x509.NameAttribute(NameOID.COUNTRY_NAME, branch.country_code),
-            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, branch.organization_unit_name),
-            x509.NameAttribute(NameOID.ORGANIZATION_NAME, branch.organization_name),
-            x509.NameAttribute(NameOID.COMMON_NAME, branch.common_name)
-        ]))
-        # Add ASN.1 extension
-        csr_builder = csr_builder.add_extension(
-            x509.UnrecognizedExtension(
-                ObjectIdentifier("1.3.6.1.4.1.311.20.2"), 
-                settings.ZATCA_ASN_TEMPLATE.encode()
-            ),
-            critical=False
-        )
-        # Add SAN extension
-        csr_builder = csr_builder.add_extension(
-            x509.SubjectAlternativeName([
-                x509.DirectoryName(x509.Name([
-                    x509.NameAttribute(ObjectIdentifier("2.5.4.4"), self._generate_serial_number()),
-                    x509.NameAttribute(ObjectIdentifier("0.9.2342.19200300.100.1.1"), branch.vat_number),
-                    x509.NameAttribute(ObjectIdentifier("2.5.4.12"), branch.invoicing_type),
-                    x509.NameAttribute(ObjectIdentifier("2.5.4.26"), branch.address),
-                    x509.NameAttribute(ObjectIdentifier("2.5.4.15"), branch.business_category)
-                ]))
-            ]),
-            critical=False
-        )
-        # Sign the CSR with the private key
-        csr = csr_builder.sign(private_key, hashes.SHA256(), default_backend())
-        # Serialize private key and CSR
-        private_key_pem = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=serialization.NoEncryption()
-        )
-        csr_pem = csr.public_bytes(serialization.Encoding.PEM)
-        # Strip header/footer from private key
-        private_key_content = re.sub(
-            r'-----BEGIN .* PRIVATE KEY-----|-----END .* PRIVATE KEY-----|\n', '', 
-            private_key_pem.decode('utf-8')
-        )
-        # Encode CSR in Base64
-        csr_base64 = base64.b64encode(csr_pem).decode('utf-8')
-        return private_key_content, csr_base64
+    def _get_timeout(self, timeout: float | None) -> Timeout:
+        """The timeout of a Zatca endpoint from the settings, the default of the client when it has none"""
+        if timeout is None:
+            return USE_CLIENT_DEFAULT
+        return Timeout(timeout, connect=settings.HTTP_CONNECT_TIMEOUT)
+
+    async def _generate_private_key_and_csr(self, branch: ZatcaPhase2BranchDataInDB) -> tuple[str, str]:
+        """Generates a private key and CSR in base64 and returns them as a tuple of strings (private_key, csr_base64).
+        The key is taken from the pool of pre-generated keys and the CSR is built on a worker thread."""
+        return await csr_generator.generate_async(branch, settings.ZATCA_ASN_TEMPLATE)
     
-    async def _get_new_pih(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage) -> str:
-        pih = await self.zatca_repo.get_pih(organization_id, branch_id, stage)
-        if pih is None:
-            return "NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ=="
-        return pih
-
-    async def _get_new_icv(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage) -> int:
-        icv = await self.zatca_repo.get_icv(organization_id, branch_id, stage)
-        if icv is None:
-            return 1
-        return icv+1
+    async def _reserve_chain_slot(self, branch_tax_authority_data: ZatcaPhase2BranchDataInDB) -> tuple[int, str]:
+        """Locks the chain of the EGS unit in its stage until the end of the transaction and returns the (icv, pih) of
+        the next invoice. The invoice must be signed and the chain moved forward in the same transaction."""
+        chain = await self.zatca_repo.lock_chain(branch_tax_authority_data.organization_id, branch_tax_authority_data.branch_id, branch_tax_authority_data.stage, branch_tax_authority_data.point_of_sale_id)
+        if chain is None:
+            raise ZatcaBranchDataNotFoundException()
+        icv, pih = chain
+        return (icv or 0) + 1, pih or self.INITIAL_PIH
 
     async def _send_compliance_csid_request(self, csr_base64: str, otp: str) -> ZatcaPhase2CSIDResponse:
         json_payload = json.dumps({'csr': csr_base64})
@@ -154,7 +109,7 @@ class ZatcaPhase2Service(TaxAuthorityService):
             'Accept-Version': 'V2',
             'Content-Type': 'application/json',
         }
-        response = await self.request_service.post(settings.ZATCA_COMPLIANCE_CSID_URL, headers, json_payload)
+        response = await self.request_service.post(settings.ZATCA_COMPLIANCE_CSID_URL, headers, json_payload, timeout=self._get_timeout(settings.ZATCA_CSID_TIMEOUT))
         if not response:
             raise ZatcaRequestFailedException()
         if response.status_code != status.HTTP_200_OK:
@@ -186,7 +141,7 @@ class ZatcaPhase2Service(TaxAuthorityService):
             'Content-Type': 'application/json',
         }
         auth = BasicAuth(binary_security_token, secret)
-        response = await self.request_service.post(settings.ZATCA_PRODUCTION_CSID_URL, headers, json_payload, auth)
+        response = await self.request_service.post(settings.ZATCA_PRODUCTION_CSID_URL, headers, json_payload, auth, timeout=self._get_timeout(settings.ZATCA_CSID_TIMEOUT))
         if not response:
             raise ZatcaRequestFailedException()
         if response.status_code != status.HTTP_200_OK:
@@ -210,7 +165,7 @@ class ZatcaPhase2Service(TaxAuthorityService):
         )
 
     async def _generate_compliance_csid(self, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, zatca_otp: str) -> ZatcaPhase2CSIDInDB:
-        private_key, csr_base64 = self._generate_private_key_and_csr(branch_tax_authority_data)
+        private_key, csr_base64 = await self._generate_private_key_and_csr(branch_tax_authority_data)
         zatca_csid = await self._send_compliance_csid_request(csr_base64, zatca_otp)
         certificate = base64.b64decode(zatca_csid.binary_security_token).decode('utf-8')
         authorization = zatca_csid.binary_security_token + ':' + zatca_csid.secret
@@ -226,7 +181,7 @@ class ZatcaPhase2Service(TaxAuthorityService):
             secret=zatca_csid.secret
         )
         data = csid_data.model_dump()
-        data.update({"stage": ZatcaPhase2Stage.COMPLIANCE})
+        data.update({"stage": ZatcaPhase2Stage.COMPLIANCE, "point_of_sale_id": branch_tax_authority_data.point_of_sale_id})
         csid = await self.zatca_repo.create_csid(branch_tax_authority_data.organization_id, branch_tax_authority_data.branch_id, data)
         return ZatcaPhase2CSIDInDB.model_validate(csid)
     
@@ -234,7 +189,8 @@ class ZatcaPhase2Service(TaxAuthorityService):
         compliance_csid = await self.zatca_repo.get_csid_by_branch(
             branch_tax_authority_data.organization_id, 
             branch_tax_authority_data.branch_id, 
-            ZatcaPhase2Stage.COMPLIANCE
+            ZatcaPhase2Stage.COMPLIANCE,
+            branch_tax_authority_data.point_of_sale_id,
         )
         if not compliance_csid:
             raise ZatcaCSIDNotIssuedException("Compliance CSID not found. Need to have Compliance CSID in order to issue production one.")
@@ -257,12 +213,12 @@ class ZatcaPhase2Service(TaxAuthorityService):
             secret=zatca_csid.secret
         )
         data = csid_data.model_dump()
-        data.update({"stage": ZatcaPhase2Stage.PRODUCTION})
+        data.update({"stage": ZatcaPhase2Stage.PRODUCTION, "point_of_sale_id": branch_tax_authority_data.point_of_sale_id})
         csid = await self.zatca_repo.create_csid(branch_tax_authority_data.organization_id, branch_tax_authority_data.branch_id, data)
         return ZatcaPhase2CSIDInDB.model_validate(csid)
 
-    async def _get_csid(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage) -> ZatcaPhase2CSIDInDB | None:
-        csid = await self.zatca_repo.get_csid_by_branch(organization_id, branch_id, stage)
+    async def _get_csid(self, organization_id: int, branch_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> ZatcaPhase2CSIDInDB | None:
+        csid = await self.zatca_repo.get_csid_by_branch(organization_id, branch_id, stage, point_of_sale_id)
         if csid is None:
             return None
         return ZatcaPhase2CSIDInDB.model_validate(csid)
@@ -276,11 +232,14 @@ class ZatcaPhase2Service(TaxAuthorityService):
             'Content-Type': 'application/json',
         }
         auth = BasicAuth(binary_security_token, secret)
-        response = await self.request_service.post(settings.ZATCA_COMPLIANCE_INVOICE_URL, headers, json_payload, auth)
+        response = await self.request_service.post(settings.ZATCA_COMPLIANCE_INVOICE_URL, headers, json_payload, auth, timeout=self._get_timeout(settings.ZATCA_COMPLIANCE_INVOICE_TIMEOUT), idempotent=True)
         if response.status_code == status.HTTP_200_OK:
             zatca_status = InvoiceTaxAuthorityStatus.ACCEPTED
         elif response.status_code == status.HTTP_201_CREATED or response.status_code == status.HTTP_202_ACCEPTED:
             zatca_status = InvoiceTaxAuthorityStatus.ACCEPTED_WITH_WARNINGS
+        elif response.status_code in AsyncRequestService.RETRY_STATUS_CODES:
+            # Zatca throttled or failed, the invoice was not judged and is sent again later
+            zatca_status = InvoiceTaxAuthorityStatus.NOT_SENT
         else:
             zatca_status = InvoiceTaxAuthorityStatus.REJECTED
         try:
@@ -294,6 +253,10 @@ class ZatcaPhase2Service(TaxAuthorityService):
             response=response_json, 
         )
 
+    def _get_conflict_detail(self, response) -> str:
+        """The 409 answer of Zatca, kept on the failed submission to reconcile the invoice"""
+        return f"Zatca already has an invoice with this uuid: {response.text}"
+
     async def _send_standard_invoice(self, invoice_request: dict, binary_security_token: str, secret: str) -> ZatcaPhase2InvoiceResponse:
         json_payload = json.dumps(invoice_request)
         headers = {
@@ -304,11 +267,16 @@ class ZatcaPhase2Service(TaxAuthorityService):
         }
         auth = BasicAuth(binary_security_token, secret)
 
-        response = await self.request_service.post(settings.ZATCA_STANDARD_INVOICE_URL, headers, json_payload, auth)
+        response = await self.request_service.post(settings.ZATCA_STANDARD_INVOICE_URL, headers, json_payload, auth, timeout=self._get_timeout(settings.ZATCA_CLEARANCE_TIMEOUT), idempotent=True)
         if response.status_code == status.HTTP_200_OK:
             zatca_status = InvoiceTaxAuthorityStatus.ACCEPTED
         elif response.status_code == status.HTTP_201_CREATED or response.status_code == status.HTTP_202_ACCEPTED:
             zatca_status = InvoiceTaxAuthorityStatus.ACCEPTED_WITH_WARNINGS
+        elif response.status_code == status.HTTP_409_CONFLICT:
+            # No cleared invoice comes with a 409, whether Zatca cleared this one is left to reconcile by hand
+            raise ZatcaInvoiceConflictException(detail=self._get_conflict_detail(response))
+        elif response.status_code in AsyncRequestService.RETRY_STATUS_CODES:
+            zatca_status = InvoiceTaxAuthorityStatus.NOT_SENT
         else:
             zatca_status = InvoiceTaxAuthorityStatus.REJECTED
         try:
@@ -333,11 +301,13 @@ class ZatcaPhase2Service(TaxAuthorityService):
             'Content-Type': 'application/json',
         }
         auth = BasicAuth(binary_security_token, secret)
-        response = await self.request_service.post(settings.ZATCA_SIMPLIFIED_INVOICE_URL, headers, json_payload, auth)
+        response = await self.request_service.post(settings.ZATCA_SIMPLIFIED_INVOICE_URL, headers, json_payload, auth, timeout=self._get_timeout(settings.ZATCA_REPORTING_TIMEOUT), idempotent=True)
         if response.status_code == status.HTTP_200_OK:
             zatca_status = InvoiceTaxAuthorityStatus.ACCEPTED
         elif response.status_code == status.HTTP_201_CREATED or response.status_code == status.HTTP_202_ACCEPTED:
             zatca_status = InvoiceTaxAuthorityStatus.ACCEPTED_WITH_WARNINGS
+        elif response.status_code in AsyncRequestService.RETRY_STATUS_CODES:
+            zatca_status = InvoiceTaxAuthorityStatus.NOT_SENT
         else:
             zatca_status = InvoiceTaxAuthorityStatus.REJECTED
         try:
@@ -345,6 +315,11 @@ class ZatcaPhase2Service(TaxAuthorityService):
         except Exception:
             response_json = {}
             zatca_status = InvoiceTaxAuthorityStatus.NOT_SENT
+        if response.status_code == status.HTTP_409_CONFLICT:
+            # An earlier send whose answer was lost reported the invoice, the stored one is the invoice Zatca has
+            if response_json.get("reportingStatus") != "REPORTED":
+                raise ZatcaInvoiceConflictException(detail=self._get_conflict_detail(response))
+            zatca_status = InvoiceTaxAuthorityStatus.ACCEPTED
         return ZatcaPhase2InvoiceResponse(
             tax_authority=TaxAuthority.ZATCA_PHASE2,
             status=zatca_status,
@@ -352,23 +327,10 @@ class ZatcaPhase2Service(TaxAuthorityService):
             response=response_json
         )
 
-    async def _prepare_invoice_for_signing(self, ctx: RequestContext, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, invoice: SaleInvoiceOut) -> dict[str, str]:
-        """Create a dictionary representing the invoice and transform all numeric values into strings."""
+    async def _prepare_invoice_for_signing(self, ctx: RequestContext, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, invoice: SaleInvoiceOut, lines_tax_authority_data: dict[int, ZatcaPhase2InvoiceLineDataOut]) -> SignableInvoice:
+        """Create the signable form of the invoice, with all values already formatted as they go into the XML.
+        The pih and icv are left empty, they are set once a slot of the chain is reserved for the invoice."""
         invoice_lines = invoice.invoice_lines
-        invoice_dict = invoice.model_dump(exclude_none=True, exclude_unset=True)
-        pih = await self._get_new_pih(branch_tax_authority_data.organization_id, branch_tax_authority_data.branch_id, branch_tax_authority_data.stage)
-        icv = await self._get_new_icv(branch_tax_authority_data.organization_id, branch_tax_authority_data.branch_id, branch_tax_authority_data.stage)
-        invoice_dict.update({
-            "pih": pih,
-            "icv": icv,
-            "stage": branch_tax_authority_data.stage
-        })
-        # Add item price before discount
-        for line in invoice_dict["invoice_lines"]:
-            line.update({
-                "item_price_before_discount": line["item_price"],
-                "item_price_after_discount": round_decimal(line["item_price"] - line["price_discount"], 2),
-            })
 
         tax_categories = {
             'S': {"taxable_amount": Decimal("0"), "tax_amount": Decimal("0"), "classified_tax_category": 'S', "tax_rate": Decimal(settings.STANDARD_TAX_RATE), "tax_exemption_reason_code": None, "tax_exemption_reason": None, "used": False},
@@ -379,7 +341,7 @@ class ZatcaPhase2Service(TaxAuthorityService):
 
         # Invoice can have document level discount amount only if all lines have the same VAT category
         if invoice.discount_amount > 0:
-            line_tax_authority_data = await self.get_line_tax_authority_data(ctx, invoice_lines[0].id)
+            line_tax_authority_data = lines_tax_authority_data.get(invoice_lines[0].id)
             tax_exemption_reason_code = line_tax_authority_data.tax_exemption_reason_code if line_tax_authority_data else None
             tax_exemption_reason = line_tax_authority_data.tax_exemption_reason if line_tax_authority_data else None
             has_total_discount = True
@@ -392,7 +354,7 @@ class ZatcaPhase2Service(TaxAuthorityService):
         else:
             has_total_discount = False
             for line in invoice_lines:
-                line_tax_authority_data = await self.get_line_tax_authority_data(ctx, line.id)
+                line_tax_authority_data = lines_tax_authority_data.get(line.id)
                 tax_exemption_reason_code = line_tax_authority_data.tax_exemption_reason_code if line_tax_authority_data else None
                 tax_exemption_reason = line_tax_authority_data.tax_exemption_reason if line_tax_authority_data else None
                 tax_category = line.classified_tax_category
@@ -401,16 +363,21 @@ class ZatcaPhase2Service(TaxAuthorityService):
                 tax_categories[tax_category]['tax_exemption_reason_code'] = tax_exemption_reason_code
                 tax_categories[tax_category]['tax_exemption_reason'] = tax_exemption_reason
                 tax_categories[tax_category]['used'] = True
-        tax_categories = {k: v for k, v in tax_categories.items() if v['used'] == True}
-
-        invoice_dict.update({
-            "has_total_discount": has_total_discount,
-            "supplier": branch_tax_authority_data.model_dump(),
-            "tax_categories": tax_categories
-        })
-        return self._convert_dict_to_str(invoice_dict)
+        tax_categories = {
+            k: SignableTaxCategory.from_totals(v["classified_tax_category"], v["taxable_amount"], v["tax_amount"], v["tax_rate"], v["tax_exemption_reason_code"], v["tax_exemption_reason"])
+            for k, v in tax_categories.items() if v['used'] == True
+        }
+        return SignableInvoice.from_sale_invoice(
+            invoice,
+            supplier=SignableParty.from_model(branch_tax_authority_data),
+            pih=None,
+            icv=None,
+            has_total_discount=has_total_discount,
+            tax_categories=tax_categories,
+            supplier_cache_key=(branch_tax_authority_data.branch_id, branch_tax_authority_data.stage),
+        )
 
-    async def _send_compliance_invoices(self, ctx: RequestContext, invoicing_type: InvoicingType) -> None:
+    async def _send_compliance_invoices(self, ctx: RequestContext, invoicing_type: InvoicingType, point_of_sale_id: int | None = None) -> None:
         invoice_types = []
         if invoicing_type == InvoicingType.STANDARD:
             invoice_types = [InvoiceType.STANDARD]
@@ -421,40 +388,54 @@ class ZatcaPhase2Service(TaxAuthorityService):
         invoice_type_codes = [InvoiceTypeCode.INVOICE, InvoiceTypeCode.CREDIT_NOTE, InvoiceTypeCode.DEBIT_NOTE]
         from .utils.templates.invoice_data import invoice_data_template
         last_invoice_number = ""
-        pih = "NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ=="
+        pih = self.INITIAL_PIH
         icv = 1
-        branch_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.COMPLIANCE)
-        csid = await self._get_csid(ctx.organization.id, ctx.branch.id, ZatcaPhase2Stage.COMPLIANCE)
+        branch_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.COMPLIANCE, point_of_sale_id)
+        csid = await self._get_csid(ctx.organization.id, ctx.branch.id, ZatcaPhase2Stage.COMPLIANCE, point_of_sale_id)
+        invoices_data = []
         for type in invoice_types:
             for code in invoice_type_codes:
                 invoice_data = invoice_data_template.copy()
-                invoice_data["supplier"] = branch_tax_authority_data.model_dump()
+                invoice_data["supplier"] = SignableParty.from_model(branch_tax_authority_data)
                 invoice_data["invoice_number"] = f"wasel-test-inv-000{icv}"
                 invoice_data["uuid"] = str(uuid.uuid4())
-                invoice_data["icv"] = icv
+                invoice_data["icv"] = str(icv)
                 invoice_data["pih"] = pih
-                invoice_data["invoice_type"] = type
-                invoice_data["invoice_type_code"] = code
+                invoice_data["invoice_type"] = type.value
+                invoice_data["invoice_type_code"] = code.value
                 invoice_data["issue_date"] = datetime.now(KSA_TZ).date().isoformat()
                 invoice_data["issue_time"] = datetime.now(KSA_TZ).time().isoformat(timespec='seconds')
                 invoice_data["actual_delivery_date"] = datetime.now(KSA_TZ).date().isoformat()
                 if code != InvoiceTypeCode.INVOICE:
                     invoice_data["original_invoice_number"] = last_invoice_number
                     invoice_data["instruction_note"] = "Correction of invoice"
-                invoice_data = self._convert_dict_to_str(invoice_data)
-                try:
-                    invoice_request = invoice_helper.sign_and_get_request(invoice_data, csid.private_key, csid.certificate)
-                    # with open(f"invoice-{icv}.xml", "w") as f:
-                    #     f.write(base64.b64decode(invoice_request["invoice"]).decode())    
-                except Exception as e:
-                    raise ZatcaCSIDNotIssuedException(detail="Could not create invoice for compliance submission")
-                zatca_response = await self._send_compliance_invoice(invoice_request, type, csid.binary_security_token, csid.secret)
-                if zatca_response.status_code not in [status.HTTP_200_OK, status.HTTP_201_CREATED, status.HTTP_202_ACCEPTED, status.HTTP_409_CONFLICT]:
-                    raise ZatcaCSIDNotIssuedException(detail="One or more of the compliance invoices were not accepted by Zatca")
+                invoices_data.append(invoice_data)
                 icv += 1
-                pih = invoice_request["invoiceHash"]
                 if code == InvoiceTypeCode.INVOICE:
                     last_invoice_number = invoice_data["invoice_number"]
+        # The PIH of each invoice is the hash of the previous one, which is known locally, so the whole chain
+        # is signed first and the invoices are then submitted without waiting for each other
+        try:
+            signing_material = invoice_helper.get_signing_material(csid.id, csid.private_key, csid.certificate)
+            invoice_requests = await invoice_helper.sign_batch_async(invoices_data, signing_material, pih, 1, validate=settings.ZATCA_VALIDATE_INVOICES)
+        except InvoiceValidationError as e:
+            raise ZatcaInvoiceValidationException(detail=str(e)) from e
+        except Exception as e:
+            raise ZatcaCSIDNotIssuedException(detail="Could not create invoice for compliance submission") from e
+        semaphore = asyncio.Semaphore(self.COMPLIANCE_SUBMISSION_CONCURRENCY)
+        async def submit(invoice_data: dict, invoice_request: dict) -> ZatcaPhase2InvoiceResponse:
+            async with semaphore:
+                return await self._send_compliance_invoice(invoice_request, InvoiceType(invoice_data["invoice_type"]), csid.binary_security_token, csid.secret)
+        zatca_responses = await asyncio.gather(
+            *[submit(invoice_data, invoice_request) for invoice_data, invoice_request in zip(invoices_data, invoice_requests)],
+            return_exceptions=True,
+        )
+        for zatca_response in zatca_responses:
+            if isinstance(zatca_response, Exception):
+                raise zatca_response
+        for zatca_response in zatca_responses:
+            if zatca_response.status_code not in [status.HTTP_200_OK, status.HTTP_201_CREATED, status.HTTP_202_ACCEPTED, status.HTTP_409_CONFLICT]:
+                raise ZatcaCSIDNotIssuedException(detail="One or more of the compliance invoices were not accepted by Zatca")
         return None
         
     async def create_branch_tax_authority_data(self, ctx: RequestContext, branch_id: int, data: ZatcaPhase2BranchDataCreate) -> ZatcaPhase2BranchDataInDB:
@@ -486,26 +467,79 @@ class ZatcaPhase2Service(TaxAuthorityService):
             "pih": "NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ==",
         })
         branch_tax_authority_data = await self.zatca_repo.update_branch_tax_authority_data(ctx.user.id, ctx.organization.id, branch_id, payload)
+        invoice_helper.invalidate_supplier_party(branch_id)
         return ZatcaPhase2BranchDataInDB.model_validate(branch_tax_authority_data)   
 
     async def complete_branch_tax_authority_data(self, ctx: RequestContext, branch_id: int, data: ZatcaPhase2BranchDataComplete) -> ZatcaPhase2BranchDataInDB:
         if ctx.organization.tax_authority != TaxAuthority.ZATCA_PHASE2:
             raise IncorrectTaxAuthorityException()
         branch_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, branch_id, ZatcaPhase2Stage.COMPLIANCE)
-        await self._generate_compliance_csid(branch_tax_authority_data, data.otp)
-        await self._send_compliance_invoices(ctx, branch_tax_authority_data.invoicing_type)
+        return await self._complete_egs_unit(ctx, branch_tax_authority_data, data.otp)
+
+    async def _complete_egs_unit(self, ctx: RequestContext, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, otp: str) -> ZatcaPhase2BranchDataInDB:
+        """Onboards the EGS unit of the compliance data, the branch or one of its points of sale: issues its compliance
+        CSID, passes the compliance invoices, issues its production CSID and starts its production chain."""
+        await self._generate_compliance_csid(branch_tax_authority_data, otp)
+        await self._send_compliance_invoices(ctx, branch_tax_authority_data.invoicing_type, branch_tax_authority_data.point_of_sale_id)
         await self._generate_production_csid(branch_tax_authority_data)
         payload = ZatcaPhase2BranchDataCreate.model_validate(branch_tax_authority_data).model_dump()
         payload.update({
             "icv": 1,
-            "pih": "NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ==",
+            "pih": self.INITIAL_PIH,
             "stage": ZatcaPhase2Stage.PRODUCTION,
+            "point_of_sale_id": branch_tax_authority_data.point_of_sale_id,
         })
-        branch_tax_authority_data = await self.zatca_repo.create_branch_tax_authority_data(ctx.user.id, ctx.organization.id, branch_id, payload)
+        branch_tax_authority_data = await self.zatca_repo.create_branch_tax_authority_data(ctx.user.id, ctx.organization.id, branch_tax_authority_data.branch_id, payload)
         return ZatcaPhase2BranchDataInDB.model_validate(branch_tax_authority_data)   
+
+    async def create_point_of_sale_tax_authority_data(self, ctx: RequestContext, point_of_sale_id: int, data: ZatcaPhase2PointOfSaleDataCreate) -> ZatcaPhase2BranchDataInDB:
+        """Registers the point of sale as an EGS unit of its own, with the supplier data of its branch. Once completed it
+        signs its invoices with its own CSID and chain, in parallel with the other points of sale of the branch."""
+        if ctx.organization.tax_authority != TaxAuthority.ZATCA_PHASE2:
+            raise IncorrectTaxAuthorityException()
+        if ctx.branch.tax_integration_status != BranchTaxIntegrationStatus.COMPLETED:
+            raise ZatcaPointOfSaleOnboardingNotAllowedException()
+        if await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.PRODUCTION, point_of_sale_id):
+            raise ZatcaPointOfSaleDataAlreadyCreatedException()
+        branch_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.PRODUCTION)
+        if branch_tax_authority_data is None:
+            raise ZatcaBranchDataNotFoundException()
+        payload = ZatcaPhase2BranchDataCreate.model_validate(branch_tax_authority_data).model_dump()
+        payload.update({
+            "common_name": data.common_name,
+            "invoicing_type": data.invoicing_type or branch_tax_authority_data.invoicing_type,
+            "icv": 1,
+            "stage": ZatcaPhase2Stage.COMPLIANCE,
+            "pih": self.INITIAL_PIH,
+        })
+        # Registering again before completing replaces the pending data, as for branches
+        if await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.COMPLIANCE, point_of_sale_id):
+            point_of_sale_tax_authority_data = await self.zatca_repo.update_branch_tax_authority_data(ctx.user.id, ctx.organization.id, ctx.branch.id, payload, point_of_sale_id)
+        else:
+            payload["point_of_sale_id"] = point_of_sale_id
+            point_of_sale_tax_authority_data = await self.zatca_repo.create_branch_tax_authority_data(ctx.user.id, ctx.organization.id, ctx.branch.id, payload)
+        return ZatcaPhase2BranchDataInDB.model_validate(point_of_sale_tax_authority_data)
+
+    async def complete_point_of_sale_tax_authority_data(self, ctx: RequestContext, point_of_sale_id: int, data: ZatcaPhase2BranchDataComplete) -> ZatcaPhase2BranchDataInDB:
+        if ctx.organization.tax_authority != TaxAuthority.ZATCA_PHASE2:
+            raise IncorrectTaxAuthorityException()
+        if await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.PRODUCTION, point_of_sale_id):
+            raise ZatcaPointOfSaleDataAlreadyCreatedException()
+        point_of_sale_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.COMPLIANCE, point_of_sale_id)
+        if point_of_sale_tax_authority_data is None:
+            raise ZatcaBranchDataNotFoundException(detail="Tax authority data for this point of sale was not found")
+        return await self._complete_egs_unit(ctx, point_of_sale_tax_authority_data, data.otp)
+
+    async def get_point_of_sale_tax_authority_data(self, ctx: RequestContext, point_of_sale_id: int) -> Optional[ZatcaPhase2BranchDataInDB]:
+        """Returns the data of the EGS unit of the point of sale, None when it is not registered as one"""
+        for stage in (ZatcaPhase2Stage.PRODUCTION, ZatcaPhase2Stage.COMPLIANCE):
+            point_of_sale_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, stage, point_of_sale_id)
+            if point_of_sale_tax_authority_data is not None:
+                return point_of_sale_tax_authority_data
+        return None
     
-    async def _get_branch_tax_authority_data_by_stage(self, ctx: RequestContext, branch_id: int, stage: ZatcaPhase2Stage) -> Optional[ZatcaPhase2BranchDataInDB]:
-        tax_authority_data = await self.zatca_repo.get_branch_tax_authority_data_by_branch(branch_id, stage)
+    async def _get_branch_tax_authority_data_by_stage(self, ctx: RequestContext, branch_id: int, stage: ZatcaPhase2Stage, point_of_sale_id: int | None = None) -> Optional[ZatcaPhase2BranchDataInDB]:
+        tax_authority_data = await self.zatca_repo.get_branch_tax_authority_data_by_branch(branch_id, stage, point_of_sale_id)
         if tax_authority_data is None:
             return None
             # raise ZatcaBranchDataNotFoundException()
@@ -548,51 +582,196 @@ class ZatcaPhase2Service(TaxAuthorityService):
         await self.zatca_repo.delete_lines_tax_authority_data(invoice_id)
         return None
         
-    async def sign_and_submit_invoice(self, ctx: RequestContext, invoice: SaleInvoiceOut, metadata: dict = {}) -> ZatcaPhase2InvoiceDataOut:
-        """Signs the invoice and send it to the relevant tax authority."""
-
+    async def _get_submission_context(self, ctx: RequestContext, point_of_sale_id: int | None, invoices: list[SaleInvoiceOut]) -> ZatcaPhase2SubmissionContext:
+        """Loads the EGS unit signing the invoices of the point of sale, its CSID and the data of the invoice lines. The
+        unit is the one of the point of sale once it completed its onboarding, otherwise the one of the branch in the
+        stage the branch currently signs invoices in."""
         if ctx.branch.tax_integration_status == BranchTaxIntegrationStatus.COMPLETED:
-            branch_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.PRODUCTION)
+            stage = ZatcaPhase2Stage.PRODUCTION
         else:
-            branch_tax_authority_data = await self._get_branch_tax_authority_data_by_stage(ctx, ctx.branch.id, ZatcaPhase2Stage.COMPLIANCE)
-         
-        if branch_tax_authority_data is None:
+            stage = ZatcaPhase2Stage.COMPLIANCE
+        invoice_line_ids = [line.id for invoice in invoices for line in invoice.invoice_lines]
+        submission_context = await self.zatca_repo.get_submission_context(ctx.organization.id, ctx.branch.id, stage, point_of_sale_id, invoice_line_ids)
+        if submission_context is None:
             raise ZatcaBranchDataNotFoundException()
-        csid = await self._get_csid(ctx.organization.id, ctx.branch.id, branch_tax_authority_data.stage)
-        invoice_data = await self._prepare_invoice_for_signing(ctx, branch_tax_authority_data, invoice)
-        try:
-            invoice_request = invoice_helper.sign_and_get_request(invoice_data, csid.private_key, csid.certificate)
-        except Exception as e:
-            raise ZatcaInvoiceSigningException()
-        # with open('inv.xml', "w") as f:
-        #     f.write(base64.b64decode(invoice_request["invoice"]).decode())
+        branch_tax_authority_data, csid, lines_tax_authority_data = submission_context
+        return ZatcaPhase2SubmissionContext(
+            branch_data=ZatcaPhase2BranchDataInDB.model_validate(branch_tax_authority_data),
+            csid=ZatcaPhase2CSIDInDB.model_validate(csid) if csid is not None else None,
+            lines_data={id: ZatcaPhase2InvoiceLineDataOut.model_validate(data) for id, data in lines_tax_authority_data.items()},
+        )
+
+    async def _submit_invoice_request(self, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, csid: ZatcaPhase2CSIDInDB, invoice_type: InvoiceType, invoice_request: dict) -> ZatcaPhase2InvoiceResponse:
+        """Sends a signed invoice to the endpoint matching the stage of the branch and the type of the invoice."""
         if (branch_tax_authority_data.stage == ZatcaPhase2Stage.COMPLIANCE):
-            zatca_result = await self._send_compliance_invoice(invoice_request, invoice.invoice_type, csid.binary_security_token, csid.secret)
-        elif (branch_tax_authority_data.stage== ZatcaPhase2Stage.PRODUCTION and invoice.invoice_type == InvoiceType.STANDARD):
-            zatca_result = await self._send_standard_invoice(invoice_request, csid.binary_security_token, csid.secret)
-        elif (branch_tax_authority_data.stage == ZatcaPhase2Stage.PRODUCTION and invoice.invoice_type == InvoiceType.SIMPLIFIED):
-            zatca_result = await self._send_simplified_invoice(invoice_request, csid.binary_security_token, csid.secret)
+            return await self._send_compliance_invoice(invoice_request, invoice_type, csid.binary_security_token, csid.secret)
+        elif (branch_tax_authority_data.stage== ZatcaPhase2Stage.PRODUCTION and invoice_type == InvoiceType.STANDARD):
+            return await self._send_standard_invoice(invoice_request, csid.binary_security_token, csid.secret)
+        elif (branch_tax_authority_data.stage == ZatcaPhase2Stage.PRODUCTION and invoice_type == InvoiceType.SIMPLIFIED):
+            return await self._send_simplified_invoice(invoice_request, csid.binary_security_token, csid.secret)
         else:
             raise ZatcaRequestFailedException()
 
-        qr_code = invoice_helper.extract_base64_qr_code(zatca_result.signed_xml_base64)
+    def _get_signed_invoice_data(self, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, icv: int, pih: str, invoice_request: dict) -> dict:
+        """The row storing a signed invoice as NOT_SENT until Zatca processes it"""
         tax_authority_data = ZatcaPhase2InvoiceDataOut(
-            **zatca_result.model_dump(),
-            pih = invoice_data["pih"], 
-            icv = invoice_data["icv"],
-            base64_qr_code = qr_code,
-            invoice_hash = invoice_request["invoiceHash"],
-            stage = branch_tax_authority_data.stage,
+            tax_authority=TaxAuthority.ZATCA_PHASE2,
+            status=InvoiceTaxAuthorityStatus.NOT_SENT,
+            signed_xml_base64=invoice_request["invoice"],
+            pih=pih,
+            icv=icv,
+            base64_qr_code=invoice_helper.extract_base64_qr_code(invoice_request["invoice"]),
+            invoice_hash=invoice_request["invoiceHash"],
+            stage=branch_tax_authority_data.stage,
+            point_of_sale_id=branch_tax_authority_data.point_of_sale_id,
         )
-        tax_authority_data = await self.create_invoice_tax_authority_data(ctx, invoice_id=invoice.id, data=tax_authority_data)
-        await self.zatca_repo.update_pih_and_icv(branch_tax_authority_data.branch_id, invoice_request["invoiceHash"])
-        return tax_authority_data
-
-
-
-
+        return tax_authority_data.model_dump()
+
+    async def _save_signed_invoice(self, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, invoice: SaleInvoiceOut, icv: int, pih: str, invoice_request: dict) -> ZatcaPhase2SaleInvoiceData:
+        """Stores a signed invoice as NOT_SENT until Zatca processes it and moves the chain of the EGS unit forward to it."""
+        signed_invoice = await self.zatca_repo.create_invoice_tax_authority_data(invoice.id, self._get_signed_invoice_data(branch_tax_authority_data, icv, pih, invoice_request))
+        await self.zatca_repo.update_pih_and_icv(branch_tax_authority_data.organization_id, branch_tax_authority_data.branch_id, branch_tax_authority_data.stage, icv, invoice_request["invoiceHash"], branch_tax_authority_data.point_of_sale_id)
+        return signed_invoice
+
+    async def _get_or_sign_invoice(self, ctx: RequestContext, submission_context: ZatcaPhase2SubmissionContext, invoice: SaleInvoiceOut) -> ZatcaPhase2SaleInvoiceData:
+        """Returns the stored invoice signed by the EGS unit in its stage that Zatca did not process yet, or signs the
+        invoice in the next slot of the chain. Reusing the signed invoice keeps a failed submission from leaving a gap."""
+        branch_tax_authority_data, csid = submission_context.branch_data, submission_context.csid
+        signed_invoice = await self.zatca_repo.get_unsent_invoice_tax_authority_data(invoice.id, branch_tax_authority_data.stage, branch_tax_authority_data.point_of_sale_id)
+        if signed_invoice is not None:
+            return signed_invoice
+        invoice_data = await self._prepare_invoice_for_signing(ctx, branch_tax_authority_data, invoice, submission_context.lines_data)
+        # Reserved last, the chain stays locked from here until the transaction ends
+        icv, pih = await self._reserve_chain_slot(branch_tax_authority_data)
+        invoice_data.icv = str(icv)
+        invoice_data.pih = pih
+        try:
+            signing_material = invoice_helper.get_signing_material(csid.id, csid.private_key, csid.certificate)
+            invoice_request = await invoice_helper.sign_and_get_request_async(invoice_data, signing_material, settings.ZATCA_VALIDATE_INVOICES)
+        except InvoiceValidationError as e:
+            raise ZatcaInvoiceValidationException(detail=str(e))
+        except Exception as e:
+            raise ZatcaInvoiceSigningException()
+        # with open('inv.xml', "w") as f:
+        #     f.write(base64.b64decode(invoice_request["invoice"]).decode())
+        return await self._save_signed_invoice(branch_tax_authority_data, invoice, icv, pih, invoice_request)
+
+    async def _submit_signed_invoice(self, branch_tax_authority_data: ZatcaPhase2BranchDataInDB, csid: ZatcaPhase2CSIDInDB, invoice: SaleInvoiceOut, signed_invoice: ZatcaPhase2SaleInvoiceData) -> ZatcaPhase2InvoiceDataOut:
+        """Sends a stored signed invoice to Zatca and stores its response. A standard invoice is replaced by the one Zatca cleared."""
+        invoice_request = {
+            "invoiceHash": signed_invoice.invoice_hash,
+            "uuid": str(invoice.uuid),
+            "invoice": signed_invoice.signed_xml_base64,
+        }
+        zatca_result = await self._submit_invoice_request(branch_tax_authority_data, csid, invoice.invoice_type, invoice_request)
+        data = {"status": zatca_result.status, "status_code": zatca_result.status_code, "response": zatca_result.response}
+        if zatca_result.signed_xml_base64 is not None:
+            data["signed_xml_base64"] = zatca_result.signed_xml_base64
+            data["base64_qr_code"] = invoice_helper.extract_base64_qr_code(zatca_result.signed_xml_base64)
+        tax_authority_data = await self.zatca_repo.update_invoice_tax_authority_data(signed_invoice.id, data)
+        return ZatcaPhase2InvoiceDataOut.model_validate(tax_authority_data)
 
+    async def backfill_invoices_tax_authority_data(self, after_id: int = 0, limit: int = BACKFILL_BATCH_SIZE) -> tuple[int, int]:
+        """Fills in the QR code and hash of up to limit stored invoices that are missing them, read from their signed XML.
+        Returns the last id looked at, to pass as after_id for the next batch, and the number of invoices updated."""
+        rows = await self.zatca_repo.get_invoices_tax_authority_data_to_backfill(after_id, limit)
+        if not rows:
+            return after_id, 0
+        extracted = await invoice_helper.extract_many_async([signed_xml_base64 for _, signed_xml_base64, _, _ in rows])
+        data = []
+        for (id, _, base64_qr_code, invoice_hash), (extracted_qr_code, extracted_invoice_hash) in zip(rows, extracted):
+            values = {}
+            if base64_qr_code is None and extracted_qr_code is not None:
+                values["base64_qr_code"] = extracted_qr_code
+            if invoice_hash is None and extracted_invoice_hash is not None:
+                values["invoice_hash"] = extracted_invoice_hash
+            if values:
+                data.append({"id": id, **values})
+        await self.zatca_repo.update_invoices_tax_authority_data(data)
+        return rows[-1][0], len(data)
+
+    async def sign_invoice(self, ctx: RequestContext, invoice: SaleInvoiceOut, metadata: dict = {}) -> ZatcaPhase2InvoiceDataOut:
+        """Signs the invoice in the next slot of the chain of its EGS unit and stores it until it is submitted.
+        The chain stays locked until the transaction ends, committing before submitting lets the other invoices of
+        the unit be signed while this one is sent."""
+        point_of_sale_id = invoice.point_of_sale.id if invoice.point_of_sale is not None else None
+        submission_context = await self._get_submission_context(ctx, point_of_sale_id, [invoice])
+        signed_invoice = await self._get_or_sign_invoice(ctx, submission_context, invoice)
+        return ZatcaPhase2InvoiceDataOut.model_validate(signed_invoice)
 
+    async def sign_and_submit_invoice(self, ctx: RequestContext, invoice: SaleInvoiceOut, metadata: dict = {}) -> ZatcaPhase2InvoiceDataOut:
+        """Signs the invoice and send it to the relevant tax authority. An invoice already signed by sign_invoice()
+        is only sent."""
+        point_of_sale_id = invoice.point_of_sale.id if invoice.point_of_sale is not None else None
+        submission_context = await self._get_submission_context(ctx, point_of_sale_id, [invoice])
+        signed_invoice = await self._get_or_sign_invoice(ctx, submission_context, invoice)
+        return await self._submit_signed_invoice(submission_context.branch_data, submission_context.csid, invoice, signed_invoice)
+
+    async def _sign_invoices(self, ctx: RequestContext, submission_context: ZatcaPhase2SubmissionContext, invoices: list[SaleInvoiceOut]) -> dict[int, ZatcaPhase2SaleInvoiceData]:
+        """Signs a run of invoices of one EGS unit as one chain, returns the stored signed invoices by invoice id.
+        Invoices already signed and not processed by Zatca keep their place in the chain."""
+        branch_tax_authority_data, csid = submission_context.branch_data, submission_context.csid
+        signed_invoices = await self.zatca_repo.get_unsent_invoices_tax_authority_data(
+            [invoice.id for invoice in invoices],
+            branch_tax_authority_data.stage,
+            branch_tax_authority_data.point_of_sale_id,
+        )
+        unsigned_invoices = [invoice for invoice in invoices if invoice.id not in signed_invoices]
+        if not unsigned_invoices:
+            return signed_invoices
+        invoices_data = [await self._prepare_invoice_for_signing(ctx, branch_tax_authority_data, invoice, submission_context.lines_data) for invoice in unsigned_invoices]
+        # Reserved last, the chain stays locked from here until the transaction ends
+        starting_icv, starting_pih = await self._reserve_chain_slot(branch_tax_authority_data)
+        try:
+            signing_material = invoice_helper.get_signing_material(csid.id, csid.private_key, csid.certificate)
+            invoice_requests = await invoice_helper.sign_batch_async(invoices_data, signing_material, starting_pih, starting_icv, validate=settings.ZATCA_VALIDATE_INVOICES)
+        except InvoiceValidationError as e:
+            raise ZatcaInvoiceValidationException(detail=str(e))
+        except Exception as e:
+            raise ZatcaInvoiceSigningException()
+        data = []
+        pih = starting_pih
+        for index, (invoice, invoice_request) in enumerate(zip(unsigned_invoices, invoice_requests)):
+            data.append({"invoice_id": invoice.id, **self._get_signed_invoice_data(branch_tax_authority_data, starting_icv + index, pih, invoice_request)})
+            pih = invoice_request["invoiceHash"]
+        for invoice, signed_invoice in zip(unsigned_invoices, await self.zatca_repo.create_invoices_tax_authority_data(data)):
+            signed_invoices[invoice.id] = signed_invoice
+        # The chain moves forward once, to the last invoice of the run
+        await self.zatca_repo.update_pih_and_icv(branch_tax_authority_data.organization_id, branch_tax_authority_data.branch_id, branch_tax_authority_data.stage, starting_icv + len(unsigned_invoices) - 1, pih, branch_tax_authority_data.point_of_sale_id)
+        return signed_invoices
+
+    def _get_chain_lock_order(self, submission_context: ZatcaPhase2SubmissionContext) -> tuple:
+        """The chain of the branch first, then those of its points of sale by id"""
+        branch_tax_authority_data = submission_context.branch_data
+        return (branch_tax_authority_data.stage, branch_tax_authority_data.point_of_sale_id is not None, branch_tax_authority_data.point_of_sale_id or 0)
+
+    async def sign_invoices(self, ctx: RequestContext, invoices: list[SaleInvoiceOut], metadata: dict = {}) -> list[ZatcaPhase2InvoiceDataOut]:
+        """Signs a run of invoices of the current branch, such as the end of day invoices of a point of sale, and stores
+        them until they are submitted. The invoices of every EGS unit are signed as one chain of that unit, in the
+        order given. Nothing is sent: the chains stay locked until the transaction ends, so it is committed before the
+        invoices are submitted, through the submission queue."""
+        if not invoices:
+            return []
+        invoices_by_point_of_sale = {}
+        for invoice in invoices:
+            point_of_sale_id = invoice.point_of_sale.id if invoice.point_of_sale is not None else None
+            invoices_by_point_of_sale.setdefault(point_of_sale_id, []).append(invoice)
+        submission_contexts = {}
+        invoices_submission_context = {}
+        for point_of_sale_id, point_of_sale_invoices in invoices_by_point_of_sale.items():
+            submission_context = await self._get_submission_context(ctx, point_of_sale_id, point_of_sale_invoices)
+            # Points of sale without a unit of their own share the one of the branch, and its chain
+            unit_submission_context = submission_contexts.setdefault(submission_context.branch_data.point_of_sale_id, submission_context)
+            unit_submission_context.lines_data.update(submission_context.lines_data)
+            for invoice in point_of_sale_invoices:
+                invoices_submission_context[invoice.id] = unit_submission_context
+        signed_invoices = {}
+        # The chains are locked in the same order by every run, whatever the order of its invoices, so two runs over
+        # the same units wait for each other instead of deadlocking
+        for submission_context in sorted(submission_contexts.values(), key=self._get_chain_lock_order):
+            unit_invoices = [invoice for invoice in invoices if invoices_submission_context[invoice.id] is submission_context]
+            signed_invoices.update(await self._sign_invoices(ctx, submission_context, unit_invoices))
+        return [ZatcaPhase2InvoiceDataOut.model_validate(signed_invoices[invoice.id]) for invoice in invoices]
 
     # async def _send_compliance_invoices(self, ctx: RequestContext, invoicing_type: InvoicingType) -> None:
     #     invoice_types = []
@@ -0,0 +1,172 @@
+import asyncio
+import base64
+import re
+import threading
+import uuid
+from collections import deque
+from cryptography import x509
+from cryptography.x509.oid import NameOID, ObjectIdentifier
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+
+class key_pool:
+    """Process-wide pool of private keys generated ahead of time, so onboarding a branch does not wait for one.
+
+    Keys only ever live in the memory of this process, they are never written anywhere before being taken, and
+    every key is handed out once and removed from the pool. Once taking keys leaves the pool at or below
+    REFILL_THRESHOLD of its size, a background thread tops it up again, away from the request. When the pool is
+    empty the key is generated on the spot.
+    """
+
+    # Fraction of the pool left when a refill starts, refilling in bursts keeps the thread from running on every take
+    REFILL_THRESHOLD = 0.5
+
+    _lock = threading.Lock()
+    _size: int = 8
+    _keys: deque = deque()
+    _refilling: bool = False
+    _metrics: dict[str, int] = {"taken": 0, "generated_on_demand": 0, "generated_ahead": 0}
+
+    @staticmethod
+    def generate():
+        """Returns a new private key object, not a serialized string"""
+        return ec.generate_private_key(ec.SECP256K1(), default_backend())
+
+    @staticmethod
+    def configure(size: int = 8) -> None:
+        """Sets the number of keys kept ready, 0 disables the pool and every key is generated when taken"""
+        if size < 0:
+            raise ValueError("The key pool size cannot be negative")
+        with key_pool._lock:
+            key_pool._size = size
+            while len(key_pool._keys) > size:
+                key_pool._keys.pop()
+
+    @staticmethod
+    def fill() -> None:
+        """Generates keys until the pool is full, on the calling thread"""
+        try:
+            while True:
+                with key_pool._lock:
+                    if len(key_pool._keys) >= key_pool._size:
+                        return
+                # Generated outside the lock so taking a key never waits for a refill
+                private_key = key_pool.generate()
+                with key_pool._lock:
+                    if len(key_pool._keys) >= key_pool._size:
+                        return
+                    key_pool._keys.append(private_key)
+                    key_pool._metrics["generated_ahead"] += 1
+        finally:
+            with key_pool._lock:
+                key_pool._refilling = False
+
+    @staticmethod
+    def start() -> None:
+        """Tops the pool up on a background thread, unless a refill is already running or the pool is full"""
+        with key_pool._lock:
+            if key_pool._refilling or len(key_pool._keys) >= key_pool._size:
+                return
+            key_pool._refilling = True
+        threading.Thread(target=key_pool.fill, name="key-pool", daemon=True).start()
+
+    @staticmethod
+    def take():
+        """Removes a key from the pool and returns it, or generates one when the pool is empty"""
+        with key_pool._lock:
+            private_key = key_pool._keys.popleft() if key_pool._keys else None
+            key_pool._metrics["taken"] += 1
+            if private_key is None:
+                key_pool._metrics["generated_on_demand"] += 1
+            refill = len(key_pool._keys) <= key_pool._size * key_pool.REFILL_THRESHOLD
+        if refill:
+            key_pool.start()
+        return private_key if private_key is not None else key_pool.generate()
+
+    @staticmethod
+    def clear() -> None:
+        """Drops every key that was not taken yet"""
+        with key_pool._lock:
+            key_pool._keys.clear()
+
+    @staticmethod
+    def get_metrics() -> dict[str, int]:
+        with key_pool._lock:
+            return dict(key_pool._metrics, available=len(key_pool._keys), size=key_pool._size)
+
+
+class csr_generator:
+    """Builds the private key and the CSR a branch sends to Zatca for its compliance CSID.
+
+    The key comes from key_pool. Building and signing the CSR is CPU work, generate_async() runs it on a worker
+    thread so the event loop keeps serving other requests while branches are onboarded.
+    """
+
+    # Extension holding the certificate template name, ZATCA_ASN_TEMPLATE in the settings
+    CERTIFICATE_TEMPLATE_NAME = ObjectIdentifier("1.3.6.1.4.1.311.20.2")
+
+    @staticmethod
+    def generate_serial_number() -> str:
+        """Generates a serial number for CSR generation."""
+        serial_uuid = str(uuid.uuid4())
+        serial_number = "|".join(["1-Wasel", "2-v1", f"3-{serial_uuid}"])
+        return serial_number
+
+    @staticmethod
+    def build_csr(branch, private_key, asn_template: str) -> x509.CertificateSigningRequest:
+        """Builds the CSR of a branch and signs it with private_key"""
+        csr_builder = x509.CertificateSigningRequestBuilder()
+        csr_builder = csr_builder.subject_name(x509.Name([
+            x509.NameAttribute(NameOID.COUNTRY_NAME, branch.country_code),
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, branch.organization_unit_name),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, branch.organization_name),
+            x509.NameAttribute(NameOID.COMMON_NAME, branch.common_name)
+        ]))
+        # Add ASN.1 extension
+        csr_builder = csr_builder.add_extension(
+            x509.UnrecognizedExtension(csr_generator.CERTIFICATE_TEMPLATE_NAME, asn_template.encode()),
+            critical=False
+        )
+        # Add SAN extension
+        csr_builder = csr_builder.add_extension(
+            x509.SubjectAlternativeName([
+                x509.DirectoryName(x509.Name([
+                    x509.NameAttribute(ObjectIdentifier("2.5.4.4"), csr_generator.generate_serial_number()),
+                    x509.NameAttribute(ObjectIdentifier("0.9.2342.19200300.100.1.1"), branch.vat_number),
+                    x509.NameAttribute(ObjectIdentifier("2.5.4.12"), branch.invoicing_type),
+                    x509.NameAttribute(ObjectIdentifier("2.5.4.26"), branch.address),
+                    x509.NameAttribute(ObjectIdentifier("2.5.4.15"), branch.business_category)
+                ]))
+            ]),
+            critical=False
+        )
+        # Sign the CSR with the private key
+        return csr_builder.sign(private_key, hashes.SHA256(), default_backend())
+
+    @staticmethod
+    def generate(branch, asn_template: str) -> tuple[str, str]:
+        """Generates a private key and CSR in base64 and returns them as a tuple of strings (private_key, csr_base64)."""
+        private_key = key_pool.take()
+        csr = csr_generator.build_csr(branch, private_key, asn_template)
+        # Serialize private key and CSR
+        private_key_pem = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        csr_pem = csr.public_bytes(serialization.Encoding.PEM)
+        # Strip header/footer from private key
+        private_key_content = re.sub(
+            r'-----BEGIN .* PRIVATE KEY-----|-----END .* PRIVATE KEY-----|\n', '',
+            private_key_pem.decode('utf-8')
+        )
+        # Encode CSR in Base64
+        csr_base64 = base64.b64encode(csr_pem).decode('utf-8')
+        return private_key_content, csr_base64
+
+    @staticmethod
+    async def generate_async(branch, asn_template: str) -> tuple[str, str]:
+        """Same as generate(), on a worker thread"""
+        return await asyncio.to_thread(csr_generator.generate, branch, asn_template)
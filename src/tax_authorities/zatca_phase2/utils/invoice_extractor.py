@@ -0,0 +1,133 @@
+import base64
+import binascii
+import re
+from lxml import etree
+
+
+CBC = "{urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2}"
+CAC = "{urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2}"
+DS = "{http://www.w3.org/2000/09/xmldsig#}"
+
+
+class invoice_extractor:
+    """Reads the QR code and the invoice hash out of signed or cleared invoices without parsing the whole document.
+
+    Both values sit in the head of the invoice: the hash in the signature inside UBLExtensions and the QR code in
+    the document references before the parties. Only the first HEAD_SIZE base64 characters are decoded and
+    scanned at first, the rest of the invoice is only decoded when a value is not found there. Documents the
+    scan does not recognize, such as ones with comments or CDATA around the values, fall back to a pull parser
+    fed with slices of the decoded buffer, which stops at the first matching element.
+    """
+
+    # Base64 characters decoded first, a multiple of 4 that covers the signature and the document references
+    HEAD_SIZE = 32768
+    # Bytes fed to the pull parser at a time
+    CHUNK_SIZE = 16384
+    QR_CODE = re.compile(
+        rb"<(?:[\w.-]+:)?ID>\s*QR\s*</(?:[\w.-]+:)?ID>\s*<(?:[\w.-]+:)?Attachment>\s*"
+        rb"<(?:[\w.-]+:)?EmbeddedDocumentBinaryObject\b[^>]*>\s*([A-Za-z0-9+/=]+)\s*<"
+    )
+    INVOICE_HASH = re.compile(
+        rb"<(?:[\w.-]+:)?Reference\b[^>]*\bId=[\"']invoiceSignedData[\"'][^>]*>"
+        rb"(?:(?!</(?:[\w.-]+:)?Reference>).)*?<(?:[\w.-]+:)?DigestValue>\s*([A-Za-z0-9+/=]+)\s*<",
+        re.DOTALL,
+    )
+    # Cheap checks for whether a value can be in the invoice at all, before falling back to the pull parser
+    HAS_QR_CODE = re.compile(rb">\s*QR\s*<")
+    HAS_INVOICE_HASH = re.compile(rb"invoiceSignedData")
+
+    @staticmethod
+    def decode(invoice: str | bytes, size: int | None = None) -> memoryview:
+        """Decodes the first size base64 characters of the invoice, or all of it when size is None"""
+        if isinstance(invoice, str):
+            invoice = invoice.encode("ascii")
+        if size is not None and size < len(invoice):
+            try:
+                return memoryview(base64.b64decode(invoice[:size], validate=True))
+            except binascii.Error:
+                # Whitespace or line breaks shift the 4 character groups, the whole invoice is decoded instead
+                pass
+        return memoryview(base64.b64decode(invoice))
+
+    @staticmethod
+    def scan(xml: memoryview | bytes, pattern: re.Pattern) -> str | None:
+        match = pattern.search(xml)
+        return match.group(1).decode("ascii") if match is not None else None
+
+    @staticmethod
+    def pull(xml: memoryview | bytes, tag: str, read) -> str | None:
+        """Parses the invoice one slice at a time and returns read(element) for the first element it is not None"""
+        xml = memoryview(xml)
+        parser = etree.XMLPullParser(events=("end",), tag=tag)
+        for start in range(0, len(xml), invoice_extractor.CHUNK_SIZE):
+            parser.feed(xml[start:start + invoice_extractor.CHUNK_SIZE].tobytes())
+            for _, element in parser.read_events():
+                value = read(element)
+                if value is not None:
+                    return value
+        return None
+
+    @staticmethod
+    def read_qr_code(element: etree._Element) -> str | None:
+        if element.findtext(f"{CBC}ID") != "QR":
+            return None
+        return element.findtext(f"{CAC}Attachment/{CBC}EmbeddedDocumentBinaryObject")
+
+    @staticmethod
+    def read_invoice_hash(element: etree._Element) -> str | None:
+        if element.get("Id") != "invoiceSignedData":
+            return None
+        return element.findtext(f"{DS}DigestValue")
+
+    @staticmethod
+    def find_qr_code(xml: memoryview | bytes) -> str | None:
+        """Returns the QR code of a decoded invoice"""
+        qr_code = invoice_extractor.scan(xml, invoice_extractor.QR_CODE)
+        if qr_code is None and invoice_extractor.HAS_QR_CODE.search(xml) is not None:
+            qr_code = invoice_extractor.pull(xml, f"{CAC}AdditionalDocumentReference", invoice_extractor.read_qr_code)
+        return qr_code
+
+    @staticmethod
+    def find_invoice_hash(xml: memoryview | bytes) -> str | None:
+        """Returns the invoice hash of a decoded invoice"""
+        invoice_hash = invoice_extractor.scan(xml, invoice_extractor.INVOICE_HASH)
+        if invoice_hash is None and invoice_extractor.HAS_INVOICE_HASH.search(xml) is not None:
+            invoice_hash = invoice_extractor.pull(xml, f"{DS}Reference", invoice_extractor.read_invoice_hash)
+        return invoice_hash
+
+    @staticmethod
+    def extract(invoice: str | bytes) -> tuple[str | None, str | None]:
+        """Returns the (QR code, invoice hash) of a base64 invoice, decoding it once for both"""
+        head = invoice_extractor.decode(invoice, invoice_extractor.HEAD_SIZE)
+        qr_code = invoice_extractor.scan(head, invoice_extractor.QR_CODE)
+        invoice_hash = invoice_extractor.scan(head, invoice_extractor.INVOICE_HASH)
+        if qr_code is None or invoice_hash is None:
+            xml = invoice_extractor.decode(invoice)
+            if qr_code is None:
+                qr_code = invoice_extractor.find_qr_code(xml)
+            if invoice_hash is None:
+                invoice_hash = invoice_extractor.find_invoice_hash(xml)
+        return qr_code, invoice_hash
+
+    @staticmethod
+    def extract_qr_code(invoice: str | bytes) -> str | None:
+        """Returns the QR code of a base64 invoice"""
+        qr_code = invoice_extractor.scan(invoice_extractor.decode(invoice, invoice_extractor.HEAD_SIZE), invoice_extractor.QR_CODE)
+        return qr_code if qr_code is not None else invoice_extractor.find_qr_code(invoice_extractor.decode(invoice))
+
+    @staticmethod
+    def extract_invoice_hash(invoice: str | bytes) -> str | None:
+        """Returns the invoice hash of a base64 invoice"""
+        invoice_hash = invoice_extractor.scan(invoice_extractor.decode(invoice, invoice_extractor.HEAD_SIZE), invoice_extractor.INVOICE_HASH)
+        return invoice_hash if invoice_hash is not None else invoice_extractor.find_invoice_hash(invoice_extractor.decode(invoice))
+
+    @staticmethod
+    def extract_many(invoices: list[str | bytes | None]) -> list[tuple[str | None, str | None]]:
+        """Returns the (QR code, invoice hash) of every invoice in order, (None, None) for a missing or broken one"""
+        results = []
+        for invoice in invoices:
+            try:
+                results.append(invoice_extractor.extract(invoice) if invoice else (None, None))
+            except (binascii.Error, ValueError, etree.XMLSyntaxError):
+                results.append((None, None))
+        return results
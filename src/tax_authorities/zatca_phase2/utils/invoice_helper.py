@@ -1,5 +1,12 @@
+import asyncio
 from src.core.enums import DocumentType, InvoiceType, InvoiceTypeCode
+from .einvoice_signer import einvoice_signer
 from .xml_generator import xml_generator
+from .invoice_extractor import invoice_extractor
+from .invoice_validator import InvoiceValidationError, invoice_validator
+from .signing_material import SigningMaterial, signing_material_cache
+from .signing_executor import signing_executor
+from .supplier_party_cache import supplier_party_cache
 
 class invoice_helper:
 
@@ -15,6 +22,9 @@ class invoice_helper:
             InvoiceTypeCode.DEBIT_NOTE: {InvoiceType.STANDARD: "QT", InvoiceType.SIMPLIFIED: "QT"},  
         }
     }  
+    # Stands in for the PIH while a batch is built, it is replaced by the real hash once the chain is known
+    # It is valid base64 so the batch still passes the schema when it is validated before signing
+    BATCH_PIH_PLACEHOLDER = "V0FTRUxCQVRDSFBJSFBMQUNFSE9MREVS"
 
     @staticmethod
     def extract_error_message_from_response(response: dict | None) -> str | None:
@@ -35,10 +45,108 @@ class invoice_helper:
         return f"{prefix}-{two_digit_year}-{zumber}"
     
     @staticmethod
-    def sign_and_get_request(invoice_data, private_key, x509_certificate_content) -> dict[str, str]:
-        """Signs the invoice and returns the invoice request as a dictionary containing {invoice_hash, uuid, invoice}"""
-        return xml_generator.sign_and_get_request(invoice_data, private_key, x509_certificate_content)
+    def get_signing_material(csid_id: int | None, private_key: str, x509_certificate_content: str) -> SigningMaterial:
+        """Returns the parsed key and certificate of the CSID, cached per process until the CSID is renewed"""
+        return signing_material_cache.get(csid_id, x509_certificate_content, private_key)
+
+    @staticmethod
+    def invalidate_supplier_party(branch_id: int) -> None:
+        """Drops the cached supplier party of the branch after its tax authority data changed. Worker processes
+        notice the change on their own, their cached party no longer matches the supplier values."""
+        supplier_party_cache.invalidate(branch_id)
+
+    @staticmethod
+    def sign_and_get_request(invoice_data, signing_material: SigningMaterial, validate: bool = False, signature_timestamp: str | None = None) -> dict[str, str]:
+        """Signs the invoice and returns the invoice request as a dictionary containing {invoice_hash, uuid, invoice}.
+        With validate, the built invoice is validated first and InvoiceValidationError is raised if it has errors.
+        signature_timestamp fixes the signing time, which is the current time by default."""
+        if not validate:
+            return xml_generator.sign_and_get_request(invoice_data, signing_material, signature_timestamp)
+        document = xml_generator.generate_xml_invoice_tree(invoice_data)
+        invoice_validator.raise_for_errors([invoice_validator.validate(document)])
+        return einvoice_signer.get_request_api(document, signing_material, signature_timestamp).to_request()
+
+    @staticmethod
+    async def sign_and_get_request_async(invoice_data, signing_material: SigningMaterial, validate: bool = False) -> dict[str, str]:
+        """Same as sign_and_get_request, but runs on the signing executor so the event loop is not blocked"""
+        return await signing_executor.run(invoice_helper.sign_and_get_request, invoice_data, signing_material, validate)
     
+    @staticmethod
+    def canonicalize_batch(invoices: list[dict], starting_icv: int, validate: bool = False) -> list[tuple[str, bool, str, list | None]]:
+        """Builds and canonicalizes a run of invoices with consecutive ICVs. The PIH is left as a placeholder
+        so the invoices do not depend on each other and can be built in any order. With validate, every invoice
+        is validated once built and InvoiceValidationError is raised with all the invoices that have errors."""
+        canonicalized = []
+        results = []
+        for index, invoice_data in enumerate(invoices):
+            invoice_data = dict(invoice_data, icv=str(starting_icv + index), pih=invoice_helper.BATCH_PIH_PLACEHOLDER)
+            document = xml_generator.generate_xml_invoice_tree(invoice_data)
+            if validate:
+                results.append(invoice_validator.validate(document))
+            uuid, is_simplified_invoice, canonical_xml, qr_details = einvoice_signer.canonicalize_invoice(document)
+            if canonical_xml.count(invoice_helper.BATCH_PIH_PLACEHOLDER) != 1:
+                raise Exception(f"Could not locate the PIH of invoice {invoice_data.get('invoice_number')} in its canonical form")
+            canonicalized.append((uuid, is_simplified_invoice, canonical_xml, qr_details))
+        invoice_validator.raise_for_errors(results)
+        return canonicalized
+
+    @staticmethod
+    def chain_batch(canonicalized: list[tuple[str, bool, str, list | None]], starting_pih: str) -> list[tuple[str, bool, str, list | None, str]]:
+        """Fills in the PIH of every invoice with the hash of the one before it and returns them with their hashes"""
+        chained = []
+        pih = starting_pih
+        for uuid, is_simplified_invoice, canonical_xml, qr_details in canonicalized:
+            # The PIH is base64, which canonicalization leaves untouched, so it can be substituted in the canonical form
+            canonical_xml = canonical_xml.replace(invoice_helper.BATCH_PIH_PLACEHOLDER, pih)
+            pih = einvoice_signer.generate_base64_hash(canonical_xml)
+            chained.append((uuid, is_simplified_invoice, canonical_xml, qr_details, pih))
+        return chained
+
+    @staticmethod
+    def complete_batch(chained: list[tuple[str, bool, str, list | None, str]], signing_material: SigningMaterial, signature_timestamp: str | None = None) -> list[dict[str, str]]:
+        """Signs the hashed invoices and returns their requests"""
+        return [
+            einvoice_signer.complete_request(uuid, is_simplified_invoice, canonical_xml, base64_hash, signing_material, qr_details, signature_timestamp).to_request()
+            for uuid, is_simplified_invoice, canonical_xml, qr_details, base64_hash in chained
+        ]
+
+    @staticmethod
+    def sign_batch(invoices: list[dict], signing_material: SigningMaterial, starting_pih: str, starting_icv: int, validate: bool = False, signature_timestamp: str | None = None) -> list[dict[str, str]]:
+        """Signs a chain of invoices and returns their requests in order. The invoices get consecutive ICVs from
+        starting_icv, and each one's PIH is the invoiceHash of the invoice before it, starting from starting_pih."""
+        canonicalized = invoice_helper.canonicalize_batch(invoices, starting_icv, validate)
+        chained = invoice_helper.chain_batch(canonicalized, starting_pih)
+        return invoice_helper.complete_batch(chained, signing_material, signature_timestamp)
+
+    @staticmethod
+    async def sign_batch_async(invoices: list[dict], signing_material: SigningMaterial, starting_pih: str, starting_icv: int, chunk_size: int = 50, validate: bool = False) -> list[dict[str, str]]:
+        """Same as sign_batch, but the building and the signing are spread over the signing executor in chunks.
+        Only the hashing of the chain runs in order."""
+        chunks = [(invoices[i:i + chunk_size], starting_icv + i) for i in range(0, len(invoices), chunk_size)]
+        canonicalized_chunks = await asyncio.gather(*[
+            signing_executor.run(invoice_helper.canonicalize_batch, chunk, chunk_icv, validate) for chunk, chunk_icv in chunks
+        ], return_exceptions=True)
+        for chunk in canonicalized_chunks:
+            if isinstance(chunk, InvoiceValidationError):
+                # Report the invalid invoices of every chunk at once, not only those of the first chunk
+                invoice_validator.raise_for_errors([result for chunk in canonicalized_chunks if isinstance(chunk, InvoiceValidationError) for result in chunk.results])
+            if isinstance(chunk, BaseException):
+                raise chunk
+        canonicalized = [invoice for chunk in canonicalized_chunks for invoice in chunk]
+        chained = invoice_helper.chain_batch(canonicalized, starting_pih)
+        signed_chunks = await asyncio.gather(*[
+            signing_executor.run(invoice_helper.complete_batch, chained[i:i + chunk_size], signing_material) for i in range(0, len(chained), chunk_size)
+        ])
+        return [request for chunk in signed_chunks for request in chunk]
+
     @staticmethod
     def extract_base64_qr_code(invoice) -> str | None:
-        return xml_generator.extract_base64_qr_code(invoice)
\ No newline at end of file
+        return xml_generator.extract_base64_qr_code(invoice)
+
+    @staticmethod
+    async def extract_many_async(invoices: list[str | None], chunk_size: int = 200) -> list[tuple[str | None, str | None]]:
+        """Returns the (QR code, invoice hash) of many base64 invoices, read on the signing executor in chunks"""
+        chunks = await asyncio.gather(*[
+            signing_executor.run(invoice_extractor.extract_many, invoices[i:i + chunk_size]) for i in range(0, len(invoices), chunk_size)
+        ])
+        return [result for chunk in chunks for result in chunk]
@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import re
+from typing import BinaryIO, Iterator
+from lxml import etree
+from .einvoice_signer import einvoice_signer, SignedInvoice
+from .qr_code_generator import qr_code_generator
+from .resource_registry import resource_registry
+from .xml_generator import xml_generator
+
+
+class invoice_streamer:
+    """Generates and hashes invoices with a very large number of lines without holding the document in memory.
+
+    The invoice is built without its lines and canonicalized once, then every line is built, canonicalized and
+    dropped one at a time. The canonical chunks are exactly the slices of the canonical form einvoice_signer hashes,
+    so the hash and the encoded invoice are the same as the ones of the in-memory path. Memory stays flat in the
+    number of lines, apart from the invoice data itself.
+    """
+
+    INVOICE_END = "\n</Invoice>"
+    LINE_SEPARATOR = "\n\t"
+    NAMESPACE_DECLARATION = re.compile(r' xmlns(?::[A-Za-z_][\w.-]*)?="[^"]*"')
+
+    @staticmethod
+    def canonicalize_invoice(invoice_data: dict) -> tuple[str, bool, list | None, Iterator[str]]:
+        """Returns (uuid, is_simplified_invoice, qr_details, chunks) where chunks lazily yields the canonical invoice"""
+        header_data = dict(invoice_data, invoice_lines=[])
+        root = xml_generator.build_xml_invoice(header_data, normalize=True).getroot()
+        etree.indent(root, space="\t")
+        uuid, is_simplified_invoice, canonical_xml, qr_details = einvoice_signer.canonicalize_invoice(root)
+        if not canonical_xml.endswith(invoice_streamer.INVOICE_END):
+            raise Exception("Unexpected end of the canonical invoice.")
+        # Lines are the last children of the invoice, they go between the header and the closing tag
+        header = canonical_xml[:-len(invoice_streamer.INVOICE_END)]
+        root_declarations = {f' xmlns{":" + prefix if prefix else ""}="{uri}"' for prefix, uri in root.nsmap.items()}
+        return uuid, is_simplified_invoice, qr_details, invoice_streamer.iter_chunks(invoice_data, root, header, root_declarations)
+
+    @staticmethod
+    def iter_chunks(invoice_data: dict, root: etree._Element, header: str, root_declarations: set[str]) -> Iterator[str]:
+        yield header
+        # Lines are built under an empty copy of the invoice element so they see the same namespaces
+        parent = etree.Element(root.tag, nsmap=root.nsmap)
+        currency_id = invoice_data["document_currency_code"]
+        for line in invoice_data["invoice_lines"]:
+            xml_generator.add_invoice_line(line, parent)
+            line_root = parent[0]
+            xml_generator.fill_and_clear_tags(line_root, invoice_data, currency_id, normalize=True)
+            if len(parent) == 0:
+                continue
+            etree.indent(line_root, space="\t", level=1)
+            line_root.tail = None
+            yield invoice_streamer.LINE_SEPARATOR + invoice_streamer.canonicalize_line(line_root, root_declarations)
+            parent.remove(line_root)
+        yield invoice_streamer.INVOICE_END
+
+    @staticmethod
+    def canonicalize_line(line_root: etree._Element, root_declarations: set[str]) -> str:
+        """Canonicalizes a line on its own. The namespaces the invoice element already declares are dropped from the
+        start tag, since the canonical form of the whole invoice only declares them once on the invoice element."""
+        canonical_line = etree.tostring(line_root, method='c14n').decode('utf-8')
+        start_tag_end = canonical_line.find('>')
+        start_tag = invoice_streamer.NAMESPACE_DECLARATION.sub(
+            lambda match: "" if match.group(0) in root_declarations else match.group(0),
+            canonical_line[:start_tag_end],
+        )
+        return start_tag + canonical_line[start_tag_end:]
+
+    @staticmethod
+    def hash_invoice(invoice_data: dict) -> str:
+        """Returns the base64 invoice hash, computed over the canonical chunks as they are generated"""
+        _, _, _, chunks = invoice_streamer.canonicalize_invoice(invoice_data)
+        digest = hashlib.sha256()
+        for chunk in chunks:
+            digest.update(chunk.encode('utf-8'))
+        return base64.b64encode(digest.digest()).decode()
+
+    @staticmethod
+    def write_invoice(invoice_data: dict, signing_material, output: BinaryIO, signature_timestamp: str | None = None) -> SignedInvoice:
+        """Writes the base64 encoded invoice of the request into output and returns the rest of the request.
+        The returned SignedInvoice has no invoice, its content is what was written to output.
+
+        Standard invoices are written in the same pass that hashes them. Simplified invoices need their hash
+        before the signature can be written, so their lines are generated twice instead of being kept."""
+        uuid, is_simplified_invoice, qr_details, chunks = invoice_streamer.canonicalize_invoice(invoice_data)
+        xml_declaration = '<?xml version="1.0" encoding="UTF-8"?>'
+        encoder = base64_writer(output)
+        if not is_simplified_invoice:
+            digest = hashlib.sha256()
+            encoder.write(f"{xml_declaration}\n".encode('utf-8'))
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                digest.update(data)
+                encoder.write(data)
+            encoder.close()
+            return SignedInvoice(uuid, base64.b64encode(digest.digest()).decode(), None)
+
+        base64_hash = invoice_streamer.hash_invoice(invoice_data)
+        header = next(chunks)
+        signature_timestamp = signature_timestamp or einvoice_signer.get_signature_timestamp()
+        signed_properties_hash = einvoice_signer.get_signed_properties_hash(signature_timestamp, signing_material.public_key_hashing, signing_material.issuer_name, signing_material.serial_number)
+        signature_value = einvoice_signer.get_digital_signature(base64_hash, signing_material.private_key)
+        ubl_content = einvoice_signer.populate_ubl_template(base64_hash, signed_properties_hash, signature_value, signing_material.certificate_content, signature_timestamp, signing_material.public_key_hashing, signing_material.issuer_name, signing_material.serial_number)
+        qr_code = qr_code_generator.generate_qr_code(None, base64_hash, signature_value, signing_material.ecdsa_result, qr_details)
+        signature_content = resource_registry.get_signature_template().replace("BASE64_QRCODE", qr_code)
+        # The UBL extensions and the signature both go into the header, the lines follow unchanged
+        signed_header = einvoice_signer.insert_signature_fragments(f"{xml_declaration}\n", header, ubl_content, signature_content)
+        encoder.write(signed_header.encode('utf-8'))
+        for chunk in chunks:
+            encoder.write(chunk.encode('utf-8'))
+        encoder.close()
+        return SignedInvoice(uuid, base64_hash, None, qr_code)
+
+
+class base64_writer:
+    """Base64 encodes everything written to it into output, in chunks whose length is a multiple of three bytes"""
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self.pending = b""
+
+    def write(self, data: bytes) -> None:
+        data = self.pending + data
+        cut = len(data) - len(data) % 3
+        self.output.write(base64.b64encode(data[:cut]))
+        self.pending = data[cut:]
+
+    def close(self) -> None:
+        self.output.write(base64.b64encode(self.pending))
+        self.pending = b""
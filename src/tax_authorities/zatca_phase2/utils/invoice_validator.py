@@ -0,0 +1,391 @@
+import asyncio
+import threading
+from decimal import Decimal, InvalidOperation
+from lxml import etree
+from .resource_registry import resource_registry
+from .signing_executor import signing_executor
+from .xml_generator import xml_generator
+
+
+CBC = "{urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2}"
+CAC = "{urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2}"
+
+
+class ValidationIssue:
+    """A rule the invoice breaks, named after the ZATCA or EN 16931 business rule it comes from"""
+
+    ERROR = "error"
+    WARNING = "warning"
+
+    __slots__ = ("rule", "severity", "message")
+
+    def __init__(self, rule: str, severity: str, message: str):
+        self.rule = rule
+        self.severity = severity
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"[{self.rule}] {self.message}"
+
+    def __repr__(self) -> str:
+        return f"ValidationIssue({self.rule!r}, {self.severity!r}, {self.message!r})"
+
+
+class ValidationResult:
+    """Every issue found in one invoice. schema_checked is False when the UBL schema is not installed."""
+
+    __slots__ = ("invoice_number", "issues", "schema_checked")
+
+    def __init__(self, invoice_number: str | None, issues: list[ValidationIssue], schema_checked: bool):
+        self.invoice_number = invoice_number
+        self.issues = issues
+        self.schema_checked = schema_checked
+
+    @property
+    def errors(self) -> list[ValidationIssue]:
+        return [issue for issue in self.issues if issue.severity == ValidationIssue.ERROR]
+
+    @property
+    def warnings(self) -> list[ValidationIssue]:
+        return [issue for issue in self.issues if issue.severity == ValidationIssue.WARNING]
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+
+class InvoiceValidationError(Exception):
+    """Raised when one or more invoices break a rule that ZATCA would reject them for"""
+
+    def __init__(self, results: list[ValidationResult]):
+        self.results = results
+        messages = [f"{result.invoice_number}: {'; '.join(str(issue) for issue in result.errors)}" for result in results]
+        super().__init__(" | ".join(messages))
+
+    def __reduce__(self):
+        # Raised inside the process pool as well, so it has to survive pickling with its results
+        return (InvoiceValidationError, (self.results,))
+
+
+class Rules:
+    """Collects the issues of one invoice while its tree is walked. An amount read by several rules is only
+    reported once if it is broken."""
+
+    __slots__ = ("issues", "_seen")
+
+    def __init__(self):
+        self.issues: list[ValidationIssue] = []
+        self._seen: set[tuple[str, str]] = set()
+
+    def _add(self, rule: str, severity: str, message: str) -> None:
+        if (rule, message) not in self._seen:
+            self._seen.add((rule, message))
+            self.issues.append(ValidationIssue(rule, severity, message))
+
+    def error(self, rule: str, message: str) -> None:
+        self._add(rule, ValidationIssue.ERROR, message)
+
+    def warning(self, rule: str, message: str) -> None:
+        self._add(rule, ValidationIssue.WARNING, message)
+
+    def amount(self, node: etree._Element | None, path: str, rule: str, required: bool = True) -> Decimal | None:
+        """Reads a decimal child of node. Reports a missing required value or any value that is not a number."""
+        text = node.findtext(path) if node is not None else None
+        if text is None or not text.strip():
+            if required:
+                self.error(rule, f"{path.replace(CBC, 'cbc:').replace(CAC, 'cac:')} is missing")
+            return None
+        try:
+            return Decimal(text.strip())
+        except InvalidOperation:
+            self.error(rule, f"{path.replace(CBC, 'cbc:').replace(CAC, 'cac:')} is not a number: {text!r}")
+            return None
+
+
+class invoice_validator:
+    """Offline checks of a built invoice against the UBL 2.1 schema and the ZATCA business rules.
+
+    Catches the invoices ZATCA would reject before they are signed and use up an ICV and a place in the chain.
+    Only the arithmetic and cardinality rules are checked here, rules needing the history of the branch (such as
+    the PIH matching the previous invoice) are left to ZATCA. Amounts are compared as Decimals, the rules that
+    depend on how the amounts were rounded are reported as warnings within a tolerance of ROUNDING_TOLERANCE.
+    """
+
+    ROUNDING_TOLERANCE = Decimal("0.01")
+    INVOICE_TYPE_CODES = ("388", "381", "383")
+    CREDIT_AND_DEBIT_NOTES = ("381", "383")
+    TAX_CATEGORIES = ("S", "Z", "E", "O")
+    # The header fields that must appear exactly once, with the rule requiring them
+    REQUIRED_FIELDS = (
+        ("BR-02", f"{CBC}ID"),
+        ("BR-03", f"{CBC}IssueDate"),
+        ("BR-KSA-25", f"{CBC}IssueTime"),
+        ("BR-04", f"{CBC}InvoiceTypeCode"),
+        ("BR-05", f"{CBC}DocumentCurrencyCode"),
+        ("BR-KSA-03", f"{CBC}UUID"),
+    )
+
+    # A compiled schema keeps the log of its last run, so validations through it are serialized
+    _schema_lock = threading.Lock()
+
+    @staticmethod
+    def validate(xml: etree._Element | etree._ElementTree) -> ValidationResult:
+        """Validates a built invoice tree, signed or not"""
+        root = xml.getroot() if isinstance(xml, etree._ElementTree) else xml
+        rules = Rules()
+        schema_checked = invoice_validator.check_schema(root, rules)
+        invoice_validator.check_header(root, rules)
+        invoice_validator.check_parties(root, rules)
+        invoice_validator.check_lines(root, rules)
+        invoice_validator.check_tax_subtotals(root, rules)
+        invoice_validator.check_totals(root, rules)
+        return ValidationResult(root.findtext(f"{CBC}ID"), rules.issues, schema_checked)
+
+    @staticmethod
+    def validate_invoice(invoice_data) -> ValidationResult:
+        """Builds the invoice from its data and validates the tree"""
+        return invoice_validator.validate(xml_generator.generate_xml_invoice_tree(invoice_data))
+
+    @staticmethod
+    def validate_batch(invoices: list) -> list[ValidationResult]:
+        """Validates many invoices, returning their results in order"""
+        return [invoice_validator.validate_invoice(invoice_data) for invoice_data in invoices]
+
+    @staticmethod
+    async def validate_batch_async(invoices: list, chunk_size: int = 50) -> list[ValidationResult]:
+        """Same as validate_batch, but spread over the signing executor in chunks"""
+        chunks = await asyncio.gather(*[
+            signing_executor.run(invoice_validator.validate_batch, invoices[i:i + chunk_size]) for i in range(0, len(invoices), chunk_size)
+        ])
+        return [result for chunk in chunks for result in chunk]
+
+    @staticmethod
+    def raise_for_errors(results: list[ValidationResult]) -> None:
+        """Raises InvoiceValidationError with every result that has errors, warnings alone are let through"""
+        failed = [result for result in results if not result.is_valid]
+        if failed:
+            raise InvoiceValidationError(failed)
+
+    @staticmethod
+    def check_schema(root: etree._Element, rules: Rules) -> bool:
+        schema = resource_registry.get_invoice_schema()
+        if schema is None:
+            return False
+        with invoice_validator._schema_lock:
+            if not schema.validate(root):
+                for entry in schema.error_log:
+                    rules.error("UBL-XSD", f"{entry.path}: {entry.message}")
+        return True
+
+    @staticmethod
+    def check_header(root: etree._Element, rules: Rules) -> None:
+        for rule, path in invoice_validator.REQUIRED_FIELDS:
+            values = root.findall(path)
+            if len(values) != 1 or not (values[0].text or "").strip():
+                rules.error(rule, f"{path.replace(CBC, 'cbc:')} must appear exactly once, found {len(values)}")
+
+        type_code = root.find(f"{CBC}InvoiceTypeCode")
+        code = type_code.text.strip() if type_code is not None and type_code.text else None
+        name = type_code.get("name", "") if type_code is not None else ""
+        if code is not None and code not in invoice_validator.INVOICE_TYPE_CODES:
+            rules.error("BR-KSA-05", f"invoice type code {code} is not one of {', '.join(invoice_validator.INVOICE_TYPE_CODES)}")
+        if len(name) != 7 or name[:2] not in ("01", "02") or not name.isdigit():
+            rules.error("BR-KSA-06", f"invoice transaction code {name!r} must be 7 digits starting with 01 or 02")
+
+        references = {}
+        for reference in root.iterfind(f"{CAC}AdditionalDocumentReference"):
+            reference_id = (reference.findtext(f"{CBC}ID") or "").strip()
+            references.setdefault(reference_id, []).append(reference)
+        icv = references.get("ICV", [])
+        if len(icv) != 1:
+            rules.error("BR-KSA-33", f"the ICV must appear exactly once, found {len(icv)}")
+        elif not (icv[0].findtext(f"{CBC}UUID") or "").strip().isdigit():
+            rules.error("BR-KSA-34", "the ICV must be a number")
+        pih = references.get("PIH", [])
+        if len(pih) != 1:
+            rules.error("BR-KSA-61", f"the PIH must appear exactly once, found {len(pih)}")
+        elif not (pih[0].findtext(f"{CAC}Attachment/{CBC}EmbeddedDocumentBinaryObject") or "").strip():
+            rules.error("BR-KSA-61", "the PIH is empty")
+
+        if code in invoice_validator.CREDIT_AND_DEBIT_NOTES:
+            if not (root.findtext(f"{CAC}BillingReference/{CAC}InvoiceDocumentReference/{CBC}ID") or "").strip():
+                rules.error("BR-KSA-56", "credit and debit notes must reference the original invoice")
+            if not (root.findtext(f"{CAC}PaymentMeans/{CBC}InstructionNote") or "").strip():
+                rules.error("BR-KSA-17", "credit and debit notes must state the reason for issuing them")
+        if name.startswith("01") and code == "388" and not (root.findtext(f"{CAC}Delivery/{CBC}ActualDeliveryDate") or "").strip():
+            rules.error("BR-KSA-15", "standard tax invoices must have a supply date")
+
+    @staticmethod
+    def check_parties(root: etree._Element, rules: Rules) -> None:
+        supplier = root.find(f"{CAC}AccountingSupplierParty/{CAC}Party")
+        if supplier is None or not (supplier.findtext(f"{CAC}PartyLegalEntity/{CBC}RegistrationName") or "").strip():
+            rules.error("BR-06", "the seller name is missing")
+        vat_number = (supplier.findtext(f"{CAC}PartyTaxScheme/{CBC}CompanyID") or "").strip() if supplier is not None else ""
+        if len(vat_number) != 15 or not vat_number.isdigit() or vat_number[0] != "3" or vat_number[-1] != "3":
+            rules.error("BR-KSA-39", f"the seller VAT number {vat_number!r} must be 15 digits starting and ending with 3")
+        type_code = root.find(f"{CBC}InvoiceTypeCode")
+        if type_code is not None and type_code.get("name", "").startswith("01"):
+            customer = root.find(f"{CAC}AccountingCustomerParty/{CAC}Party")
+            if customer is None or not (customer.findtext(f"{CAC}PartyLegalEntity/{CBC}RegistrationName") or "").strip():
+                rules.error("BR-KSA-42", "standard tax invoices must have the buyer name")
+
+    @staticmethod
+    def check_lines(root: etree._Element, rules: Rules) -> None:
+        lines = root.findall(f"{CAC}InvoiceLine")
+        if not lines:
+            rules.error("BR-16", "the invoice has no lines")
+        tolerance = invoice_validator.ROUNDING_TOLERANCE
+        for line in lines:
+            line_id = line.findtext(f"{CBC}ID") or "?"
+            if not line_id.strip() or line_id == "?":
+                rules.error("BR-21", "a line has no identifier")
+            quantity = rules.amount(line, f"{CBC}InvoicedQuantity", "BR-22")
+            line_extension = rules.amount(line, f"{CBC}LineExtensionAmount", "BR-24")
+            if not (line.findtext(f"{CAC}Item/{CBC}Name") or "").strip():
+                rules.error("BR-25", f"line {line_id} has no item name")
+            price = rules.amount(line, f"{CAC}Price/{CBC}PriceAmount", "BR-26")
+            if price is not None and price < 0:
+                rules.error("BR-27", f"line {line_id} has a negative price {price}")
+
+            category = (line.findtext(f"{CAC}Item/{CAC}ClassifiedTaxCategory/{CBC}ID") or "").strip()
+            rate = rules.amount(line, f"{CAC}Item/{CAC}ClassifiedTaxCategory/{CBC}Percent", "BR-CO-04")
+            if category not in invoice_validator.TAX_CATEGORIES:
+                rules.error("BR-CL-18", f"line {line_id} has the unknown tax category {category!r}")
+            elif rate is not None and (rate <= 0 if category == "S" else rate != 0):
+                rules.error(f"BR-{category}-05", f"line {line_id} has the rate {rate} which is not allowed for category {category}")
+
+            tax = rules.amount(line, f"{CAC}TaxTotal/{CBC}TaxAmount", "BR-KSA-50")
+            rounding = rules.amount(line, f"{CAC}TaxTotal/{CBC}RoundingAmount", "BR-KSA-51")
+            if line_extension is None or tax is None:
+                continue
+            if rounding is not None and rounding != line_extension + tax:
+                rules.error("BR-KSA-51", f"line {line_id} rounding amount {rounding} is not {line_extension} + {tax}")
+            if rate is not None and abs(tax - line_extension * rate / 100) > tolerance:
+                rules.warning("BR-KSA-50", f"line {line_id} tax {tax} is not {line_extension} x {rate}%")
+            if quantity is not None and price is not None:
+                allowances = invoice_validator.sum_allowances(line, rules)
+                net = quantity * price - allowances
+                # Lines of invoices whose prices include tax are worth the line amount plus its tax
+                if abs(net - line_extension) > tolerance and abs(net - line_extension - tax) > tolerance:
+                    rules.warning("BR-KSA-EN16931-11", f"line {line_id} amount {line_extension} is not {quantity} x {price} - {allowances}")
+
+    @staticmethod
+    def check_tax_subtotals(root: etree._Element, rules: Rules) -> None:
+        line_amounts = {}
+        for line in root.iterfind(f"{CAC}InvoiceLine"):
+            category = (line.findtext(f"{CAC}Item/{CAC}ClassifiedTaxCategory/{CBC}ID") or "").strip()
+            amount = rules.amount(line, f"{CBC}LineExtensionAmount", "BR-24", required=False)
+            line_amounts[category] = line_amounts.get(category, Decimal("0")) + (amount or Decimal("0"))
+        document_allowances = {}
+        for allowance in root.iterfind(f"{CAC}AllowanceCharge"):
+            category = (allowance.findtext(f"{CAC}TaxCategory/{CBC}ID") or "").strip()
+            amount = rules.amount(allowance, f"{CBC}Amount", "BR-31") or Decimal("0")
+            sign = 1 if (allowance.findtext(f"{CBC}ChargeIndicator") or "").strip() == "true" else -1
+            document_allowances[category] = document_allowances.get(category, Decimal("0")) + sign * amount
+
+        subtotals = root.findall(f"{CAC}TaxTotal/{CAC}TaxSubtotal")
+        if not subtotals:
+            rules.error("BR-CO-18", "the invoice has no tax breakdown")
+        seen = set()
+        tolerance = invoice_validator.ROUNDING_TOLERANCE
+        for subtotal in subtotals:
+            category = (subtotal.findtext(f"{CAC}TaxCategory/{CBC}ID") or "").strip()
+            taxable = rules.amount(subtotal, f"{CBC}TaxableAmount", "BR-45")
+            tax = rules.amount(subtotal, f"{CBC}TaxAmount", "BR-46")
+            rate = rules.amount(subtotal, f"{CAC}TaxCategory/{CBC}Percent", "BR-48")
+            if category not in invoice_validator.TAX_CATEGORIES:
+                rules.error("BR-CL-18", f"the tax breakdown has the unknown tax category {category!r}")
+                continue
+            if category in seen:
+                rules.error(f"BR-{category}-08", f"the tax breakdown has category {category} more than once")
+            seen.add(category)
+            expected_taxable = line_amounts.get(category, Decimal("0")) + document_allowances.get(category, Decimal("0"))
+            if taxable is not None and taxable != expected_taxable:
+                rules.error(f"BR-{category}-08", f"taxable amount {taxable} of category {category} is not the lines minus the allowances, {expected_taxable}")
+            if category == "S":
+                if rate is not None and rate <= 0:
+                    rules.error("BR-S-06", f"category S has the rate {rate}")
+                elif rate is not None and taxable is not None and tax is not None and abs(tax - taxable * rate / 100) > tolerance:
+                    rules.warning("BR-S-09", f"tax {tax} of category S is not {taxable} x {rate}%")
+                continue
+            if rate is not None and rate != 0:
+                rules.error(f"BR-{category}-06", f"category {category} has the rate {rate}")
+            if tax is not None and tax != 0:
+                rules.error(f"BR-{category}-09", f"category {category} has the tax amount {tax}")
+            has_reason_code = (subtotal.findtext(f"{CAC}TaxCategory/{CBC}TaxExemptionReasonCode") or "").strip()
+            has_reason = (subtotal.findtext(f"{CAC}TaxCategory/{CBC}TaxExemptionReason") or "").strip()
+            if not has_reason_code or not has_reason:
+                rules.error("BR-KSA-69", f"category {category} needs an exemption reason and its code")
+        for category in line_amounts:
+            if category in invoice_validator.TAX_CATEGORIES and category not in seen:
+                rules.error(f"BR-{category}-01", f"lines of category {category} have no tax breakdown")
+
+    @staticmethod
+    def check_totals(root: etree._Element, rules: Rules) -> None:
+        totals = root.find(f"{CAC}LegalMonetaryTotal")
+        if totals is None:
+            rules.error("BR-12", "the document totals are missing")
+            return
+        line_extension = rules.amount(totals, f"{CBC}LineExtensionAmount", "BR-12")
+        tax_exclusive = rules.amount(totals, f"{CBC}TaxExclusiveAmount", "BR-13")
+        tax_inclusive = rules.amount(totals, f"{CBC}TaxInclusiveAmount", "BR-14")
+        payable = rules.amount(totals, f"{CBC}PayableAmount", "BR-15")
+        allowance_total = rules.amount(totals, f"{CBC}AllowanceTotalAmount", "BR-CO-11", required=False)
+        charge_total = rules.amount(totals, f"{CBC}ChargeTotalAmount", "BR-CO-12", required=False)
+        prepaid = rules.amount(totals, f"{CBC}PrepaidAmount", "BR-CO-16", required=False)
+        payable_rounding = rules.amount(totals, f"{CBC}PayableRoundingAmount", "BR-CO-16", required=False)
+
+        lines_total = sum(
+            (rules.amount(line, f"{CBC}LineExtensionAmount", "BR-24", required=False) or Decimal("0") for line in root.iterfind(f"{CAC}InvoiceLine")),
+            Decimal("0"),
+        )
+        if line_extension is not None and line_extension != lines_total:
+            rules.error("BR-CO-10", f"line extension amount {line_extension} is not the sum of the lines, {lines_total}")
+
+        allowances = Decimal("0")
+        charges = Decimal("0")
+        for allowance in root.iterfind(f"{CAC}AllowanceCharge"):
+            amount = rules.amount(allowance, f"{CBC}Amount", "BR-31") or Decimal("0")
+            if (allowance.findtext(f"{CBC}ChargeIndicator") or "").strip() == "true":
+                charges += amount
+            else:
+                allowances += amount
+        if (allowance_total or Decimal("0")) != allowances:
+            rules.error("BR-CO-11", f"allowance total {allowance_total} is not the sum of the document allowances, {allowances}")
+        if (charge_total or Decimal("0")) != charges:
+            rules.error("BR-CO-12", f"charge total {charge_total} is not the sum of the document charges, {charges}")
+
+        if line_extension is not None and tax_exclusive is not None:
+            expected = line_extension - (allowance_total or Decimal("0")) + (charge_total or Decimal("0"))
+            if tax_exclusive != expected:
+                rules.error("BR-CO-13", f"tax exclusive amount {tax_exclusive} is not {line_extension} - allowances + charges, {expected}")
+
+        tax_totals = root.findall(f"{CAC}TaxTotal")
+        if not tax_totals:
+            rules.error("BR-KSA-EN16931-08", "the invoice has no tax total")
+            return
+        tax_amount = None
+        for tax_total in tax_totals:
+            amount = rules.amount(tax_total, f"{CBC}TaxAmount", "BR-CO-14")
+            subtotals = tax_total.findall(f"{CAC}TaxSubtotal")
+            if subtotals and amount is not None:
+                subtotals_sum = sum((rules.amount(subtotal, f"{CBC}TaxAmount", "BR-46", required=False) or Decimal("0") for subtotal in subtotals), Decimal("0"))
+                if amount != subtotals_sum:
+                    rules.error("BR-CO-14", f"tax total {amount} is not the sum of the tax breakdown, {subtotals_sum}")
+            if tax_amount is None or subtotals:
+                tax_amount = amount
+        if tax_exclusive is not None and tax_inclusive is not None and tax_amount is not None and tax_inclusive != tax_exclusive + tax_amount:
+            rules.error("BR-CO-15", f"tax inclusive amount {tax_inclusive} is not {tax_exclusive} + {tax_amount}")
+        if tax_inclusive is not None and payable is not None:
+            expected = tax_inclusive - (prepaid or Decimal("0")) + (payable_rounding or Decimal("0"))
+            if payable != expected:
+                rules.error("BR-CO-16", f"payable amount {payable} is not the tax inclusive amount less prepaid plus rounding, {expected}")
+
+    @staticmethod
+    def sum_allowances(line: etree._Element, rules: Rules) -> Decimal:
+        """Line allowances less line charges, the price discount is already part of the price"""
+        total = Decimal("0")
+        for allowance in line.iterfind(f"{CAC}AllowanceCharge"):
+            amount = rules.amount(allowance, f"{CBC}Amount", "BR-41") or Decimal("0")
+            total += -amount if (allowance.findtext(f"{CBC}ChargeIndicator") or "").strip() == "true" else amount
+        return total
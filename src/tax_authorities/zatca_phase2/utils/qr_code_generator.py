@@ -7,9 +7,20 @@ from OpenSSL import crypto
 
 class qr_code_generator:
 
+    CBC = '{urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2}'
+    CAC = '{urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2}'
+    SUPPLIER_PARTY = f'.//{CAC}AccountingSupplierParty/{CAC}Party'
+    # Tags 1 to 9 all fit in a single byte, so they are encoded once here instead of on every invoice
+    TAGS = {tag: bytes([tag]) for tag in range(1, 10)}
+
     @staticmethod
-    def generate_qr_code(canonical_xml, invoice_hash, signature_value, ecdsa_result):
-        invoice_details = qr_code_generator.get_invoice_details(canonical_xml) #, invoice_hash, signature_value)
+    def generate_qr_code(canonical_xml, invoice_hash, signature_value, ecdsa_result, invoice_details=None):
+        """Returns the base64 QR code of a simplified invoice. Pass the invoice_details already read from the
+        invoice tree to skip parsing the canonical xml again."""
+        if invoice_details is None:
+            invoice_details = qr_code_generator.get_invoice_details(canonical_xml) #, invoice_hash, signature_value)
+        else:
+            invoice_details = list(invoice_details)
 
         # Retrieve the InvoiceTypeCode name (from position 8 in array)
         #invoice_type_code_name = invoice_details[8]
@@ -50,20 +61,62 @@ class qr_code_generator:
             #invoice_type_code_name
         ]
 
+    @staticmethod
+    def get_invoice_details_from_tree(xml):
+        """Same as get_invoice_details, but reads the fields from an lxml tree that is already in memory"""
+        cbc = qr_code_generator.CBC
+        cac = qr_code_generator.CAC
+        supplier_party = qr_code_generator.SUPPLIER_PARTY
+        supplier_name = xml.find(f'{supplier_party}/{cac}PartyLegalEntity/{cbc}RegistrationName').text
+        company_id = xml.find(f'{supplier_party}/{cac}PartyTaxScheme/{cbc}CompanyID').text
+        issue_date_time = xml.find(f'.//{cbc}IssueDate').text + 'T' + xml.find(f'.//{cbc}IssueTime').text
+        payable_amount = xml.find(f'.//{cac}LegalMonetaryTotal/{cbc}PayableAmount').text
+        tax_amount = xml.find(f'.//{cac}TaxTotal/{cbc}TaxAmount').text
+        return [None, supplier_name, company_id, issue_date_time, payable_amount, tax_amount]
+
+    @staticmethod
+    def get_invoice_details_from_data(invoice_data: dict):
+        """Reads the five seller and totals fields from the invoice data dictionary, as used for Phase 1 QR codes"""
+        return [
+            None,
+            str(invoice_data["supplier"]["registration_name"]),
+            str(invoice_data["supplier"]["vat_number"]),
+            f'{invoice_data["issue_date"]}T{invoice_data["issue_time"]}',
+            str(invoice_data["payable_amount"]),
+            str(invoice_data["tax_amount"]),
+        ]
+
+    @staticmethod
+    def generate_phase1_qr_code(invoice_data: dict):
+        """Returns the base64 QR code of a Phase 1 invoice, which carries the first five tags only"""
+        return qr_code_generator.generate_qr_code_from_values(qr_code_generator.get_invoice_details_from_data(invoice_data))
+
     @staticmethod
     def generate_qr_code_from_values(invoice_details):
-        data = b''  
+        values = []
+        size = 0
         for key, value in enumerate(invoice_details[1:], start=1):
+            if value is None:
+                raise ValueError("Please provide a value!")
             if isinstance(value, str):
                 value = value.encode('utf-8')
-            
-            tlv_data = qr_code_generator.write_tlv(key, value)
-            data += tlv_data
-            
+            tag = qr_code_generator.TAGS.get(key) or qr_code_generator.write_tag(key)
+            length = qr_code_generator.write_length(len(value))
+            values.append((tag, length, value))
+            size += len(tag) + len(length) + len(value)
+
          # Ensure to check if data is empty
-        if not data:
+        if not size:
             raise ValueError("No data generated for QR code!")
-        
+
+        # Every TLV is written once into a buffer of the final size
+        data = bytearray(size)
+        view = memoryview(data)
+        position = 0
+        for tag, length, value in values:
+            for part in (tag, length, value):
+                view[position:position + len(part)] = part
+                position += len(part)
         return base64.b64encode(data).decode()
 
     @staticmethod
@@ -99,6 +152,25 @@ class qr_code_generator:
         tlv += value
         return tlv
 
+    @staticmethod
+    def read_tlv(qr_code):
+        """Decodes a base64 QR code back into {tag: value}, the inverse of generate_qr_code_from_values"""
+        data = base64.b64decode(qr_code)
+        fields = {}
+        position = 0
+        while position < len(data):
+            tag = data[position]
+            length = data[position + 1]
+            position += 2
+            # Lengths above 0x7F are written as 0x80 | number of bytes, followed by the length itself
+            if length & 0x80:
+                size = length & 0x7F
+                length = int.from_bytes(data[position:position + size], "big")
+                position += size
+            fields[tag] = data[position:position + length]
+            position += length
+        return fields
+
     @staticmethod
     def get_public_key_and_signature(certificate_base64):
         try:
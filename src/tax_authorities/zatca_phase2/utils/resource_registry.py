@@ -0,0 +1,124 @@
+import copy
+import os
+import threading
+from lxml import etree
+from .template_binder import template_binder
+
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+class resource_registry:
+    """Process-wide cache of the xml templates and signing resources.
+
+    Every file is read and parsed once per process. Parsed templates are handed out as deep copies so callers
+    can modify them freely, the XSLT is compiled once per thread since compiled stylesheets must not be shared
+    between threads. Call reload() after editing any of the files during development.
+    """
+
+    TEMPLATES = {
+        "invoice": os.path.join(current_dir, "templates", "invoice.xml"),
+        "invoice_line": os.path.join(current_dir, "templates", "invoice_line.xml"),
+        "tax_subtotal": os.path.join(current_dir, "templates", "tax_subtotal.xml"),
+        "supplier_customer": os.path.join(current_dir, "templates", "supplier_customer.xml"),
+        "allowance_charge": os.path.join(current_dir, "templates", "allowance_charge.xml"),
+    }
+    XSL_FILE = os.path.join(current_dir, "resources", "xslfile.xsl")
+    UBL_TEMPLATE = os.path.join(current_dir, "resources", "zatca_ubl.xml")
+    SIGNATURE_TEMPLATE = os.path.join(current_dir, "resources", "zatca_signature.xml")
+    # Not bundled, copy the xsd folder of the UBL 2.1 distribution to resources/ubl to validate against it
+    UBL_INVOICE_SCHEMA = os.path.join(current_dir, "resources", "ubl", "maindoc", "UBL-Invoice-2.1.xsd")
+
+    _lock = threading.Lock()
+    _local = threading.local()
+    _generation = 0
+    _trees: dict[str, etree._ElementTree] | None = None
+    _xsl: etree._ElementTree | None = None
+    _strings: dict[str, str] | None = None
+    _binders: dict[str, template_binder] = {}
+    _schema: etree.XMLSchema | None = None
+    _schema_loaded = False
+
+    @staticmethod
+    def _load(force: bool = False) -> None:
+        """Read and parse all resources, then swap them in at once so readers never see a partial state"""
+        with resource_registry._lock:
+            if resource_registry._trees is not None and not force:
+                return
+            trees = {name: etree.parse(path) for name, path in resource_registry.TEMPLATES.items()}
+            xsl = etree.parse(resource_registry.XSL_FILE)
+            strings = {}
+            for name, path in (("ubl", resource_registry.UBL_TEMPLATE), ("signature", resource_registry.SIGNATURE_TEMPLATE)):
+                with open(path, 'r') as f:
+                    strings[name] = f.read()
+            resource_registry._xsl = xsl
+            resource_registry._strings = strings
+            resource_registry._trees = trees
+            resource_registry._binders = {}
+            resource_registry._generation += 1
+
+    @staticmethod
+    def reload() -> None:
+        """Read every resource from disk again. Meant for development, after editing a template."""
+        resource_registry._load(force=True)
+        with resource_registry._lock:
+            resource_registry._schema = None
+            resource_registry._schema_loaded = False
+
+    @staticmethod
+    def get_template_tree(name: str) -> etree._ElementTree:
+        """Returns a private copy of a parsed template document"""
+        if resource_registry._trees is None:
+            resource_registry._load()
+        return copy.deepcopy(resource_registry._trees[name])
+
+    @staticmethod
+    def get_template(name: str) -> etree._Element:
+        """Returns a private copy of the root element of a parsed template"""
+        return resource_registry.get_template_tree(name).getroot()
+
+    @staticmethod
+    def get_binder(name: str) -> template_binder:
+        """Returns the placeholder map of a template, compiled on first use"""
+        if resource_registry._trees is None:
+            resource_registry._load()
+        binders = resource_registry._binders
+        binder = binders.get(name)
+        if binder is None:
+            binder = template_binder(resource_registry._trees[name].getroot())
+            binders[name] = binder
+        return binder
+
+    @staticmethod
+    def get_xslt() -> etree.XSLT:
+        """Returns the compiled XSLT used to strip the signature related tags before hashing"""
+        if resource_registry._xsl is None:
+            resource_registry._load()
+        local = resource_registry._local
+        if getattr(local, "generation", None) != resource_registry._generation or getattr(local, "xslt", None) is None:
+            local.xslt = etree.XSLT(resource_registry._xsl)
+            local.generation = resource_registry._generation
+        return local.xslt
+
+    @staticmethod
+    def get_invoice_schema() -> etree.XMLSchema | None:
+        """Returns the UBL 2.1 invoice schema, compiled once per process on first use. Compiling it reads the
+        whole UBL library and takes a while, so it is never done per invoice. None when it is not installed."""
+        if not resource_registry._schema_loaded:
+            with resource_registry._lock:
+                if not resource_registry._schema_loaded:
+                    if os.path.exists(resource_registry.UBL_INVOICE_SCHEMA):
+                        resource_registry._schema = etree.XMLSchema(etree.parse(resource_registry.UBL_INVOICE_SCHEMA))
+                    resource_registry._schema_loaded = True
+        return resource_registry._schema
+
+    @staticmethod
+    def get_ubl_template() -> str:
+        if resource_registry._strings is None:
+            resource_registry._load()
+        return resource_registry._strings["ubl"]
+
+    @staticmethod
+    def get_signature_template() -> str:
+        if resource_registry._strings is None:
+            resource_registry._load()
+        return resource_registry._strings["signature"]
@@ -0,0 +1,201 @@
+from decimal import Decimal
+from enum import Enum
+from typing import Iterator
+from src.core.utils.math_helper import round_decimal
+
+
+def to_text(value) -> str | None:
+    """Formats a value the way it is written into the XML, enums by their value and everything else with str()"""
+    if value is None:
+        return None
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+class SignableDocument:
+    """Base of the signable parts of an invoice, every value is already formatted as it goes into the XML.
+
+    The parts are read like the dictionaries the XML builder also accepts: document["key"] returns a value,
+    "key" in document is False for a value that was never set, and dict(document) copies the values that are.
+    Values that are None are not set at all, so their tags are cleared from the invoice.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            if value is not None:
+                setattr(self, name, value)
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value) -> None:
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__ and hasattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self) -> Iterator[str]:
+        return (name for name in self.__slots__ if hasattr(self, name))
+
+
+class SignableParty(SignableDocument):
+    """A supplier or customer"""
+
+    __slots__ = (
+        "registration_name",
+        "vat_number",
+        "street",
+        "building_number",
+        "division",
+        "city",
+        "postal_code",
+        "country_code",
+        "party_identification_scheme",
+        "party_identification_value",
+    )
+
+    @staticmethod
+    def from_model(party) -> "SignableParty":
+        """Builds the party from the branch tax authority data or a customer, missing fields are left unset"""
+        return SignableParty(**{name: to_text(getattr(party, name, None)) for name in SignableParty.__slots__})
+
+
+class SignableLine(SignableDocument):
+    """An invoice line, the item name and unit code are flattened into the line"""
+
+    __slots__ = (
+        "id",
+        "item_name",
+        "item_unit_code",
+        "quantity",
+        "price_discount",
+        "discount_amount",
+        "line_extension_amount",
+        "tax_amount",
+        "tax_rate",
+        "classified_tax_category",
+        "rounding_amount",
+        "item_price_before_discount",
+        "item_price_after_discount",
+    )
+
+    @staticmethod
+    def from_sale_invoice_line(line) -> "SignableLine":
+        """Builds the line from a SaleInvoiceLineOut"""
+        item = line.item
+        return SignableLine(
+            id=to_text(line.id),
+            item_name=to_text(item.name) if item is not None else None,
+            item_unit_code=to_text(item.unit_code) if item is not None else None,
+            quantity=to_text(line.quantity),
+            price_discount=to_text(line.price_discount),
+            discount_amount=to_text(line.discount_amount),
+            line_extension_amount=to_text(line.line_extension_amount),
+            tax_amount=to_text(line.tax_amount),
+            tax_rate=to_text(line.tax_rate),
+            classified_tax_category=to_text(line.classified_tax_category),
+            rounding_amount=to_text(line.rounding_amount),
+            item_price_before_discount=to_text(line.item_price),
+            item_price_after_discount=to_text(round_decimal(line.item_price - line.price_discount, 2)),
+        )
+
+
+class SignableTaxCategory(SignableDocument):
+    """The totals of one tax category, written as a tax subtotal and used by the document level discount"""
+
+    __slots__ = (
+        "classified_tax_category",
+        "taxable_amount",
+        "tax_amount",
+        "tax_rate",
+        "tax_exemption_reason_code",
+        "tax_exemption_reason",
+    )
+
+    @staticmethod
+    def from_totals(classified_tax_category, taxable_amount: Decimal, tax_amount: Decimal, tax_rate: Decimal,
+                    tax_exemption_reason_code=None, tax_exemption_reason=None) -> "SignableTaxCategory":
+        return SignableTaxCategory(
+            classified_tax_category=to_text(classified_tax_category),
+            taxable_amount=to_text(taxable_amount),
+            tax_amount=to_text(tax_amount),
+            tax_rate=to_text(tax_rate),
+            tax_exemption_reason_code=to_text(tax_exemption_reason_code),
+            tax_exemption_reason=to_text(tax_exemption_reason),
+        )
+
+
+class SignableInvoice(SignableDocument):
+    """Everything the XML builder needs to generate an invoice, and nothing else"""
+
+    __slots__ = (
+        "invoice_type",
+        "invoice_type_code",
+        "invoice_number",
+        "uuid",
+        "issue_date",
+        "issue_time",
+        "document_currency_code",
+        "actual_delivery_date",
+        "payment_means_code",
+        "note",
+        "original_invoice_number",
+        "instruction_note",
+        "discount_amount",
+        "line_extension_amount",
+        "taxable_amount",
+        "tax_amount",
+        "tax_inclusive_amount",
+        "payable_amount",
+        "pih",
+        "icv",
+        "has_total_discount",
+        "supplier",
+        "supplier_cache_key",
+        "customer",
+        "invoice_lines",
+        "tax_categories",
+    )
+
+    @staticmethod
+    def from_sale_invoice(invoice, supplier: SignableParty, pih: str, icv: int, has_total_discount: bool,
+                          tax_categories: dict[str, SignableTaxCategory], supplier_cache_key: tuple | None = None) -> "SignableInvoice":
+        """Builds the invoice from a SaleInvoiceOut, the supplier and the totals per tax category. The supplier party
+        is reused across invoices with the same supplier_cache_key, the (branch id, stage) of the supplier."""
+        return SignableInvoice(
+            invoice_type=to_text(invoice.invoice_type),
+            invoice_type_code=to_text(invoice.invoice_type_code),
+            invoice_number=to_text(invoice.invoice_number),
+            uuid=to_text(invoice.uuid),
+            issue_date=to_text(invoice.issue_date),
+            issue_time=to_text(invoice.issue_time),
+            document_currency_code=to_text(invoice.document_currency_code),
+            actual_delivery_date=to_text(invoice.actual_delivery_date),
+            payment_means_code=to_text(invoice.payment_means_code),
+            note=to_text(invoice.note),
+            original_invoice_number=to_text(invoice.original_invoice_number),
+            instruction_note=to_text(invoice.instruction_note),
+            discount_amount=to_text(invoice.discount_amount),
+            line_extension_amount=to_text(invoice.line_extension_amount),
+            taxable_amount=to_text(invoice.taxable_amount),
+            tax_amount=to_text(invoice.tax_amount),
+            tax_inclusive_amount=to_text(invoice.tax_inclusive_amount),
+            payable_amount=to_text(invoice.payable_amount),
+            pih=pih,
+            icv=to_text(icv),
+            has_total_discount=has_total_discount,
+            supplier=supplier,
+            supplier_cache_key=supplier_cache_key,
+            customer=SignableParty.from_model(invoice.customer) if invoice.customer is not None else None,
+            invoice_lines=[SignableLine.from_sale_invoice_line(line) for line in invoice.invoice_lines],
+            tax_categories=tax_categories,
+        )
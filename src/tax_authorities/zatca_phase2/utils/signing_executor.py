@@ -0,0 +1,141 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from .resource_registry import resource_registry
+
+
+def _warm_worker() -> None:
+    """Runs once in every worker so the first invoice does not pay for parsing the templates, the XSLT and the schema"""
+    resource_registry.get_binder("invoice")
+    resource_registry.get_xslt()
+    resource_registry.get_invoice_schema()
+
+
+def _started() -> None:
+    """Does nothing, submitted once per worker to bring the workers up"""
+
+
+def _timed_call(fn, args: tuple) -> tuple[object, float]:
+    """Runs fn inside the worker and returns its result together with the time spent running it"""
+    started_at = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started_at
+
+
+class signing_executor:
+    """Runs the CPU bound signing work away from the event loop.
+
+    The mode is one of inline (on the calling thread, blocks the loop), thread (a thread pool, lxml and the
+    crypto calls release the GIL for most of their work) or process (a pool of warm worker processes). Work
+    sent to the process pool must be picklable, signing material is sent as the raw CSID and rebuilt once per
+    worker from that worker's own cache.
+    """
+
+    INLINE = "inline"
+    THREAD = "thread"
+    PROCESS = "process"
+    MODES = (INLINE, THREAD, PROCESS)
+
+    _lock = threading.Lock()
+    _mode: str = THREAD
+    _workers: int = 2
+    _pool: Executor | None = None
+    _metrics: dict[str, float] = {
+        "submitted": 0,
+        "completed": 0,
+        "failed": 0,
+        "queue_depth": 0,
+        "max_queue_depth": 0,
+        "total_latency": 0.0,
+        "max_latency": 0.0,
+        "total_run_time": 0.0,
+    }
+
+    @staticmethod
+    def configure(mode: str = THREAD, workers: int = 2) -> None:
+        """Selects the executor. Any running pool is shut down and replaced on the next submission."""
+        if mode not in signing_executor.MODES:
+            raise ValueError(f"Unknown signing executor mode '{mode}', expected one of {signing_executor.MODES}")
+        if workers < 1:
+            raise ValueError("The signing executor needs at least one worker")
+        signing_executor.shutdown()
+        with signing_executor._lock:
+            signing_executor._mode = mode
+            signing_executor._workers = workers
+
+    @staticmethod
+    def start() -> Executor | None:
+        """Creates the pool and warms every worker, returns the pool or None inline. Called on startup, otherwise on
+        the first submission."""
+        with signing_executor._lock:
+            if signing_executor._pool is not None or signing_executor._mode == signing_executor.INLINE:
+                return signing_executor._pool
+            workers = signing_executor._workers
+            if signing_executor._mode == signing_executor.PROCESS:
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_warm_worker)
+            else:
+                pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="signing", initializer=_warm_worker)
+            # Workers are started lazily by the pools and warmed by the initializer, one empty task per worker brings
+            # them up before the first invoice
+            for future in [pool.submit(_started) for _ in range(workers)]:
+                future.result()
+            signing_executor._pool = pool
+            return pool
+
+    @staticmethod
+    def shutdown() -> None:
+        """Waits for the running signatures to finish and releases the workers"""
+        with signing_executor._lock:
+            pool = signing_executor._pool
+            signing_executor._pool = None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    @staticmethod
+    async def run(fn, *args):
+        """Runs fn(*args) on the configured executor and returns its result"""
+        metrics = signing_executor._metrics
+        submitted_at = time.perf_counter()
+        metrics["submitted"] += 1
+        metrics["queue_depth"] += 1
+        metrics["max_queue_depth"] = max(metrics["max_queue_depth"], metrics["queue_depth"])
+        try:
+            pool = None
+            if signing_executor._mode != signing_executor.INLINE:
+                pool = signing_executor._pool or await asyncio.to_thread(signing_executor.start)
+            if pool is None:
+                # Inline, or switched to inline by configure() while the pool was starting
+                result, run_time = _timed_call(fn, args)
+            else:
+                loop = asyncio.get_running_loop()
+                result, run_time = await loop.run_in_executor(pool, _timed_call, fn, args)
+        except Exception:
+            metrics["failed"] += 1
+            raise
+        finally:
+            metrics["queue_depth"] -= 1
+        latency = time.perf_counter() - submitted_at
+        metrics["completed"] += 1
+        metrics["total_latency"] += latency
+        metrics["total_run_time"] += run_time
+        metrics["max_latency"] = max(metrics["max_latency"], latency)
+        return result
+
+    @staticmethod
+    def get_metrics() -> dict[str, float | str]:
+        """Returns the counters of the executor, latency is measured from submission and includes the queue wait"""
+        metrics = dict(signing_executor._metrics)
+        completed = metrics["completed"] or 1
+        metrics["mode"] = signing_executor._mode
+        metrics["workers"] = signing_executor._workers
+        metrics["average_latency"] = metrics["total_latency"] / completed
+        metrics["average_run_time"] = metrics["total_run_time"] / completed
+        metrics["average_wait_time"] = metrics["average_latency"] - metrics["average_run_time"]
+        return metrics
+
+    @staticmethod
+    def reset_metrics() -> None:
+        for name in signing_executor._metrics:
+            signing_executor._metrics[name] = 0
@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from .einvoice_signer import einvoice_signer
+
+
+class SigningMaterial:
+    """Everything the signer derives from a CSID, parsed once and reused for every invoice signed with it.
+
+    Pickling only carries the raw certificate and private key, the other side resolves them through its own
+    cache, so a worker process parses the material of a CSID once and reuses it for every invoice it signs.
+    """
+
+    __slots__ = (
+        "csid_id",
+        "fingerprint",
+        "certificate_content",
+        "private_key_content",
+        "private_key",
+        "certificate",
+        "issuer_name",
+        "serial_number",
+        "public_key_hashing",
+        "public_key_der",
+        "certificate_signature",
+    )
+
+    def __init__(self, certificate_content: str, private_key_content: str, csid_id: int | None = None):
+        self.csid_id = csid_id
+        self.fingerprint = SigningMaterial.get_fingerprint(certificate_content, private_key_content)
+        self.certificate_content = certificate_content
+        self.private_key_content = private_key_content
+        self.private_key = einvoice_signer.load_private_key(private_key_content)
+        pem_certificate = einvoice_signer.wrap_certificate(certificate_content)
+        self.certificate = x509.load_pem_x509_certificate(pem_certificate.encode(), default_backend())
+        self.issuer_name = einvoice_signer.get_issuer_name(self.certificate)
+        self.serial_number = self.certificate.serial_number
+        self.public_key_hashing = einvoice_signer.generate_public_key_hashing(certificate_content)
+        ecdsa_result = einvoice_signer.get_public_key_and_signature(certificate_content, self.certificate)
+        self.public_key_der: bytes = ecdsa_result["public_key"]
+        self.certificate_signature: bytes = ecdsa_result["signature"]
+
+    def __reduce__(self):
+        return (signing_material_cache.get, (self.csid_id, self.certificate_content, self.private_key_content))
+
+    @property
+    def ecdsa_result(self) -> dict[str, bytes]:
+        """The public key and certificate signature in the shape the QR code generator expects"""
+        return {"public_key": self.public_key_der, "signature": self.certificate_signature}
+
+    @staticmethod
+    def get_fingerprint(certificate_content: str, private_key_content: str) -> str:
+        """Returns a digest that changes whenever the certificate or the key of a CSID is renewed"""
+        digest = hashlib.sha256(certificate_content.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(private_key_content.encode('utf-8'))
+        return digest.hexdigest()
+
+
+class signing_material_cache:
+    """Process-wide cache of signing material, keyed by CSID id and checked against the certificate fingerprint.
+
+    A renewed CSID comes with a new certificate, so its fingerprint no longer matches and the material is
+    rebuilt on the next lookup without any explicit invalidation.
+    """
+
+    MAX_SIZE = 1024
+
+    _lock = threading.Lock()
+    _entries: "OrderedDict[int | str, SigningMaterial]" = OrderedDict()
+
+    @staticmethod
+    def get(csid_id: int | None, certificate_content: str, private_key_content: str) -> SigningMaterial:
+        """Returns the cached material of the CSID, building it on first use or after a renewal"""
+        fingerprint = SigningMaterial.get_fingerprint(certificate_content, private_key_content)
+        key = csid_id if csid_id is not None else fingerprint
+        entries = signing_material_cache._entries
+        with signing_material_cache._lock:
+            material = entries.get(key)
+            if material is not None and material.fingerprint == fingerprint:
+                entries.move_to_end(key)
+                return material
+        material = SigningMaterial(certificate_content, private_key_content, csid_id)
+        with signing_material_cache._lock:
+            entries[key] = material
+            entries.move_to_end(key)
+            while len(entries) > signing_material_cache.MAX_SIZE:
+                entries.popitem(last=False)
+        return material
+
+    @staticmethod
+    def invalidate(csid_id: int | None = None) -> None:
+        """Drops the material of one CSID, or of all of them when no id is given"""
+        with signing_material_cache._lock:
+            if csid_id is None:
+                signing_material_cache._entries.clear()
+            else:
+                signing_material_cache._entries.pop(csid_id, None)
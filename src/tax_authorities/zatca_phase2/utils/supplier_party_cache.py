@@ -0,0 +1,63 @@
+import copy
+import threading
+from collections import OrderedDict
+from typing import Callable
+from lxml import etree
+from .resource_registry import resource_registry
+from .signable_invoice import SignableParty
+
+
+class supplier_party_cache:
+    """Process-wide cache of the supplier party of every branch, already filled and cleared as it goes into the XML.
+
+    The supplier of a branch only changes when its tax authority data is updated, so its party is built once per
+    (branch, stage) and handed out as a copy to every invoice. Each entry remembers the supplier values it was
+    built from, the data version, and is rebuilt when they differ, so a worker process that missed an
+    invalidation still never uses a stale party. Reloading the templates also rebuilds every entry.
+    """
+
+    MAX_SIZE = 4096
+
+    _lock = threading.Lock()
+    # (branch id, stage, normalize) -> (data version, party or None when nothing was left after clearing)
+    _entries: "OrderedDict[tuple, tuple[tuple, etree._Element | None]]" = OrderedDict()
+
+    @staticmethod
+    def get_version(party) -> tuple:
+        """The data version of a supplier, every value that goes into its party and the version of the templates"""
+        return (resource_registry._generation, tuple(party.get(name) for name in SignableParty.__slots__))
+
+    @staticmethod
+    def get(cache_key: tuple | None, party, normalize: bool, build: Callable[[object, bool], etree._Element | None]) -> etree._Element | None:
+        """Returns a copy of the party built by build(party, normalize), built once per cache_key and data version.
+        Without a cache_key the party is built every time."""
+        if cache_key is None:
+            return build(party, normalize)
+        key = (*cache_key, normalize)
+        version = supplier_party_cache.get_version(party)
+        entries = supplier_party_cache._entries
+        with supplier_party_cache._lock:
+            entry = entries.get(key)
+            if entry is not None and entry[0] == version:
+                entries.move_to_end(key)
+                element = entry[1]
+                return copy.deepcopy(element) if element is not None else None
+        element = build(party, normalize)
+        with supplier_party_cache._lock:
+            entries[key] = (version, element)
+            entries.move_to_end(key)
+            while len(entries) > supplier_party_cache.MAX_SIZE:
+                entries.popitem(last=False)
+        return copy.deepcopy(element) if element is not None else None
+
+    @staticmethod
+    def invalidate(branch_id: int, stage: str | None = None) -> None:
+        """Drops the cached parties of a branch, of every stage unless one is given"""
+        with supplier_party_cache._lock:
+            for key in [key for key in supplier_party_cache._entries if key[0] == branch_id and (stage is None or key[1] == stage)]:
+                del supplier_party_cache._entries[key]
+
+    @staticmethod
+    def clear() -> None:
+        with supplier_party_cache._lock:
+            supplier_party_cache._entries.clear()
@@ -50,7 +50,7 @@ invoice_data_template = {
         "default_buy_price": "10.15",
         "unit_code": "PCE",
       },
-      "id": 1,
+      "id": "1",
       "item_price": "10",
       "quantity": "1",
       "price_discount": "0",
@@ -1,11 +1,15 @@
-import base64
 from lxml import etree 
 import uuid
-import json
 import xml.dom.minidom as minidom
 import os
 from pathlib import Path
 from .einvoice_signer import einvoice_signer
+from .invoice_extractor import invoice_extractor
+from .resource_registry import resource_registry
+from .signable_invoice import SignableLine
+from .signing_material import SigningMaterial
+from .supplier_party_cache import supplier_party_cache
+from .template_binder import template_binder
 
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,17 +22,18 @@ class xml_generator:
         'cbc': "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
         'cac': "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
     }
+    CBC_PREFIX = f'{{{namespaces['cbc']}}}'
+    CUSTOMER_PARTY_TAG = f'{{{namespaces['cac']}}}AccountingCustomerParty'
+    SUPPLIER_PARTY_TAG = f'{{{namespaces['cac']}}}AccountingSupplierParty'
 
 
     @staticmethod
-    def sign_and_get_request(invoice_data, private_key, x509_certificate_content) -> dict[str, str]:
+    def sign_and_get_request(invoice_data, signing_material: SigningMaterial, signature_timestamp: str | None = None) -> dict[str, str]:
         """Signs the invoice and returns the invoice request as a dictionary containing {invoice_hash, uuid, invoice}"""
-        xml_string = xml_generator.generate_xml_invoice(invoice_data)
-        base_document = etree.fromstring(xml_string)
+        base_document = xml_generator.generate_xml_invoice_tree(invoice_data)
         # Sign the invoice, and return the invoice request {invoice_hash, uuid, invoice} 
-        invoice_request_json = einvoice_signer.get_request_api(base_document, x509_certificate_content, private_key)
-        invoice_request_dict: dict = json.loads(invoice_request_json)
-        return invoice_request_dict
+        signed_invoice = einvoice_signer.get_request_api(base_document, signing_material, signature_timestamp)
+        return signed_invoice.to_request()
         
 
     @staticmethod
@@ -84,56 +89,109 @@ class xml_generator:
 
 
     @staticmethod
-    def add_supplier_or_customer(root, data: dict, type: str):
-        
-        # Read supplier/customer info xml template file
-        info_xml_root = etree.parse(os.path.abspath(os.path.join(current_dir, "templates", "supplier_customer.xml"))).getroot()
+    def normalize_text(text: str) -> str:
+        """The value a text ends up with after the legacy whitespace stripping and minidom round trip"""
+        text = text.replace('\n', '').replace('\t', '').replace('    ', '')
+        return text.replace('\r\n', '\n').replace('\r', '\n')
 
-        # Set PartyIdentification
-        element = info_xml_root.xpath(".//*[text()='{{party_identification_value}}']", namespaces=xml_generator.namespaces)[0]
-        element.set("schemeID", data["party_identification_scheme"])
+    @staticmethod
+    def normalize_attribute(value: str) -> str:
+        """Same as normalize_text for attribute values, where tabs and newlines were escaped and then normalized to spaces by the parser"""
+        value = value.replace('    ', '').replace('\r\n', '\n')
+        return value.replace('\r', ' ').replace('\n', ' ').replace('\t', ' ')
 
-        # Update supplier/customer info
-        for key, value in data.items():
-            placeholder = f"{{{{{key}}}}}"  # e.g., "{{IssueDate}}"
-            elements = info_xml_root.xpath(f".//*[text()='{placeholder}']", namespaces=xml_generator.namespaces)
-            for elem in elements:
-                elem.text = value  # Replace with the value from the JSON
+    @staticmethod
+    def fill_and_clear_tags(node, values: dict, currency_id: str, normalize: bool = False):
+        """Fill the placeholders left in the tree from values, set every currencyID and clear empty tags in one pass.
+        Removes exactly the tags clear_empty_tags would remove once the placeholders are filled.
+        With normalize, the kept values are normalized the way the legacy pretty printing did it."""
+        key = template_binder.placeholder_key(node.text)
+        if key is not None and key in values:
+            node.text = values[key]
+        if 'currencyID' in node.attrib:
+            node.attrib['currencyID'] = currency_id
+        if normalize:
+            for name, value in node.attrib.items():
+                node.attrib[name] = xml_generator.normalize_attribute(value)
+        # If a tag has cbc namespace, then it contains data
+        if node.tag.startswith(xml_generator.CBC_PREFIX):
+            if node.text is None or node.text[:2] == '{{' or node.text.strip() == "":
+                node.getparent().remove(node)
+            elif normalize:
+                node.text = xml_generator.normalize_text(node.text)
+            return
+        # The supplier party is added already filled and cleared, see add_supplier
+        if node.tag == xml_generator.SUPPLIER_PARTY_TAG:
+            return
+        # If a tag has cac namespace, then it may have child tags
+        for child in node:
+            xml_generator.fill_and_clear_tags(child, values, currency_id, normalize)
+
+        # Don't remove customer party even it was empty because it is required for allowance and other tags
+        if node.tag == xml_generator.CUSTOMER_PARTY_TAG:
+            return
+
+        if len(node) == 0 and (node.text is None or node.text.strip() == ""):
+            node.getparent().remove(node)
+
+
+    @staticmethod
+    def add_supplier_or_customer(root, data: dict, type: str):
+        
+        # Fill a copy of the supplier/customer info template, PartyIdentification gets its schemeID attribute
+        info_xml_root = resource_registry.get_binder("supplier_customer").bind(
+            data,
+            {"party_identification_scheme": data["party_identification_scheme"]},
+        )
 
         # Add the supplier/customer info into the AccountingSupplierParty/AccountingCustomerParty tag
         if type == "supplier":
-            target = './/cac:AccountingSupplierParty'
+            target = 'cac:AccountingSupplierParty'
         else:
-            target = './/cac:AccountingCustomerParty'
+            target = 'cac:AccountingCustomerParty'
         
-        xml_generator.insert_tag_inside(root, info_xml_root, target)
+        root.find(target, namespaces=xml_generator.namespaces).append(info_xml_root)
+
+
+    @staticmethod
+    def build_supplier_party(data, normalize: bool = False) -> etree._Element | None:
+        """Returns the filled and cleared party of a supplier, None if none of its tags is left"""
+        party = resource_registry.get_binder("supplier_customer").bind(
+            data,
+            {"party_identification_scheme": data["party_identification_scheme"]},
+        )
+        # The party is cleared under a placeholder parent, which it leaves if nothing in it is kept
+        holder = etree.Element("holder")
+        holder.append(party)
+        xml_generator.fill_and_clear_tags(party, {}, "", normalize)
+        return holder[0] if len(holder) else None
 
+    @staticmethod
+    def add_supplier(root, invoice_data, normalize: bool = False):
+        """Adds the supplier party, reused from supplier_party_cache when the invoice has a supplier_cache_key"""
+        party = supplier_party_cache.get(invoice_data.get("supplier_cache_key"), invoice_data["supplier"], normalize, xml_generator.build_supplier_party)
+        target = root.find('cac:AccountingSupplierParty', namespaces=xml_generator.namespaces)
+        if party is None:
+            root.remove(target)
+        else:
+            target.append(party)
 
     @staticmethod
     def add_invoice_line(invoice_line, root):
         
-        # Read invoice line xml template file
-        invoice_line_root = etree.parse(os.path.abspath(os.path.join(current_dir, "templates", "invoice_line.xml"))).getroot()
-        
-        # Add invoiced quantity
-        element = invoice_line_root.xpath(".//*[text()='{{quantity}}']", namespaces=xml_generator.namespaces)[0]
-        element.set("unitCode", invoice_line["item"]["unit_code"])
-        element.text = invoice_line["quantity"]
-
-        # Add item name
-        element = invoice_line_root.xpath(".//*[text()='{{item_name}}']", namespaces=xml_generator.namespaces)[0]
-        element.text = invoice_line["item"]["name"]
-
-        # Add item price before discount
-        element = invoice_line_root.xpath(".//*[text()='{{item_price_before_discount}}']", namespaces=xml_generator.namespaces)[0]
-        element.text = invoice_line["item_price_before_discount"]
-
-        # Replace placeholders with actual invoice line values
-        for key, value in invoice_line.items():
-            placeholder = f"{{{{{key}}}}}"  # e.g., "{{IssueDate}}"
-            elements = invoice_line_root.xpath(f".//*[text()='{placeholder}']", namespaces=xml_generator.namespaces)
-            for elem in elements:
-                elem.text = value  # Replace with the value from the JSON
+        # A SignableLine already carries the item name and unit code, a dictionary has them in a nested item
+        if isinstance(invoice_line, SignableLine):
+            values = invoice_line
+            unit_code = invoice_line["item_unit_code"]
+        else:
+            values = dict(invoice_line)
+            values["item_name"] = invoice_line["item"]["name"]
+            unit_code = invoice_line["item"]["unit_code"]
+        # Quantity gets its unit code
+        invoice_line_root = resource_registry.get_binder("invoice_line").bind(
+            values,
+            {"item_unit_code": unit_code},
+        )
 
         # Append invoice line to the invoice
         root.append(invoice_line_root)
@@ -143,62 +201,59 @@ class xml_generator:
         """Add the tax subtotals template for each tax category in the second TaxTotal element"""
 
         tax_categories = invoice_data["tax_categories"]
-        tax_total_element = root.xpath('.//cac:TaxTotal', namespaces=xml_generator.namespaces)[1]
+        tax_total_element = root.findall('cac:TaxTotal', namespaces=xml_generator.namespaces)[1]
+        binder = resource_registry.get_binder("tax_subtotal")
         
         for cat, vals in tax_categories.items():
-            tax_subtotal_xml_template = etree.parse(os.path.abspath(os.path.join(current_dir, "templates", "tax_subtotal.xml"))).getroot()
-            for key, value in vals.items():
-                placeholder = f"{{{{{key}}}}}"  # e.g., "{{IssueDate}}"
-                elements = tax_subtotal_xml_template.xpath(f".//*[text()='{placeholder}']", namespaces=xml_generator.namespaces)
-                for elem in elements:
-                    elem.text = value  # Replace with the value from the JSON
-            tax_total_element.append(tax_subtotal_xml_template)
+            tax_total_element.append(binder.bind(vals))
 
     @staticmethod
     def add_allowance_charge(root, invoice_data: dict):
         """Add details about tax categories in the AllowanceCharge element"""
 
-        allowance_xml_root = root.xpath('.//cac:AllowanceCharge', namespaces=xml_generator.namespaces)[0]
+        allowance_xml_root = root.find('cac:AllowanceCharge', namespaces=xml_generator.namespaces)
         tax_categories = invoice_data["tax_categories"]
         
         if invoice_data["has_total_discount"] == True:
             for cat, vals in tax_categories.items():
-                for key, value in vals.items():
-                    placeholder = f"{{{{{key}}}}}"  # e.g., "{{IssueDate}}"
-                    elements = allowance_xml_root.xpath(f".//*[text()='{placeholder}']", namespaces=xml_generator.namespaces)
-                    for elem in elements:
-                        elem.text = value  # Replace with the value from the JSON
+                for elem in allowance_xml_root.iter():
+                    key = template_binder.placeholder_key(elem.text)
+                    if key is not None and key in vals:
+                        elem.text = vals[key]  # Replace with the value from the JSON
         else:
             root.remove(allowance_xml_root)
         
     @staticmethod
-    def generate_xml_invoice(invoice_data: dict):
-        """Generates the base xml invoice ready to be signed"""
+    def build_xml_invoice(invoice_data: dict, normalize: bool = False) -> etree._ElementTree:
+        """Builds the filled invoice tree, without any indentation"""
 
-        xml_template = etree.parse(os.path.abspath(os.path.join(current_dir, "templates", "invoice.xml")))
-        root = xml_template.getroot()
         # Change name attribute of InvoiceTypeCode tag
-        invoice_type_code = root.xpath(".//*[text()='{{invoice_type_code}}']", namespaces=xml_generator.namespaces)[0]
-        invoice_type_code.set('name', invoice_data['invoice_type'])
-        xml_generator.add_supplier_or_customer(root, invoice_data["supplier"], "supplier")
+        root = resource_registry.get_binder("invoice").bind({}, {"invoice_type": invoice_data['invoice_type']})
+        xml_template = etree.ElementTree(root)
+        xml_generator.add_supplier(root, invoice_data, normalize)
         if "customer" in invoice_data:
             xml_generator.add_supplier_or_customer(root, invoice_data["customer"], "customer")
-        for line in invoice_data["invoice_lines"]:
-            xml_generator.add_invoice_line(line, root)
         xml_generator.add_tax_subtotals(root, invoice_data)
         xml_generator.add_allowance_charge(root, invoice_data)
-        # Update general invoice data
-        for key, value in invoice_data.items():
-            placeholder = f"{{{{{key}}}}}"  # e.g., "{{IssueDate}}"
-            elements = root.xpath(f".//*[text()='{placeholder}']", namespaces=xml_generator.namespaces)
-            for elem in elements:
-                elem.text = value  # Replace with the value from the JSON
-        # Update all attributes named "currencyID"
-        for elem in root.iter():  # Iterate through all elements in the XML tree
-            if 'currencyID' in elem.attrib:
-                elem.attrib['currencyID'] = invoice_data["document_currency_code"]
-        # Clear empty tags that were not given in the json data
-        xml_generator.clear_empty_tags(root)
+        for line in invoice_data["invoice_lines"]:
+            xml_generator.add_invoice_line(line, root)
+        # Update general invoice data and all attributes named "currencyID", then clear empty tags that were not given in the json data
+        xml_generator.fill_and_clear_tags(root, invoice_data, invoice_data["document_currency_code"], normalize)
+        return xml_template
+
+    @staticmethod
+    def generate_xml_invoice_tree(invoice_data: dict) -> etree._Element:
+        """Generates the base xml invoice ready to be signed as an lxml element.
+        The tree is indented in place with tabs, which canonicalizes exactly like the string from generate_xml_invoice."""
+        root = xml_generator.build_xml_invoice(invoice_data, normalize=True).getroot()
+        etree.indent(root, space="\t")
+        return root
+
+    @staticmethod
+    def generate_xml_invoice(invoice_data: dict):
+        """Generates the base xml invoice ready to be signed as a pretty printed string. Kept as the reference output of generate_xml_invoice_tree."""
+
+        xml_template = xml_generator.build_xml_invoice(invoice_data)
         # Transform the XML to a string, remove all \n, \t and tabs (4 consecutive spaces) then use toprettyxml() to re-indent the resulting XML string
         xml_str = etree.tostring(xml_template, encoding="UTF-8")
         xml_str = xml_str.replace(b'\n', b'').replace(b'\t', b'').replace(b'    ', b'')
@@ -208,41 +263,33 @@ class xml_generator:
 
     @staticmethod
     def extract_invoice_hash(xml_input) -> str:
+        """Returns the invoice hash of a base64 invoice, raw xml bytes or an lxml element. Strings and bytes are
+        scanned by invoice_extractor instead of being parsed into a tree."""
         if isinstance(xml_input, str):
-            decoded_xml = base64.b64decode(xml_input)
-            if decoded_xml is None:
-                raise ValueError("Invalid Base64 string provided.")
-            xml_input = decoded_xml
-        elif not isinstance(xml_input, (bytes, etree._Element)):
+            return invoice_extractor.extract_invoice_hash(xml_input)
+        elif isinstance(xml_input, bytes):
+            return invoice_extractor.find_invoice_hash(xml_input)
+        elif not isinstance(xml_input, etree._Element):
             raise ValueError("Input must be a string or lxml.etree._Element.")
-        # Load XML into an lxml Element
-        if isinstance(xml_input, bytes):
-            doc = etree.fromstring(xml_input)
-        else:
-            doc = xml_input  # Assume it's already an lxml Element
         # Extract invoiceHash
-        invoice_hash_node = doc.xpath("//ds:Reference[@Id='invoiceSignedData']/ds:DigestValue", namespaces=xml_generator.namespaces)
+        invoice_hash_node = xml_input.xpath("//ds:Reference[@Id='invoiceSignedData']/ds:DigestValue", namespaces=xml_generator.namespaces)
         invoice_hash = invoice_hash_node[0].text if invoice_hash_node else None
         return invoice_hash
     
     
     @staticmethod
     def extract_base64_qr_code(invoice) -> str | None:
+        """Returns the QR code of a base64 invoice, raw xml bytes or an lxml element. Strings and bytes are
+        scanned by invoice_extractor instead of being parsed into a tree."""
         if isinstance(invoice, str):
-            decoded_xml = base64.b64decode(invoice)
-            if decoded_xml is None:
-                raise ValueError("Invalid Base64 string provided.")
-            invoice = decoded_xml
-        elif not isinstance(invoice, (bytes, etree._Element)):
+            return invoice_extractor.extract_qr_code(invoice)
+        elif isinstance(invoice, bytes):
+            return invoice_extractor.find_qr_code(invoice)
+        elif not isinstance(invoice, etree._Element):
             return None
             # raise ValueError("Input must be a string or lxml.etree._Element.")
-        # Load XML into an lxml Element
-        if isinstance(invoice, bytes):
-            doc = etree.fromstring(invoice)
-        else:
-            doc = invoice  # Assume it's already an lxml Element
         # Extract base64QRCode
-        base64_qr_code_node = doc.xpath("//cac:AdditionalDocumentReference[cbc:ID='QR']/cac:Attachment/cbc:EmbeddedDocumentBinaryObject", namespaces=xml_generator.namespaces)
+        base64_qr_code_node = invoice.xpath("//cac:AdditionalDocumentReference[cbc:ID='QR']/cac:Attachment/cbc:EmbeddedDocumentBinaryObject", namespaces=xml_generator.namespaces)
         base64_qr_code = base64_qr_code_node[0].text if base64_qr_code_node else None
         return base64_qr_code
 